@@ -0,0 +1,180 @@
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from metrics import ANSWER_CACHE_HITS, ANSWER_CACHE_MISSES
+
+ANSWER_CACHE_ENABLED = os.getenv('ANSWER_CACHE_ENABLED', '1') not in ('0', 'false', 'no')
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv('ANSWER_CACHE_MAX_ENTRIES', '1000'))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv('ANSWER_CACHE_TTL_SECONDS', '3600'))
+# Cosine similarity a new question's embedding needs to reuse a cached answer. Questions
+# that differ only in a year or amount embed very close together, so near-duplicate hits
+# also require the same numbers (see question_entities)
+ANSWER_CACHE_SIMILARITY = float(os.getenv('ANSWER_CACHE_SIMILARITY', '0.97'))
+# How often (seconds) callers should re-read the corpus version from the database
+ANSWER_CACHE_VERSION_CHECK_SECONDS = float(os.getenv('ANSWER_CACHE_VERSION_CHECK_SECONDS', '5'))
+
+
+NUMBER_PATTERN = re.compile(r"\d+(?:[.,]\d+)*%?")
+
+
+def normalize_question(question: str) -> str:
+    """Lowercase, drop punctuation and collapse whitespace for exact-match lookups"""
+    return " ".join(re.sub(r"[^\w%.$-]+", " ", question.lower()).split()).strip(" .")
+
+
+def question_entities(question: str) -> frozenset:
+    """Years, amounts and percentages in a question; a semantic hit must match them exactly"""
+    return frozenset(match.replace(',', '') for match in NUMBER_PATTERN.findall(question or ""))
+
+
+class AnswerCache:
+    """
+    In-process answer cache with two tiers:
+
+    1. exact match on the normalized question text
+    2. near-duplicate match when the question embedding's cosine similarity to
+       a cached question is at least `similarity_threshold` and both questions
+       mention the same numbers ("revenue in 2023" never answers "revenue in 2024")
+
+    Every entry records the corpus version it was answered against. Callers
+    report the current version through `observe_version()`; when it changes
+    (a document was ingested) the whole cache is dropped. Entries also expire
+    after `ttl_seconds` and the least recently used are evicted past `max_entries`.
+    """
+
+    def __init__(self,
+                 max_entries: int = ANSWER_CACHE_MAX_ENTRIES,
+                 ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+                 similarity_threshold: float = ANSWER_CACHE_SIMILARITY,
+                 version_check_seconds: float = ANSWER_CACHE_VERSION_CHECK_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self.version_check_seconds = version_check_seconds
+
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._matrix = None  # stacked unit-length question embeddings, rebuilt lazily
+        self._matrix_keys: List[str] = []
+        self._lock = threading.Lock()
+
+        self.corpus_version = None
+        self._version_checked_at = 0.0
+
+        self.stats = {
+            'exact_hits': 0,
+            'semantic_hits': 0,
+            'misses': 0,
+            'evictions': 0,
+            'expirations': 0,
+            'invalidations': 0,
+        }
+
+    # --- corpus version -------------------------------------------------
+
+    def needs_version_check(self) -> bool:
+        return time.monotonic() - self._version_checked_at >= self.version_check_seconds
+
+    def observe_version(self, version: int):
+        """Record the corpus version read from the database, clearing the cache if it moved"""
+        with self._lock:
+            self._version_checked_at = time.monotonic()
+            if self.corpus_version is not None and version != self.corpus_version:
+                if self._entries:
+                    self.stats['invalidations'] += 1
+                self._entries.clear()
+                self._matrix = None
+            self.corpus_version = version
+
+    # --- lookups ----------------------------------------------------------
+
+    def _live(self, key: str) -> Optional[Dict[str, Any]]:
+        """Return a non-expired entry (caller holds the lock)"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry['created'] > self.ttl_seconds or entry['version'] != self.corpus_version:
+            del self._entries[key]
+            self._matrix = None
+            self.stats['expirations'] += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def get_exact(self, question: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            entry = self._live(normalize_question(question))
+            if entry is not None:
+                self.stats['exact_hits'] += 1
+                ANSWER_CACHE_HITS.inc(tier='exact')
+            return entry
+
+    def get_similar(self, embedding: Optional[List[float]], question: str = "") -> Optional[Dict[str, Any]]:
+        """
+        Near-duplicate lookup: candidates above the threshold are tried in similarity
+        order, skipping expired ones and those mentioning other numbers than `question`.
+        Counts a miss when none qualifies.
+        """
+        with self._lock:
+            if embedding is not None and self._entries:
+                if self._matrix is None:
+                    self._matrix_keys = list(self._entries)
+                    self._matrix = np.stack([self._entries[k]['embedding'] for k in self._matrix_keys])
+                keys = self._matrix_keys
+
+                query = np.asarray(embedding, dtype=np.float32)
+                query /= (np.linalg.norm(query) or 1.0)
+                similarities = self._matrix @ query
+                above = np.flatnonzero(similarities >= self.similarity_threshold)
+                entities = question_entities(question)
+
+                for index in above[np.argsort(-similarities[above])]:
+                    # _live drops expired entries (and the matrix); `keys` stays valid for this loop
+                    entry = self._live(keys[index])
+                    if entry is not None and entry['entities'] == entities:
+                        self.stats['semantic_hits'] += 1
+                        ANSWER_CACHE_HITS.inc(tier='semantic')
+                        return entry
+
+            self.stats['misses'] += 1
+            ANSWER_CACHE_MISSES.inc()
+            return None
+
+    def put(self, question: str, embedding: Optional[List[float]], answer: str, sources: List[Dict] = None):
+        if embedding is None:
+            return
+        vector = np.asarray(embedding, dtype=np.float32)
+        vector /= (np.linalg.norm(vector) or 1.0)
+
+        with self._lock:
+            key = normalize_question(question)
+            self._entries[key] = {
+                'question': question,
+                'answer': answer,
+                'sources': sources or [],
+                'embedding': vector,
+                'entities': question_entities(question),
+                'version': self.corpus_version,
+                'created': time.monotonic(),
+            }
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.stats['evictions'] += 1
+            self._matrix = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.stats['exact_hits'] + self.stats['semantic_hits']
+            lookups = hits + self.stats['misses']
+            return {
+                **self.stats,
+                'entries': len(self._entries),
+                'hit_rate': round(hits / lookups, 4) if lookups else 0.0,
+                'corpus_version': self.corpus_version,
+            }
@@ -0,0 +1,277 @@
+import asyncio
+import os
+from typing import List, Dict, Optional, AsyncIterator, Tuple
+
+import openai
+from dotenv import load_dotenv
+
+from db import create_async_pool, CORPUS_VERSION_SQL
+from answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from embeddings import async_embed_texts, get_embedding_cache
+from rerank import mmr_rerank, RERANK_CANDIDATES, CONTEXT_CHUNKS
+from vector_snapshot import get_vector_snapshot
+from metrics import observe_stages
+from rag import (
+    EnhancedRAG,
+    HYBRID_SEARCH_SQL,
+    RRF_K,
+    ANSWER_MODEL,
+    ANSWER_MAX_TOKENS,
+    ANSWER_TEMPERATURE,
+    ANSWER_ERROR_PREFIX,
+    NO_RESULTS_ANSWER,
+    fuse_search_rows,
+    result_sources,
+    timed_stage,
+)
+
+load_dotenv()
+
+
+def to_asyncpg_query(sql: str, params: Dict) -> tuple:
+    """Rewrite psycopg2 %(name)s placeholders as asyncpg $n, returning (sql, args)"""
+    args = []
+    positions = {}
+    for name in params:
+        placeholder = f"%({name})s"
+        if placeholder in sql:
+            args.append(params[name])
+            positions[name] = len(args)
+            sql = sql.replace(placeholder, f"${positions[name]}")
+    return sql, args
+
+
+class AsyncEnhancedRAG(EnhancedRAG):
+    """
+    asyncio version of EnhancedRAG for the API server.
+
+    Uses the async OpenAI client and an asyncpg pool, so a single worker can
+    keep many questions in flight. The keyword arm runs concurrently with the
+    query-embedding request; the vector arms follow once the vectors arrive,
+    and both are fused with the same RRF scoring as the single-statement path.
+    Query analysis, ranking and prompt building are inherited unchanged.
+    """
+
+    def __init__(self):
+        self.pool = None  # created in connect(), inside the running event loop
+        self.openai_client = openai.AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.embedding_model = "text-embedding-3-small"
+        self.embedding_cache = get_embedding_cache()
+        self.answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
+
+    async def connect(self):
+        if self.pool is None:
+            self.pool = await create_async_pool()
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+            self.pool = None
+
+    async def embed_texts(self, texts: List[str]) -> List[Optional[List[float]]]:
+        return await async_embed_texts(self.openai_client, self.embedding_model, texts,
+                                       cache=self.embedding_cache)
+
+    async def get_embedding(self, text: str) -> List[float]:
+        return (await self.embed_texts([text]))[0]
+
+    async def embed_query_variations(self, query_variations: List[str]) -> Dict[str, List[float]]:
+        embeddings = await self.embed_texts(query_variations)
+        return {
+            variant: embedding
+            for variant, embedding in zip(query_variations, embeddings)
+            if embedding
+        }
+
+    async def refresh_corpus_version(self):
+        if self.answer_cache is None or not self.answer_cache.needs_version_check():
+            return
+        try:
+            async with self.pool.acquire() as conn:
+                self.answer_cache.observe_version(await conn.fetchval(CORPUS_VERSION_SQL))
+        except Exception as e:
+            print(f"Could not read corpus version: {e}")
+
+    async def lookup_cached_answer(self, question: str, timings: Dict[str, float]) -> tuple:
+        """
+        Check both answer-cache tiers. Returns (cached entry or None, query embeddings);
+        the embeddings computed for the near-duplicate check are reused by retrieval.
+        """
+        cached = None
+        if self.answer_cache is not None:
+            with timed_stage(timings, 'answer_cache'):
+                await self.refresh_corpus_version()
+                cached = self.answer_cache.get_exact(question)
+
+        query_embeddings = {}
+        if cached is None:
+            with timed_stage(timings, 'embed_queries'):
+                query_embeddings = await self.embed_query_variations(self.expand_query(question))
+            if self.answer_cache is not None:
+                cached = self.answer_cache.get_similar(query_embeddings.get(question), question)
+
+        return cached, query_embeddings
+
+    async def _search_rows(self, params: Dict, timings: Optional[Dict[str, float]], stage: str) -> List[tuple]:
+        sql, args = to_asyncpg_query(HYBRID_SEARCH_SQL, params)
+        with timed_stage(timings, stage):
+            async with self.pool.acquire() as conn:
+                rows = await conn.fetch(sql, *args)
+        return [tuple(row) for row in rows]
+
+    async def hybrid_search(self, query: str, limit: int = 10, timings: Optional[Dict[str, float]] = None,
+                            query_embeddings: Optional[Dict[str, List[float]]] = None) -> List[Dict]:
+        """Async hybrid search: keyword and vector arms run on separate pooled connections"""
+        with timed_stage(timings, 'preprocess'):
+            query_analysis = self.preprocess_query(query)
+        with timed_stage(timings, 'expand'):
+            query_variations = self.expand_query(query)
+
+        # Each statement returns every candidate of its arms so the Python fusion is exact
+        arm_rows = limit * (2 * len(query_variations) + 1)
+        candidates = max(limit, RERANK_CANDIDATES)
+
+        try:
+            keyword_params = self.build_search_params(query, [], limit)
+            keyword_params['limit'] = arm_rows
+            keyword_task = asyncio.create_task(self._search_rows(keyword_params, timings, 'sql_keyword'))
+
+            try:
+                if query_embeddings is None:
+                    with timed_stage(timings, 'embed_queries'):
+                        query_embeddings = await self.embed_query_variations(query_variations)
+
+                vector_rows = None
+                snapshot = get_vector_snapshot()
+                if query_embeddings and snapshot is not None:
+                    # In-process vector arms (RAG_VECTOR_BACKEND=snapshot); no second SQL statement
+                    try:
+                        with timed_stage(timings, 'vector_snapshot'):
+                            vector_rows = snapshot.search_rows(list(query_embeddings.values()), limit, RRF_K)
+                    except Exception as e:
+                        # A corrupt or half-written snapshot falls back to the SQL vector arms
+                        print(f"Vector snapshot search error, using SQL: {e}")
+                if vector_rows is None and query_embeddings:
+                    vector_params = self.build_search_params(query, list(query_embeddings.values()), limit)
+                    vector_params['tsquery'] = None
+                    vector_params['limit'] = arm_rows
+                    vector_rows = await self._search_rows(vector_params, timings, 'sql_vector')
+                vector_rows = vector_rows or []
+            finally:
+                keyword_rows = await keyword_task
+
+        except Exception as e:
+            print(f"Search error: {e}")
+            return []
+
+        with timed_stage(timings, 'dedupe_rank'):
+            rows = fuse_search_rows([vector_rows, keyword_rows], candidates)
+            unique_results = self.deduplicate_and_rank(self.rows_to_results(rows), query_analysis)
+        with timed_stage(timings, 'mmr'):
+            return mmr_rerank(unique_results, limit)
+
+    async def generate_enhanced_answer(self, query: str, results: List[Dict],
+                                       timings: Optional[Dict[str, float]] = None) -> str:
+        if not results:
+            return NO_RESULTS_ANSWER
+
+        with timed_stage(timings, 'context'):
+            prompt = self.build_answer_prompt(query, results)
+
+        try:
+            with timed_stage(timings, 'llm'):
+                response = await self.openai_client.chat.completions.create(
+                    model=ANSWER_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=ANSWER_MAX_TOKENS,
+                    temperature=ANSWER_TEMPERATURE
+                )
+            return response.choices[0].message.content
+        except Exception as e:
+            return f"{ANSWER_ERROR_PREFIX}: {e}"
+
+    async def stream_enhanced_answer(self, query: str, results: List[Dict],
+                                     timings: Optional[Dict[str, float]] = None) -> AsyncIterator[str]:
+        """Yield the answer as it is generated, token by token ('llm' covers the whole stream)"""
+        if not results:
+            yield NO_RESULTS_ANSWER
+            return
+
+        with timed_stage(timings, 'context'):
+            prompt = self.build_answer_prompt(query, results)
+
+        try:
+            with timed_stage(timings, 'llm'):
+                stream = await self.openai_client.chat.completions.create(
+                    model=ANSWER_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=ANSWER_MAX_TOKENS,
+                    temperature=ANSWER_TEMPERATURE,
+                    stream=True
+                )
+                async for chunk in stream:
+                    if chunk.choices and chunk.choices[0].delta.content:
+                        yield chunk.choices[0].delta.content
+        except Exception as e:
+            yield f"{ANSWER_ERROR_PREFIX}: {e}"
+
+    async def ask_stream(self, question: str) -> AsyncIterator[Tuple[str, Dict]]:
+        """
+        Answer a question as a stream of (event, data) pairs:
+        one 'metadata' event with the retrieved sources as soon as retrieval is
+        done, a 'token' event per generated fragment, then 'done' with the full answer.
+        """
+        timings = {}
+
+        cached, query_embeddings = await self.lookup_cached_answer(question, timings)
+        if cached is not None:
+            yield 'metadata', {**result_sources(cached['sources']), 'cached': True, 'timings': dict(timings)}
+            answer = cached['answer']
+            yield 'token', {'text': answer}
+            observe_stages(timings)
+            yield 'done', {'answer': answer, 'cached': True, 'timings': timings}
+            return
+
+        results = await self.hybrid_search(question, limit=CONTEXT_CHUNKS, timings=timings, query_embeddings=query_embeddings)
+        yield 'metadata', {**result_sources(results), 'cached': False, 'timings': dict(timings)}
+
+        parts = []
+        async for token in self.stream_enhanced_answer(question, results, timings):
+            parts.append(token)
+            yield 'token', {'text': token}
+
+        answer = "".join(parts)
+        self.cache_answer(question, query_embeddings, answer, results)
+        print(f"\n**Question:** {question}")
+        print(f"**Answer:** {answer}")
+        print("**Timings (ms):** " + ", ".join(f"{stage}={ms}" for stage, ms in timings.items()))
+        observe_stages(timings)
+
+        yield 'done', {'answer': answer, 'cached': False, 'timings': timings}
+
+    async def answer(self, question: str) -> Dict:
+        """
+        Answer a question and return {'answer', 'cached', 'timings'}, where timings
+        holds the milliseconds spent per stage (preprocess, expand, embed_queries,
+        sql_keyword, sql_vector or vector_snapshot, dedupe_rank, mmr, context, llm).
+        Stage timings also feed the /metrics histograms.
+        """
+        timings = {}
+
+        cached, query_embeddings = await self.lookup_cached_answer(question, timings)
+        if cached is not None:
+            answer = cached['answer']
+        else:
+            results = await self.hybrid_search(question, limit=CONTEXT_CHUNKS, timings=timings, query_embeddings=query_embeddings)
+            answer = await self.generate_enhanced_answer(question, results, timings)
+            self.cache_answer(question, query_embeddings, answer, results)
+
+        print(f"\n**Question:** {question}")
+        print(f"**Answer:** {answer}{' (cached)' if cached is not None else ''}")
+        print("**Timings (ms):** " + ", ".join(f"{stage}={ms}" for stage, ms in timings.items()))
+        observe_stages(timings)
+
+        return {'answer': answer, 'cached': cached is not None, 'timings': timings}
+
+    async def ask(self, question: str) -> str:
+        return (await self.answer(question))['answer']
@@ -0,0 +1,191 @@
+"""
+Directory-scale ingestion: discover PDFs and run OCR -> extraction -> insert
+for each one on a worker pool.
+
+Every finished file appends a line to a JSONL manifest (status, timings, row
+counts). Files already recorded as "ok" with the same content hash are skipped
+on the next run, so an interrupted batch can simply be started again.
+Identical copies of a file within one run are ingested once; the others are
+reported as skipped.
+
+Usage:
+    python batch_ingest.py ../pdf_holder --workers 4
+    python batch_ingest.py ../pdf_holder --workers 8 --mode process --manifest output/manifest.jsonl
+"""
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from pipeline import run_pipeline, load_inserter_module
+
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS', '4'))
+DEFAULT_MANIFEST = "output/manifest.jsonl"
+
+
+def discover_pdfs(root: str, recursive: bool = True) -> List[Path]:
+    """All PDFs under root (or root itself if it is a file), in a stable order"""
+    root_path = Path(root)
+    if root_path.is_file():
+        return [root_path]
+    candidates = root_path.rglob("*") if recursive else root_path.glob("*")
+    return sorted(p for p in candidates if p.is_file() and p.suffix.lower() == ".pdf")
+
+
+def load_manifest(manifest_path: str) -> Dict[str, Dict]:
+    """Latest manifest entry per file hash"""
+    entries = {}
+    if not os.path.exists(manifest_path):
+        return entries
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if entry.get('file_hash'):
+                entries[entry['file_hash']] = entry
+    return entries
+
+
+def ingest_file(pdf_path: str, company_name: Optional[str] = None, report_year: Optional[int] = None,
+                output_dir: Optional[str] = None) -> Dict:
+    """
+    Worker entry point: ingest one PDF and return its manifest entry.
+    Never raises, so one bad file does not stop the batch.
+    """
+    started = time.perf_counter()
+    entry = {
+        'file': pdf_path,
+        'file_hash': load_inserter_module().file_sha256(pdf_path),
+        'started_at': datetime.now().isoformat(),
+        'worker_pid': os.getpid(),
+    }
+    try:
+        artifacts = str(Path(output_dir) / Path(pdf_path).stem) if output_dir else None
+        summary = run_pipeline(pdf_path, company_name, report_year, output_dir=artifacts)
+        metadata = summary['document_metadata']
+        entry.update({
+            'status': 'ok',
+            'doc_id': summary['doc_id'],
+            'pages': metadata['total_pages'],
+            'paragraphs': metadata['total_paragraphs'],
+            'tables': metadata['total_tables'],
+            'images': metadata['total_images'],
+            'rows': summary['rows'],
+            'timings': summary['timings'],
+        })
+    except Exception as e:
+        entry.update({'status': 'failed', 'error': f"{type(e).__name__}: {e}"})
+    entry['seconds'] = round(time.perf_counter() - started, 3)
+    return entry
+
+
+def summarize(entries: List[Dict], wall_seconds: float) -> Dict:
+    ok = [e for e in entries if e['status'] == 'ok']
+    pages = sum(e.get('pages', 0) for e in ok)
+    chunks = sum(e.get('rows', {}).get('chunks', 0) for e in ok)
+    stage_seconds = {}
+    for e in ok:
+        for stage, seconds in e.get('timings', {}).items():
+            stage_seconds[stage] = round(stage_seconds.get(stage, 0.0) + seconds, 3)
+    return {
+        'files': len(entries),
+        'ok': len(ok),
+        'failed': sum(1 for e in entries if e['status'] == 'failed'),
+        'skipped': sum(1 for e in entries if e['status'] == 'skipped'),
+        'pages': pages,
+        'chunks': chunks,
+        'wall_seconds': round(wall_seconds, 3),
+        'pages_per_second': round(pages / wall_seconds, 3) if wall_seconds else 0.0,
+        'files_per_minute': round(len(ok) * 60 / wall_seconds, 3) if wall_seconds else 0.0,
+        'stage_seconds': stage_seconds,
+    }
+
+
+def run_batch(root: str,
+              workers: int = BATCH_WORKERS,
+              mode: str = "thread",
+              manifest_path: str = DEFAULT_MANIFEST,
+              company_name: Optional[str] = None,
+              report_year: Optional[int] = None,
+              output_dir: Optional[str] = None,
+              recursive: bool = True,
+              force: bool = False) -> Dict:
+    """Ingest every PDF under root and return the aggregate summary"""
+    pdfs = discover_pdfs(root, recursive)
+    Path(manifest_path).parent.mkdir(parents=True, exist_ok=True)
+    done = {} if force else load_manifest(manifest_path)
+    file_sha256 = load_inserter_module().file_sha256
+
+    todo, entries = [], []
+    queued = {}  # file hash -> first file queued with it
+    for pdf in pdfs:
+        file_hash = file_sha256(str(pdf))
+        previous = done.get(file_hash)
+        if previous and previous.get('status') == 'ok':
+            entries.append({'file': str(pdf), 'file_hash': previous['file_hash'],
+                            'status': 'skipped', 'doc_id': previous.get('doc_id')})
+        elif file_hash and file_hash in queued:
+            # Identical copies would race on the unique documents.file_hash index
+            print(f" Skipping {pdf}: same content as {queued[file_hash]}")
+            entries.append({'file': str(pdf), 'file_hash': file_hash,
+                            'status': 'skipped', 'duplicate_of': queued[file_hash]})
+        else:
+            if file_hash:
+                queued[file_hash] = str(pdf)
+            todo.append(str(pdf))
+
+    print(f" Found {len(pdfs)} PDFs under {root}: {len(todo)} to ingest, "
+          f"{len(pdfs) - len(todo)} already done or duplicates ({workers} {mode} workers)")
+
+    executor_class = ProcessPoolExecutor if mode == "process" else ThreadPoolExecutor
+    started = time.perf_counter()
+    with open(manifest_path, 'a', encoding='utf-8') as manifest, \
+            executor_class(max_workers=max(1, workers)) as executor:
+        futures = {executor.submit(ingest_file, pdf, company_name, report_year, output_dir): pdf
+                   for pdf in todo}
+        for future in as_completed(futures):
+            entry = future.result()
+            entries.append(entry)
+            manifest.write(json.dumps(entry) + "\n")
+            manifest.flush()
+            detail = f"{entry.get('pages', 0)} pages" if entry['status'] == 'ok' else entry.get('error')
+            print(f" [{len(entries)}/{len(pdfs)}] {entry['status']}: {entry['file']} "
+                  f"({entry['seconds']}s, {detail})")
+
+    summary = summarize(entries, time.perf_counter() - started)
+    print("\n BATCH SUMMARY:")
+    print(json.dumps(summary, indent=2))
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest every PDF in a directory on a worker pool")
+    parser.add_argument("root", help="Directory (or single PDF) to ingest")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS)
+    parser.add_argument("--mode", choices=("thread", "process"), default="thread",
+                        help="thread: shared pools and caches; process: one interpreter per worker")
+    parser.add_argument("--manifest", default=DEFAULT_MANIFEST)
+    parser.add_argument("--company", dest="company_name")
+    parser.add_argument("--year", dest="report_year", type=int)
+    parser.add_argument("--output-dir", help="Also write per-file markdown/image/JSON exports here")
+    parser.add_argument("--no-recursive", dest="recursive", action="store_false")
+    parser.add_argument("--force", action="store_true", help="Re-ingest files already marked ok in the manifest")
+    args = parser.parse_args()
+
+    summary = run_batch(args.root, args.workers, args.mode, args.manifest, args.company_name,
+                        args.report_year, args.output_dir, args.recursive, args.force)
+    if summary['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
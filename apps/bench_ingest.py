@@ -0,0 +1,409 @@
+"""
+Offline ingestion benchmark.
+
+Runs the streaming pipeline (pipeline.run_pipeline) over the PDFs under a
+directory with local stand-ins for every external API. It writes to a scratch
+Postgres database given with --database (or BENCH_PG_DB), which must differ
+from the application's PG_DB; it is set up like the main one (db.setup_database).
+    OCR         recorded Mistral OCR responses (<recorded>/<pdf stem>.json, as
+                written by `bench_ingest.py record`), else synthetic pages
+                generated deterministically from the PDF's page count
+    embeddings  deterministic unit vectors derived from the text's sha256
+    vision      a fixed JSON analysis derived from the image
+Each fake sleeps for a configurable latency per call, so API-bound and
+CPU/DB-bound regressions can be told apart. Benchmark documents are tagged
+with company_name BENCH_COMPANY_NAME; tagged documents from earlier runs are
+deleted first (nothing else ever is), images go to a fresh store, the
+embedding cache is bypassed and RAG_VECTOR_BACKEND is forced to postgres (so
+the application's vector snapshot is never refreshed from the scratch
+database), so every run does the same work.
+
+The report has pages/sec, chunks/sec, API calls per page, peak RSS and the
+seconds spent per phase (ocr, extract, write, chunks, tables, images,
+embed_and_write). It is written as JSON so runs can be compared across commits.
+
+Usage:
+    python bench_ingest.py run ../pdf_holder --database bench_scratch --output bench/ingest.json
+    BENCH_PG_DB=bench_scratch python bench_ingest.py run ../pdf_holder --synthetic-pages 200 --embed-latency 0
+    python bench_ingest.py record ../pdf_holder --recorded bench/ocr   # live Mistral OCR, once
+"""
+import argparse
+import base64
+import hashlib
+import json
+import os
+import random
+import resource
+import struct
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from datetime import datetime
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+from dotenv import load_dotenv
+
+from batch_ingest import discover_pdfs
+from embeddings import EMBEDDING_DIMENSIONS
+from image_store import configure_image_store
+from pdf_extract import EnhancedOCRProcessor, count_pdf_pages, client as mistral_client
+from pipeline import run_pipeline, load_inserter_module
+
+# company_name of every benchmark document; only documents carrying it are ever deleted
+BENCH_COMPANY_NAME = "__bench_ingest__"
+
+WORDS = ("revenue growth margin operating segment quarter fiscal dividend capital expenditure "
+         "liquidity guidance outlook customers market share subscription services hardware "
+         "international currency impact net income earnings cash flow balance sheet inventory "
+         "supply chain research development headcount restructuring acquisition").split()
+
+
+class CallCounter:
+    """Thread-safe API call counts shared by the fake clients"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.counts = {'ocr_requests': 0, 'ocr_pages': 0, 'embedding_requests': 0,
+                       'embedding_inputs': 0, 'vision_requests': 0}
+
+    def add(self, **increments):
+        with self._lock:
+            for key, value in increments.items():
+                self.counts[key] += value
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.counts)
+
+
+def synthetic_png(seed: str, size: int = 16) -> bytes:
+    """A small valid RGB PNG whose pixels are derived from seed"""
+    rng = random.Random(seed)
+    rows = b"".join(b"\x00" + bytes(rng.randrange(256) for _ in range(size * 3)) for _ in range(size))
+
+    def chunk(kind: bytes, data: bytes) -> bytes:
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+    header = struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(rows)) + chunk(b"IEND", b"")
+
+
+def synthetic_page(seed: str, index: int, paragraphs: int = 6, tables: int = 1, images: int = 1) -> SimpleNamespace:
+    """One OCR page of report-like markdown: a heading, paragraphs, markdown tables and image refs"""
+    rng = random.Random(f"{seed}:{index}")
+    lines = [f"# Section {index + 1}", ""]
+    for _ in range(paragraphs):
+        sentences = [" ".join(rng.choice(WORDS) for _ in range(rng.randint(8, 18))).capitalize() + "."
+                     for _ in range(rng.randint(2, 5))]
+        lines += [" ".join(sentences), ""]
+    for _ in range(tables):
+        lines += ["| Metric | FY2023 | FY2024 |", "| --- | --- | --- |"]
+        for _ in range(rng.randint(3, 8)):
+            lines.append(f"| {rng.choice(WORDS).capitalize()} | {rng.randint(1, 9999)} | {rng.randint(1, 9999)} |")
+        lines.append("")
+
+    page_images = []
+    for i in range(images):
+        image_id = f"img-{index}-{i}.png"
+        # The first image of every fourth page is the same one, like a repeated logo
+        image_seed = f"{seed}:logo" if i == 0 and index % 4 == 0 else f"{seed}:{index}:{i}"
+        encoded = base64.b64encode(synthetic_png(image_seed)).decode('ascii')
+        page_images.append(SimpleNamespace(id=image_id, image_base64=f"data:image/png;base64,{encoded}"))
+        lines += [f"![{image_id}]({image_id})", ""]
+    return SimpleNamespace(index=index, markdown="\n".join(lines), images=page_images)
+
+
+class FakeOCRResponse(SimpleNamespace):
+    """Enough of mistralai's OCRResponse for EnhancedOCRProcessor and the pipeline"""
+
+    def model_copy(self, update: Optional[Dict] = None):
+        return FakeOCRResponse(**{**vars(self), **(update or {})})
+
+
+def load_recorded_response(path: Path) -> FakeOCRResponse:
+    """An OCRResponse saved with model_dump_json(), as attribute-style objects"""
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    pages = [SimpleNamespace(index=page['index'], markdown=page.get('markdown', ''),
+                             images=[SimpleNamespace(**image) for image in page.get('images', [])])
+             for page in data['pages']]
+    return FakeOCRResponse(pages=pages, model=data.get('model', 'recorded'))
+
+
+class FakeMistral:
+    """
+    Stand-in for the Mistral client (files.upload, files.get_signed_url, ocr.process).
+    Serves the recorded response for a PDF when one exists, else synthetic pages.
+    """
+
+    def __init__(self, counter: CallCounter, page_latency: float = 0.05, recorded_dir: Optional[str] = None,
+                 synthetic_pages: Optional[int] = None, paragraphs: int = 6, tables: int = 1, images: int = 1):
+        self.counter = counter
+        self.page_latency = page_latency
+        self.recorded_dir = Path(recorded_dir) if recorded_dir else None
+        self.synthetic_pages = synthetic_pages
+        self.page_shape = {'paragraphs': paragraphs, 'tables': tables, 'images': images}
+        self._documents = {}  # signed url -> full response
+        self._lock = threading.Lock()
+        self.files = SimpleNamespace(upload=self._upload, get_signed_url=self._get_signed_url)
+        self.ocr = SimpleNamespace(process=self._process)
+
+    def _full_response(self, pdf_path: str) -> FakeOCRResponse:
+        recorded = self.recorded_dir / f"{Path(pdf_path).stem}.json" if self.recorded_dir else None
+        if recorded and recorded.exists():
+            return load_recorded_response(recorded)
+        seed = load_inserter_module().file_sha256(pdf_path) or pdf_path
+        page_count = self.synthetic_pages or count_pdf_pages(pdf_path) or 1
+        return FakeOCRResponse(model='synthetic',
+                               pages=[synthetic_page(seed, i, **self.page_shape) for i in range(page_count)])
+
+    def _upload(self, file: Dict, purpose: str = "ocr"):
+        pdf_path = getattr(file['content'], 'name', file.get('file_name'))
+        file_id = hashlib.sha256(f"{pdf_path}:{time.perf_counter_ns()}".encode()).hexdigest()[:16]
+        with self._lock:
+            self._documents[f"fake://{file_id}"] = self._full_response(pdf_path)
+        return SimpleNamespace(id=file_id)
+
+    def _get_signed_url(self, file_id: str):
+        return SimpleNamespace(url=f"fake://{file_id}")
+
+    def _process(self, model: str, document: Dict, include_image_base64: bool = True, pages=None):
+        with self._lock:
+            response = self._documents[document['document_url']]
+        wanted = None if pages is None else set(pages)
+        selected = [p for p in response.pages if wanted is None or p.index in wanted]
+        time.sleep(self.page_latency * len(selected))
+        self.counter.add(ocr_requests=1, ocr_pages=len(selected))
+        return response.model_copy(update={'pages': selected})
+
+
+class FakeOpenAI:
+    """Stand-in for the OpenAI client's embeddings.create and chat.completions.create"""
+
+    def __init__(self, counter: CallCounter, embed_latency: float = 0.05, vision_latency: float = 0.3,
+                 dimensions: int = EMBEDDING_DIMENSIONS):
+        self.counter = counter
+        self.embed_latency = embed_latency
+        self.vision_latency = vision_latency
+        self.dimensions = dimensions
+        self.embeddings = SimpleNamespace(create=self._embed)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._complete))
+
+    def vector(self, text: str) -> List[float]:
+        seed = int.from_bytes(hashlib.sha256(text.encode('utf-8')).digest()[:8], 'little')
+        vector = np.random.default_rng(seed).standard_normal(self.dimensions).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+    def _embed(self, model: str, input: List[str], dimensions: Optional[int] = None):
+        time.sleep(self.embed_latency)
+        self.counter.add(embedding_requests=1, embedding_inputs=len(input))
+        return SimpleNamespace(data=[SimpleNamespace(index=i, embedding=self.vector(text))
+                                     for i, text in enumerate(input)])
+
+    def _complete(self, model: str, messages: List[Dict], **kwargs):
+        time.sleep(self.vision_latency)
+        self.counter.add(vision_requests=1)
+        parts = messages[0]['content']
+        image_url = next((p['image_url']['url'] for p in parts if p.get('type') == 'image_url'), '')
+        digest = hashlib.sha256(image_url.encode('ascii')).hexdigest()[:12]
+        content = json.dumps({
+            "detailed_description": f"Bar chart {digest} comparing segment revenue across fiscal years",
+            "ocr_text": f"Revenue FY2023 FY2024 {digest}",
+            "key_insights": "Revenue grew year over year in every segment",
+            "visual_type": "chart",
+            "data_extracted": f"{int(digest[:4], 16) % 100}% growth",
+        })
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process (ru_maxrss is KiB on Linux, bytes on macOS)"""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=Path(__file__).parent, check=True).stdout.strip()
+    except Exception:
+        return None
+
+
+def use_scratch_database(database: Optional[str]) -> str:
+    """Point db.py at the benchmark database, refusing the application's own (PG_DB)"""
+    load_dotenv()
+    database = database or os.getenv('BENCH_PG_DB')
+    if not database:
+        raise SystemExit("Pass --database (or set BENCH_PG_DB) to a scratch database: "
+                         "the benchmark deletes and rewrites documents")
+    configured = os.getenv('PG_DB') or os.getenv('PG_DATABASE', 'report_agent_11')
+    if database == configured:
+        raise SystemExit(f"{database} is the application database (PG_DB); use a scratch database")
+    # db.py reads PG_DB when it is first imported (via the inserter module)
+    if 'db' in sys.modules and sys.modules['db'].DB_NAME != database:
+        raise RuntimeError("db.py was imported before the benchmark database was selected")
+    os.environ['PG_DB'] = database
+    return database
+
+
+def use_postgres_vectors():
+    """Keep finish_document from refreshing the application's vector snapshot from the scratch database"""
+    # vector_snapshot.py reads RAG_VECTOR_BACKEND when it is first imported (via the inserter module)
+    if 'vector_snapshot' in sys.modules and sys.modules['vector_snapshot'].snapshot_enabled():
+        raise RuntimeError("vector_snapshot.py was imported with RAG_VECTOR_BACKEND=snapshot "
+                           "before the benchmark could switch it off")
+    os.environ['RAG_VECTOR_BACKEND'] = 'postgres'
+
+
+def remove_previous_runs(inserter, pdf_path: str):
+    """Delete benchmark-tagged documents left by an earlier run so every page is ingested again"""
+    file_hash = load_inserter_module().file_sha256(pdf_path)
+    with inserter.pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT doc_id FROM documents
+                WHERE company_name = %s AND (file_hash = %s OR file_path = %s)
+            """, (BENCH_COMPANY_NAME, file_hash, pdf_path))
+            doc_ids = [row[0] for row in cur.fetchall()]
+    for doc_id in doc_ids:
+        inserter.delete_document(doc_id)
+
+
+def per_page(value: float, pages: int) -> float:
+    return round(value / pages, 3) if pages else 0.0
+
+
+def run_benchmark(root: str,
+                  recorded_dir: Optional[str] = None,
+                  synthetic_pages: Optional[int] = None,
+                  ocr_page_latency: float = 0.05,
+                  embed_latency: float = 0.05,
+                  vision_latency: float = 0.3,
+                  image_store_dir: Optional[str] = None,
+                  keep: bool = False,
+                  database: Optional[str] = None) -> Dict:
+    """Ingest every PDF under root into the scratch database with the fake clients and return the report"""
+    database = use_scratch_database(database)
+    use_postgres_vectors()
+    pdfs = [str(p) for p in discover_pdfs(root)]
+    configure_image_store(image_store_dir or tempfile.mkdtemp(prefix="bench_image_store_"))
+
+    # Imported only now: db.py reads PG_DB on import
+    import db
+    db.setup_database()
+
+    counter = CallCounter()
+    processor = EnhancedOCRProcessor(FakeMistral(counter, ocr_page_latency, recorded_dir, synthetic_pages))
+    inserter = load_inserter_module().DocumentInserter(
+        openai_client=FakeOpenAI(counter, embed_latency, vision_latency), use_embedding_cache=False)
+
+    files = []
+    phases = {'ocr': 0.0, 'extract': 0.0, 'write': 0.0}
+    started = time.perf_counter()
+    for pdf in pdfs:
+        if not keep:
+            remove_previous_runs(inserter, pdf)
+        file_started = time.perf_counter()
+        summary = run_pipeline(pdf, company_name=BENCH_COMPANY_NAME, processor=processor, inserter=inserter)
+        for stage in phases:
+            phases[stage] += summary['timings'][stage]
+        files.append({
+            'file': pdf,
+            'pages': summary['document_metadata']['total_pages'],
+            'rows': summary['rows'],
+            'seconds': round(time.perf_counter() - file_started, 3),
+            'timings': summary['timings'],
+        })
+    wall_seconds = time.perf_counter() - started
+
+    pages = sum(f['pages'] for f in files)
+    chunks = sum(f['rows']['chunks'] for f in files)
+    calls = counter.snapshot()
+    phases.update(inserter.phase_seconds)
+    return {
+        'revision': git_revision(),
+        'started_at': datetime.now().isoformat(),
+        'config': {
+            'root': root,
+            'database': database,
+            'ocr_source': 'recorded' if recorded_dir else 'synthetic',
+            'synthetic_pages': synthetic_pages,
+            'ocr_page_latency': ocr_page_latency,
+            'embed_latency': embed_latency,
+            'vision_latency': vision_latency,
+            'embedding_dimensions': EMBEDDING_DIMENSIONS,
+        },
+        'files': files,
+        'totals': {
+            'files': len(files),
+            'pages': pages,
+            'chunks': chunks,
+            'tables': sum(f['rows']['tables'] for f in files),
+            'images': sum(f['rows']['images'] for f in files),
+            'wall_seconds': round(wall_seconds, 3),
+            'pages_per_second': round(pages / wall_seconds, 3) if wall_seconds else 0.0,
+            'chunks_per_second': round(chunks / wall_seconds, 3) if wall_seconds else 0.0,
+        },
+        'api_calls': calls,
+        'api_calls_per_page': {name: per_page(count, pages) for name, count in calls.items()},
+        'phase_seconds': {phase: round(seconds, 3) for phase, seconds in phases.items()},
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def record_responses(root: str, recorded_dir: str):
+    """OCR each PDF once with the live Mistral API and save the response for replay"""
+    output = Path(recorded_dir)
+    output.mkdir(parents=True, exist_ok=True)
+    processor = EnhancedOCRProcessor(mistral_client)
+    for pdf in discover_pdfs(root):
+        response = processor.process_page_by_page(str(pdf))
+        (output / f"{pdf.stem}.json").write_text(response.model_dump_json(), encoding='utf-8')
+        print(f" Recorded {len(response.pages)} pages: {output / (pdf.stem + '.json')}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline ingestion benchmark with fake OCR/embedding/vision clients")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    run = commands.add_parser("run", help="Benchmark the pipeline against the database in .env")
+    run.add_argument("root", nargs="?", default="../pdf_holder")
+    run.add_argument("--recorded", help="Directory of recorded OCR responses (<pdf stem>.json)")
+    run.add_argument("--synthetic-pages", type=int, help="Pages per synthetic document (default: the PDF's page count)")
+    run.add_argument("--ocr-latency", type=float, default=0.05, help="Seconds per OCR page")
+    run.add_argument("--embed-latency", type=float, default=0.05, help="Seconds per embeddings request")
+    run.add_argument("--vision-latency", type=float, default=0.3, help="Seconds per vision request")
+    run.add_argument("--image-store", help="Image store directory (default: a fresh temporary one)")
+    run.add_argument("--database", help="Scratch database to ingest into (default: BENCH_PG_DB); never PG_DB")
+    run.add_argument("--keep", action="store_true", help="Keep documents from earlier runs (measures the resume path)")
+    run.add_argument("--output", help="Also write the report to this JSON file")
+
+    record = commands.add_parser("record", help="Save live OCR responses for later runs")
+    record.add_argument("root", nargs="?", default="../pdf_holder")
+    record.add_argument("--recorded", required=True)
+    args = parser.parse_args()
+
+    if args.command == "record":
+        record_responses(args.root, args.recorded)
+        return
+
+    report = run_benchmark(args.root, args.recorded, args.synthetic_pages, args.ocr_latency,
+                           args.embed_latency, args.vision_latency, args.image_store, args.keep,
+                           args.database)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        Path(args.output).parent.mkdir(parents=True, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""
+Binary COPY loading for the ingestion tables.
+
+Rows are encoded straight into PostgreSQL's binary COPY format (embeddings
+as pgvector's binary vector/halfvec representation rather than text), so a
+whole window of chunks, tables and images goes to the server in one COPY
+per table, inside the caller's transaction.
+"""
+import io
+import json
+import struct
+from typing import Callable, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from models import VECTOR_STORAGE
+
+COPY_SIGNATURE = b"PGCOPY\n\xff\r\n\x00"
+COPY_HEADER = COPY_SIGNATURE + struct.pack(">ii", 0, 0)  # flags, header extension length
+COPY_TRAILER = struct.pack(">h", -1)
+NULL_FIELD = struct.pack(">i", -1)
+JSONB_VERSION = b"\x01"
+# Bytes handed to the server per write while streaming a COPY
+COPY_CHUNK_BYTES = 1024 * 1024
+
+
+def encode_int4(value: int) -> bytes:
+    return struct.pack(">i", value)
+
+
+def encode_text(value: str) -> bytes:
+    return value.encode('utf-8')
+
+
+def encode_jsonb(value) -> bytes:
+    """jsonb binary input: a version byte followed by the JSON text"""
+    text = value if isinstance(value, str) else json.dumps(value)
+    return JSONB_VERSION + text.encode('utf-8')
+
+
+def encode_vector(values: Sequence[float]) -> bytes:
+    """pgvector binary input: int16 dimensions, int16 unused, big-endian float4 (vector) or float2 (halfvec)"""
+    dtype = '>f2' if VECTOR_STORAGE == 'halfvec' else '>f4'
+    array = np.asarray(values, dtype=dtype)
+    return struct.pack(">hh", array.shape[0], 0) + array.tobytes()
+
+
+Encoder = Callable[[object], bytes]
+
+# (column, encoder) per table, in COPY column order
+CHUNK_COLUMNS: List[Tuple[str, Encoder]] = [
+    ('doc_id', encode_int4),
+    ('page_number', encode_int4),
+    ('chunk_text', encode_text),
+    ('content_hash', encode_text),
+    ('embedding', encode_vector),
+]
+TABLE_COLUMNS: List[Tuple[str, Encoder]] = [
+    ('doc_id', encode_int4),
+    ('page_number', encode_int4),
+    ('table_data_json', encode_jsonb),
+    ('table_as_text', encode_text),
+    ('embedding', encode_vector),
+]
+IMAGE_COLUMNS: List[Tuple[str, Encoder]] = [
+    ('doc_id', encode_int4),
+    ('page_number', encode_int4),
+    ('image_filename', encode_text),
+    ('image_path', encode_text),
+]
+
+
+def copy_payload(rows: Iterable[Sequence], encoders: Sequence[Encoder]) -> io.BytesIO:
+    """Rows encoded as one binary COPY stream (None becomes NULL)"""
+    field_count = struct.pack(">h", len(encoders))
+    buffer = io.BytesIO()
+    buffer.write(COPY_HEADER)
+    for row in rows:
+        buffer.write(field_count)
+        for value, encode in zip(row, encoders):
+            if value is None:
+                buffer.write(NULL_FIELD)
+                continue
+            data = encode(value)
+            buffer.write(struct.pack(">i", len(data)))
+            buffer.write(data)
+    buffer.write(COPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+
+def copy_rows(cursor, table: str, columns: Sequence[Tuple[str, Encoder]], rows: List[Sequence]) -> int:
+    """COPY rows into table in binary format on the caller's transaction; returns the row count"""
+    if not rows:
+        return 0
+    names = ", ".join(name for name, _ in columns)
+    payload = copy_payload(rows, [encode for _, encode in columns])
+    cursor.copy_expert(f"COPY {table} ({names}) FROM STDIN WITH (FORMAT binary)", payload, size=COPY_CHUNK_BYTES)
+    return len(rows)
@@ -0,0 +1,177 @@
+"""
+Chunk planning for document_chunks.
+
+Candidate chunks are generated per page by a configurable list of strategies
+and deduplicated by the sha256 of their normalized text across the strategies
+of a page, before anything is embedded. A text repeated on another page, or
+already stored by another document, is still planned for that page (every page
+keeps its own rows, so re-ingesting one page never takes text away from
+another) but flagged, so the vector is reused instead of embedding it again.
+
+Dry run (no database, no embedding calls):
+    python chunk_planner.py output/db_ready_data.json --strategies paragraph,window,page
+"""
+import argparse
+import hashlib
+import json
+import os
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Set
+
+from embeddings import normalize_text, estimate_tokens
+
+# Strategies run in this order; the first one to produce a text owns it
+CHUNK_STRATEGIES = [s.strip() for s in os.getenv('CHUNK_STRATEGIES', 'paragraph,window,page').split(',') if s.strip()]
+# Reuse the vectors of chunks already stored (boilerplate, repeated disclaimers, earlier runs)
+CHUNK_DEDUP_ACROSS_DOCUMENTS = os.getenv('CHUNK_DEDUP_ACROSS_DOCUMENTS', '1') not in ('0', 'false', 'no')
+
+PARAGRAPH_MIN_CHARS = 20
+WINDOW_PARAGRAPHS = 3
+WINDOW_STEP = 2
+WINDOW_MIN_CHARS = 50
+PAGE_MIN_CHARS = 100
+PAGE_MAX_WORDS = 400
+PAGE_CHUNK_WORDS = 300
+PAGE_CHUNK_OVERLAP = 50
+
+
+def chunk_hash(text: str) -> str:
+    """Content hash used for chunk deduplication (whitespace/case-insensitive)"""
+    return hashlib.sha256(normalize_text(text).lower().encode('utf-8')).hexdigest()
+
+
+def paragraph_chunks(paragraphs: List[str]) -> List[str]:
+    """Strategy 1: individual paragraphs (for specific content)"""
+    return [p for p in paragraphs if len(p.strip()) > PARAGRAPH_MIN_CHARS]
+
+
+def window_chunks(paragraphs: List[str]) -> List[str]:
+    """Strategy 2: overlapping 2-3 paragraph windows (for broader understanding)"""
+    if len(paragraphs) <= 1:
+        return []
+    chunks = []
+    for i in range(0, len(paragraphs), WINDOW_STEP):
+        combined_text = " ".join(paragraphs[i:i + WINDOW_PARAGRAPHS])
+        if len(combined_text.strip()) > WINDOW_MIN_CHARS:
+            chunks.append(combined_text)
+    return chunks
+
+
+def page_chunks(paragraphs: List[str]) -> List[str]:
+    """Strategy 3: full page text, split into overlapping word windows when long"""
+    full_page_text = " ".join(paragraphs)
+    if len(full_page_text.strip()) <= PAGE_MIN_CHARS:
+        return []
+    words = full_page_text.split()
+    if len(words) <= PAGE_MAX_WORDS:
+        return [full_page_text]
+    chunks = []
+    for i in range(0, len(words), PAGE_CHUNK_WORDS - PAGE_CHUNK_OVERLAP):
+        chunk_text = " ".join(words[i:i + PAGE_CHUNK_WORDS])
+        if len(chunk_text.strip()) > PAGE_MIN_CHARS:
+            chunks.append(chunk_text)
+    return chunks
+
+
+STRATEGIES: Dict[str, Callable[[List[str]], List[str]]] = {
+    'paragraph': paragraph_chunks,
+    'window': window_chunks,
+    'page': page_chunks,
+}
+
+
+class PlannedChunk(NamedTuple):
+    page_number: int
+    strategy: str
+    text: str
+    content_hash: str
+    reused: bool = False  # an identical chunk was planned or stored before; its vector is reused
+
+
+class ChunkPlanner:
+    """
+    Plans the chunks of one document. Duplicates within a page are dropped;
+    texts an earlier page already planned are kept with reused=True.
+    `existing_hashes`, when given, is called with a list of content hashes and
+    returns the subset already stored (by any document, or by pages of this one
+    ingested in an earlier run); those are kept with reused=True as well. Reused
+    chunks do not spend embedding tokens again.
+    """
+
+    def __init__(self,
+                 strategies: Optional[List[str]] = None,
+                 existing_hashes: Optional[Callable[[List[str]], Set[str]]] = None):
+        self.strategies = list(strategies or CHUNK_STRATEGIES)
+        unknown = [name for name in self.strategies if name not in STRATEGIES]
+        if unknown:
+            raise ValueError(f"Unknown chunk strategies {unknown}; choose from {sorted(STRATEGIES)}")
+        self.existing_hashes = existing_hashes
+        self.seen: Set[str] = set()  # hashes whose vector this document already has or will have
+        self.stats = {name: {'candidates': 0, 'duplicates': 0, 'reused_vectors': 0,
+                             'chunks': 0, 'estimated_tokens': 0}
+                      for name in self.strategies}
+
+    def plan(self, pages: Iterable[Dict]) -> List[PlannedChunk]:
+        """Chunks for a batch of pages, deduplicated per page, in page/strategy order"""
+        candidates = []
+        for page_num, page_data in enumerate(pages, 1):
+            page_num = page_data.get('page_number', page_num)
+            paragraphs = page_data.get('paragraphs', [])
+            if not paragraphs:
+                continue
+            for name in self.strategies:
+                for text in STRATEGIES[name](paragraphs):
+                    candidates.append(PlannedChunk(page_num, name, text, chunk_hash(text)))
+
+        stored = set()
+        if self.existing_hashes and candidates:
+            stored = self.existing_hashes(sorted({c.content_hash for c in candidates} - self.seen))
+
+        planned = []
+        page_seen = set()
+        for candidate in candidates:
+            stats = self.stats[candidate.strategy]
+            stats['candidates'] += 1
+            key = (candidate.page_number, candidate.content_hash)
+            if key in page_seen:
+                stats['duplicates'] += 1
+                continue
+            page_seen.add(key)
+            stats['chunks'] += 1
+            if candidate.content_hash in self.seen or candidate.content_hash in stored:
+                self.seen.add(candidate.content_hash)
+                stats['reused_vectors'] += 1
+                planned.append(candidate._replace(reused=True))
+                continue
+            self.seen.add(candidate.content_hash)
+            stats['estimated_tokens'] += estimate_tokens(candidate.text)
+            planned.append(candidate)
+        return planned
+
+    def report(self) -> Dict:
+        totals = {key: sum(s[key] for s in self.stats.values())
+                  for key in ('candidates', 'duplicates', 'reused_vectors', 'chunks', 'estimated_tokens')}
+        return {'strategies': self.stats, 'total': totals}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dry-run the chunk planner on a db_ready JSON file")
+    parser.add_argument("db_ready_json", nargs="+")
+    parser.add_argument("--strategies", default=",".join(CHUNK_STRATEGIES),
+                        help=f"Comma-separated, from: {', '.join(STRATEGIES)}")
+    parser.add_argument("--per-document", action="store_true",
+                        help="Reuse vectors within each file only, not across the given files")
+    args = parser.parse_args()
+
+    strategies = [s.strip() for s in args.strategies.split(',') if s.strip()]
+    planner = ChunkPlanner(strategies)
+    for path in args.db_ready_json:
+        if args.per_document:
+            planner.seen.clear()
+        with open(path, 'r', encoding='utf-8') as f:
+            planner.plan(json.load(f).get('pages', []))
+
+    print(json.dumps(planner.report(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
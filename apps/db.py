@@ -1,38 +1,487 @@
 #db.py
 import os
+import re
+import sys
+import time
+import threading
+from contextlib import contextmanager
+from typing import Optional
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import ProgrammingError
 from dotenv import load_dotenv
 import psycopg2
+from psycopg2.pool import ThreadedConnectionPool
 from psycopg2.extensions import ISOLATION_LEVEL_AUTOCOMMIT
-from models import Base 
+from models import Base, search_vector_expression, VECTOR_STORAGE, EMBEDDING_DIMENSIONS
 
 load_dotenv()
 
 
-DB_HOST = os.getenv('PG_HOST')
-DB_NAME = os.getenv('PG_DB')
-DB_USER = os.getenv('PG_USER')
+DB_HOST = os.getenv('PG_HOST', 'localhost')
+DB_PORT = int(os.getenv('PG_PORT', '5432'))
+DB_NAME = os.getenv('PG_DB') or os.getenv('PG_DATABASE', 'report_agent_11')
+DB_USER = os.getenv('PG_USER', 'postgres')
 DB_PASS = os.getenv('PG_PASSWORD')
 
-DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}/{DB_NAME}"
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# Connection pool settings shared by the SQLAlchemy engine and the psycopg2 pool
+POOL_MIN_SIZE = int(os.getenv('PG_POOL_MIN', '1'))
+POOL_MAX_SIZE = int(os.getenv('PG_POOL_MAX', '10'))
+POOL_HEALTH_CHECK_SECONDS = float(os.getenv('PG_POOL_HEALTH_CHECK_SECONDS', '30'))
+STATEMENT_TIMEOUT_MS = int(os.getenv('PG_STATEMENT_TIMEOUT_MS', '30000'))
+
+# Approximate-nearest-neighbour index settings for the pgvector columns.
+# VECTOR_INDEX_TYPE: hnsw | ivfflat | none; VECTOR_DISTANCE: l2 | cosine | ip
+VECTOR_INDEX_TYPE = os.getenv('PG_VECTOR_INDEX', 'hnsw').lower()
+VECTOR_DISTANCE = os.getenv('PG_VECTOR_DISTANCE', 'l2').lower()
+HNSW_M = int(os.getenv('PG_HNSW_M', '16'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('PG_HNSW_EF_CONSTRUCTION', '64'))
+HNSW_EF_SEARCH = int(os.getenv('PG_HNSW_EF_SEARCH', '40'))
+IVFFLAT_LISTS = int(os.getenv('PG_IVFFLAT_LISTS', '0'))  # 0 = derive from row count
+IVFFLAT_PROBES = int(os.getenv('PG_IVFFLAT_PROBES', '10'))
+INDEX_MAINTENANCE_WORK_MEM = os.getenv('PG_INDEX_MAINTENANCE_WORK_MEM', '')
+
+# distance -> (operator class suffix, query operator); the class is prefixed by the storage type
+VECTOR_DISTANCES = {
+    'l2': ('l2_ops', '<->'),
+    'cosine': ('cosine_ops', '<=>'),
+    'ip': ('ip_ops', '<#>'),
+}
+if VECTOR_DISTANCE not in VECTOR_DISTANCES:
+    raise ValueError(f"PG_VECTOR_DISTANCE must be one of {', '.join(VECTOR_DISTANCES)}")
+VECTOR_OPCLASS = f"{VECTOR_STORAGE}_{VECTOR_DISTANCES[VECTOR_DISTANCE][0]}"
+VECTOR_DISTANCE_OPERATOR = VECTOR_DISTANCES[VECTOR_DISTANCE][1]
+# SQL type query embeddings are cast to, matching the columns (e.g. halfvec(512))
+VECTOR_SQL_TYPE = f"{VECTOR_STORAGE}({EMBEDDING_DIMENSIONS})"
+
+# Optional binary-quantized copy of each embedding (a generated bit column) for a
+# coarse Hamming-distance pass; BINARY_RERANK_FACTOR x limit candidates from it
+# are reranked with the full-precision embedding.
+VECTOR_BINARY_QUANTIZATION = os.getenv('PG_VECTOR_BINARY', '0') not in ('0', 'false', 'no', '')
+BINARY_RERANK_FACTOR = int(os.getenv('PG_VECTOR_BINARY_RERANK_FACTOR', '4'))
+BINARY_COLUMN = 'embedding_bq'
+
+# table -> embedding column indexed for similarity search
+VECTOR_INDEXED_COLUMNS = {
+    'document_chunks': 'embedding',
+    'extracted_tables': 'embedding',
+}
+
+DATABASE_URL = f"postgresql+psycopg2://{DB_USER}:{DB_PASS}@{DB_HOST}:{DB_PORT}/{DB_NAME}"
+
+
+class ConnectionPool:
+    """
+    Thread-safe psycopg2 connection pool with blocking checkout and health checks.
+
+    Use `with pool.connection() as conn:`; the transaction is committed when the
+    block exits cleanly and rolled back otherwise, then the connection goes back
+    to the pool instead of being closed. No connection is opened until the first
+    checkout, so constructing a pool (or an object holding one) needs no database.
+    """
+
+    def __init__(self, minconn: int = POOL_MIN_SIZE, maxconn: int = POOL_MAX_SIZE,
+                 health_check_seconds: float = POOL_HEALTH_CHECK_SECONDS,
+                 statement_timeout_ms: int = STATEMENT_TIMEOUT_MS):
+        self.minconn = minconn
+        self.maxconn = maxconn
+        self.health_check_seconds = health_check_seconds
+        self.statement_timeout_ms = statement_timeout_ms
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        # ThreadedConnectionPool raises when exhausted; make callers wait instead
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+
+    def _connections(self) -> ThreadedConnectionPool:
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadedConnectionPool(
+                    self.minconn, self.maxconn,
+                    host=DB_HOST, port=DB_PORT, dbname=DB_NAME, user=DB_USER, password=DB_PASS,
+                    options=f'-c statement_timeout={self.statement_timeout_ms}',
+                )
+            return self._pool
+
+    def _is_healthy(self, conn) -> bool:
+        if conn.closed:
+            return False
+        idle = time.monotonic() - self._last_used.get(id(conn), 0)
+        if idle < self.health_check_seconds:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def _checkout(self):
+        pool = self._connections()
+        conn = pool.getconn()
+        if not self._is_healthy(conn):
+            pool.putconn(conn, close=True)
+            conn = pool.getconn()
+        return conn
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            conn = self._checkout()
+            try:
+                yield conn
+                conn.commit()
+            except Exception:
+                if not conn.closed:
+                    conn.rollback()
+                raise
+        finally:
+            if conn is not None:
+                if conn.closed:
+                    self._last_used.pop(id(conn), None)
+                else:
+                    self._last_used[id(conn)] = time.monotonic()
+                self._pool.putconn(conn, close=bool(conn.closed))
+            self._slots.release()
+
+    def close(self):
+        with self._pool_lock:
+            if self._pool is not None:
+                self._pool.closeall()
+                self._pool = None
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_pool() -> ConnectionPool:
+    """Return the process-wide connection pool, creating it on first use"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ConnectionPool()
+        return _pool
+
+_engine = None
+_session_factory = None
+
+
+def get_engine():
+    """SQLAlchemy engine (table creation, sessions), created on first use like get_pool()"""
+    global _engine, _session_factory
+    with _pool_lock:
+        if _engine is None:
+            _engine = create_engine(
+                DATABASE_URL,
+                pool_size=POOL_MAX_SIZE,
+                max_overflow=0,
+                pool_pre_ping=True,
+                connect_args={'options': f'-c statement_timeout={STATEMENT_TIMEOUT_MS}'},
+            )
+            _session_factory = sessionmaker(autocommit=False, autoflush=False, bind=_engine)
+        return _engine
 
 def get_db():
     """Provides a database session for application use."""
-    db = SessionLocal()
+    get_engine()
+    db = _session_factory()
     try:
         yield db
     finally:
         db.close()
 
+# Corpus version: bumped by ingestion, read by the query path to invalidate cached answers
+CORPUS_VERSION_SQL = "SELECT COALESCE((SELECT version FROM corpus_state WHERE id = 1), 0)"
+BUMP_CORPUS_VERSION_SQL = """
+    INSERT INTO corpus_state (id, version) VALUES (1, 1)
+    ON CONFLICT (id) DO UPDATE SET version = corpus_state.version + 1, updated_at = now()
+"""
+
+def vector_index_name(table: str) -> str:
+    return f"{table}_embedding_{VECTOR_INDEX_TYPE}_{VECTOR_DISTANCE}_idx"
+
+def vector_search_settings() -> dict:
+    """Query-time ANN settings (ef_search / probes) for the configured index type"""
+    if VECTOR_INDEX_TYPE == 'hnsw':
+        # hnsw returns at most ef_search rows; the binary pass shortlists FACTOR x as many
+        factor = BINARY_RERANK_FACTOR if VECTOR_BINARY_QUANTIZATION else 1
+        return {'hnsw.ef_search': str(HNSW_EF_SEARCH * factor)}
+    if VECTOR_INDEX_TYPE == 'ivfflat':
+        return {'ivfflat.probes': str(IVFFLAT_PROBES)}
+    return {}
+
+def vector_search_settings_sql() -> str:
+    """SET LOCAL statement(s) tuning the ANN index for the current transaction (or '')"""
+    return ";".join(f"SET LOCAL {name} = {value}" for name, value in vector_search_settings().items())
+
+async def create_async_pool():
+    """
+    asyncpg pool for the async query path, built from the same settings as get_pool().
+    ANN search settings and the statement timeout are applied per connection.
+    """
+    import asyncpg  # only needed by the async API path
+
+    server_settings = {'statement_timeout': str(STATEMENT_TIMEOUT_MS)}
+    server_settings.update(vector_search_settings())
+    return await asyncpg.create_pool(
+        host=DB_HOST, port=DB_PORT, database=DB_NAME, user=DB_USER, password=DB_PASS,
+        min_size=POOL_MIN_SIZE, max_size=POOL_MAX_SIZE,
+        max_inactive_connection_lifetime=POOL_HEALTH_CHECK_SECONDS * 10,
+        server_settings=server_settings,
+    )
+
+def _ivfflat_lists(cursor, table: str) -> int:
+    if IVFFLAT_LISTS > 0:
+        return IVFFLAT_LISTS
+    # pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) beyond that
+    cursor.execute(f"SELECT COUNT(*) FROM {table}")
+    rows = cursor.fetchone()[0]
+    if rows > 1_000_000:
+        return int(rows ** 0.5)
+    return max(rows // 1000, 10)
+
+def _index_with_clause(cursor, table: str) -> str:
+    if VECTOR_INDEX_TYPE == 'hnsw':
+        return f"(m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION})"
+    if VECTOR_INDEX_TYPE == 'ivfflat':
+        return f"(lists = {_ivfflat_lists(cursor, table)})"
+    raise ValueError(f"Unknown PG_VECTOR_INDEX '{VECTOR_INDEX_TYPE}' (expected hnsw, ivfflat or none)")
+
+def _existing_vector_indexes(cursor, table: str, column: str):
+    """Names of the hnsw/ivfflat indexes currently defined on table.column"""
+    cursor.execute("""
+        SELECT i.relname
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        JOIN pg_am am ON am.oid = i.relam
+        JOIN pg_attribute a ON a.attrelid = t.oid AND a.attnum = ANY(x.indkey)
+        WHERE t.relname = %s AND a.attname = %s AND am.amname IN ('hnsw', 'ivfflat')
+    """, (table, column))
+    return [row[0] for row in cursor.fetchall()]
+
+def create_vector_indexes(cursor, rebuild: bool = False, concurrently: bool = False):
+    """
+    Create the configured ANN index on every embedding column.
+
+    With rebuild=True any existing hnsw/ivfflat index on those columns is
+    dropped first, so changed index type, opclass or build parameters take effect.
+    concurrently=True builds with CREATE INDEX CONCURRENTLY, so writers aren't
+    blocked for the duration of the build. Expects an autocommit cursor.
+    """
+    create = "CREATE INDEX CONCURRENTLY" if concurrently else "CREATE INDEX"
+    if INDEX_MAINTENANCE_WORK_MEM:
+        cursor.execute(f"SET maintenance_work_mem = '{INDEX_MAINTENANCE_WORK_MEM}'")
+
+    for table, column in VECTOR_INDEXED_COLUMNS.items():
+        existing = _existing_vector_indexes(cursor, table, column)
+        name = vector_index_name(table)
+
+        if rebuild:
+            for index in existing:
+                cursor.execute(f"DROP INDEX IF EXISTS {index}")
+                print(f" Dropped vector index {index}")
+            existing = []
+
+        if VECTOR_INDEX_TYPE == 'none':
+            continue
+        if name in existing:
+            print(f" Vector index {name} already exists.")
+            continue
+        if existing:
+            print(f" {table}.{column} already has vector index(es) {', '.join(existing)}; "
+                  f"run `python db.py reindex` to switch to {name}.")
+            continue
+
+        print(f" Building {VECTOR_INDEX_TYPE} index {name} on {table}.{column}...")
+        cursor.execute(f"""
+            {create} IF NOT EXISTS {name}
+            ON {table} USING {VECTOR_INDEX_TYPE} ({column} {VECTOR_OPCLASS})
+            WITH {_index_with_clause(cursor, table)}
+        """)
+        print(f" Vector index {name} ready.")
+
+    if VECTOR_BINARY_QUANTIZATION:
+        create_binary_indexes(cursor, rebuild, concurrently)
+
+def create_binary_indexes(cursor, rebuild: bool = False, concurrently: bool = False):
+    """Hamming-distance ANN index on each binary-quantized embedding column"""
+    create = "CREATE INDEX CONCURRENTLY" if concurrently else "CREATE INDEX"
+    for table in VECTOR_INDEXED_COLUMNS:
+        existing = _existing_vector_indexes(cursor, table, BINARY_COLUMN)
+        if rebuild:
+            for index in existing:
+                cursor.execute(f"DROP INDEX IF EXISTS {index}")
+                print(f" Dropped binary index {index}")
+            existing = []
+        if VECTOR_INDEX_TYPE == 'none' or existing:
+            continue
+
+        name = f"{table}_{BINARY_COLUMN}_{VECTOR_INDEX_TYPE}_idx"
+        print(f" Building {VECTOR_INDEX_TYPE} index {name} on {table}.{BINARY_COLUMN}...")
+        cursor.execute(f"""
+            {create} IF NOT EXISTS {name}
+            ON {table} USING {VECTOR_INDEX_TYPE} ({BINARY_COLUMN} bit_hamming_ops)
+            WITH {_index_with_clause(cursor, table)}
+        """)
+        print(f" Binary index {name} ready.")
+
+# table -> text column behind its generated search_vector (full-text keyword search)
+FULL_TEXT_COLUMNS = {
+    'document_chunks': 'chunk_text',
+    'extracted_tables': 'table_as_text',
+}
+
+def ensure_full_text_search(cursor):
+    """
+    Add the generated search_vector column and its GIN index to tables created
+    before full-text search existed. No-op when they are already present.
+    """
+    for table, column in FULL_TEXT_COLUMNS.items():
+        cursor.execute(f"""
+            ALTER TABLE {table}
+            ADD COLUMN IF NOT EXISTS search_vector tsvector
+            GENERATED ALWAYS AS ({search_vector_expression(column)}) STORED
+        """)
+        cursor.execute(f"""
+            CREATE INDEX IF NOT EXISTS {table}_search_vector_idx
+            ON {table} USING gin (search_vector)
+        """)
+        print(f" Full-text search column and GIN index ready on {table}.")
+
+def _column_type(cursor, table: str, column: str) -> Optional[str]:
+    """SQL type of table.column as Postgres prints it (e.g. 'vector(1536)'), or None"""
+    cursor.execute("""
+        SELECT format_type(a.atttypid, a.atttypmod)
+        FROM pg_attribute a
+        JOIN pg_class t ON t.oid = a.attrelid
+        WHERE t.relname = %s AND a.attname = %s AND NOT a.attisdropped
+    """, (table, column))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def ensure_vector_storage(cursor):
+    """
+    Convert the embedding columns to PG_VECTOR_STORAGE(EMBEDDING_DIMENSIONS) and add
+    the generated binary-quantized column when PG_VECTOR_BINARY is set.
+
+    Longer text-embedding-3 vectors are shortened in place by truncating and
+    re-normalizing them, which is what the API's `dimensions` parameter does;
+    growing the dimension count needs the documents re-ingested.
+    Expects an autocommit cursor.
+    """
+    if VECTOR_STORAGE != 'vector' or VECTOR_BINARY_QUANTIZATION:
+        cursor.execute("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        row = cursor.fetchone()
+        if row and tuple(int(part) for part in row[0].split('.')[:2]) < (0, 7):
+            raise RuntimeError(f"halfvec and binary quantization need pgvector >= 0.7 (installed: {row[0]})")
+
+    for table, column in VECTOR_INDEXED_COLUMNS.items():
+        current = _column_type(cursor, table, column)
+        if current and current != VECTOR_SQL_TYPE:
+            match = re.search(r'\((\d+)\)', current)
+            current_dimensions = int(match.group(1)) if match else 0
+            if current_dimensions == EMBEDDING_DIMENSIONS:
+                using = f"{column}::{VECTOR_SQL_TYPE}"
+            elif current_dimensions > EMBEDDING_DIMENSIONS:
+                using = f"l2_normalize(subvector({column}::vector, 1, {EMBEDDING_DIMENSIONS}))::{VECTOR_SQL_TYPE}"
+            else:
+                raise RuntimeError(f"{table}.{column} is {current}; re-ingest the documents to store {VECTOR_SQL_TYPE}")
+
+            # The ANN indexes and the generated binary column depend on the column type
+            for index in _existing_vector_indexes(cursor, table, column):
+                cursor.execute(f"DROP INDEX IF EXISTS {index}")
+            cursor.execute(f"ALTER TABLE {table} DROP COLUMN IF EXISTS {BINARY_COLUMN}")
+            print(f" Converting {table}.{column} from {current} to {VECTOR_SQL_TYPE}...")
+            cursor.execute(f"ALTER TABLE {table} ALTER COLUMN {column} TYPE {VECTOR_SQL_TYPE} USING {using}")
+
+        if VECTOR_BINARY_QUANTIZATION:
+            cursor.execute(f"""
+                ALTER TABLE {table}
+                ADD COLUMN IF NOT EXISTS {BINARY_COLUMN} bit({EMBEDDING_DIMENSIONS})
+                GENERATED ALWAYS AS (binary_quantize({column})::bit({EMBEDDING_DIMENSIONS})) STORED
+            """)
+        binary_note = f" with binary column {BINARY_COLUMN}" if VECTOR_BINARY_QUANTIZATION else ""
+        print(f" {table}.{column} stored as {VECTOR_SQL_TYPE}{binary_note}.")
+
+def ensure_ingest_tracking(cursor):
+    """Add the ingestion hash columns to databases created before they existed"""
+    cursor.execute("ALTER TABLE documents ADD COLUMN IF NOT EXISTS file_hash VARCHAR(64)")
+    cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS documents_file_hash_key ON documents (file_hash)")
+    cursor.execute("ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR(64)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS ix_document_chunks_content_hash ON document_chunks (content_hash)")
+    print(" Ingestion tracking (documents.file_hash, document_chunks.content_hash) ready.")
+
+# Advisory lock key shared by every deferred-index loader (shared while loading;
+# exclusive for the final rebuild, so only the last concurrent loader rebuilds)
+DEFERRED_INDEX_LOCK_KEY = 734215091
+
+@contextmanager
+def deferred_vector_indexes():
+    """
+    Drop the ANN indexes for the duration of a large load and build them once
+    afterwards: one bulk hnsw/ivfflat build is far cheaper than maintaining the
+    index row by row. The indexes cover the whole tables, so every query runs
+    as an exact scan meanwhile: meant for offline loads, not a serving database.
+
+    Each loader holds a shared advisory lock while it loads. When it finishes it
+    tries the lock exclusively; only the last concurrent loader gets it and
+    rebuilds, with CREATE INDEX CONCURRENTLY so other writers aren't blocked.
+    The indexes are rebuilt even if the load fails.
+    """
+    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, dbname=DB_NAME)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with conn.cursor() as cursor:
+            # Waits while another loader's rebuild holds the lock exclusively
+            cursor.execute("SELECT pg_advisory_lock_shared(%s)", (DEFERRED_INDEX_LOCK_KEY,))
+            for table, column in VECTOR_INDEXED_COLUMNS.items():
+                for indexed_column in (column, BINARY_COLUMN):
+                    for index in _existing_vector_indexes(cursor, table, indexed_column):
+                        cursor.execute(f"DROP INDEX CONCURRENTLY IF EXISTS {index}")
+                        print(f" Deferred vector index {index} until the load finishes")
+        yield
+    finally:
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT pg_advisory_unlock_shared(%s)", (DEFERRED_INDEX_LOCK_KEY,))
+                cursor.execute("SELECT pg_try_advisory_lock(%s)", (DEFERRED_INDEX_LOCK_KEY,))
+                if cursor.fetchone()[0]:
+                    try:
+                        create_vector_indexes(cursor, concurrently=True)
+                        for table in VECTOR_INDEXED_COLUMNS:
+                            cursor.execute(f"ANALYZE {table}")
+                    finally:
+                        cursor.execute("SELECT pg_advisory_unlock(%s)", (DEFERRED_INDEX_LOCK_KEY,))
+                else:
+                    print(" Another load is still running with deferred indexes; it will rebuild them")
+        except Exception as e:
+            print(f" Could not rebuild vector indexes ({e}); run `python db.py reindex`")
+        finally:
+            conn.close()
+
+def rebuild_vector_indexes():
+    """Drop and recreate the ANN indexes with the current settings"""
+    conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, dbname=DB_NAME)
+    conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+    try:
+        with conn.cursor() as cursor:
+            create_vector_indexes(cursor, rebuild=True)
+            for table in VECTOR_INDEXED_COLUMNS:
+                cursor.execute(f"ANALYZE {table}")
+    finally:
+        conn.close()
+    print(" Vector indexes rebuilt.")
+
 def setup_database():
     print("Starting automatic database setup...")
     
     try:
-        conn = psycopg2.connect(host=DB_HOST, user=DB_USER, password=DB_PASS, dbname='postgres')
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, dbname='postgres')
         conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
         cursor = conn.cursor()
         
@@ -51,7 +500,7 @@ def setup_database():
 
 
     try:
-        conn = psycopg2.connect(host=DB_HOST, user=DB_USER, password=DB_PASS, dbname=DB_NAME)
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, dbname=DB_NAME)
         conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
         cursor = conn.cursor()
         
@@ -71,15 +520,34 @@ def setup_database():
 
     try:
         print("Creating tables from models.py...")
-        # The engine is already configured with the correct DATABASE_URL
-        Base.metadata.create_all(bind=engine)
+        # The engine is configured with the correct DATABASE_URL
+        Base.metadata.create_all(bind=get_engine())
         print(" All tables created successfully (if they didn't already exist).")
     except Exception as e:
         print(f" An error occurred while creating tables: {e}")
         return
+
+    try:
+        conn = psycopg2.connect(host=DB_HOST, port=DB_PORT, user=DB_USER, password=DB_PASS, dbname=DB_NAME)
+        conn.set_isolation_level(ISOLATION_LEVEL_AUTOCOMMIT)
+        cursor = conn.cursor()
+
+        ensure_full_text_search(cursor)
+        ensure_ingest_tracking(cursor)
+        ensure_vector_storage(cursor)
+        create_vector_indexes(cursor)
+
+        cursor.close()
+        conn.close()
+    except Exception as e:
+        print(f" An error occurred while creating search indexes: {e}")
+        return
         
     print("\n Database setup is complete and correct.")
 
 if __name__ == "__main__":
-    # This allows you to run `python db.py` to set up everything.
-    setup_database()
+    # `python db.py` sets up everything; `python db.py reindex` rebuilds the vector indexes.
+    if len(sys.argv) > 1 and sys.argv[1] == 'reindex':
+        rebuild_vector_indexes()
+    else:
+        setup_database()
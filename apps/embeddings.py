@@ -0,0 +1,436 @@
+import os
+import time
+import asyncio
+import sqlite3
+import hashlib
+import threading
+from array import array
+from pathlib import Path
+from typing import List, Optional, Dict, Any
+
+# OpenAI accepts up to 2048 inputs and ~300k tokens per embeddings request;
+# stay well under both so one oversized batch can't fail the whole flush.
+EMBED_BATCH_MAX_TOKENS = int(os.getenv('EMBED_BATCH_MAX_TOKENS', '100000'))
+EMBED_BATCH_MAX_INPUTS = int(os.getenv('EMBED_BATCH_MAX_INPUTS', '1024'))
+EMBED_MAX_RETRIES = int(os.getenv('EMBED_MAX_RETRIES', '3'))
+
+# On-disk cache shared by ingest and query; set EMBEDDING_CACHE_PATH= (empty) to disable
+EMBEDDING_CACHE_PATH = os.getenv('EMBEDDING_CACHE_PATH', str(Path(__file__).parent / 'cache' / 'embeddings.sqlite3'))
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv('EMBEDDING_CACHE_MAX_ENTRIES', '500000'))
+
+# Length of stored embeddings. text-embedding-3 models can return shortened vectors
+# (the `dimensions` parameter), which shrinks tables and ANN indexes.
+EMBEDDING_DIMENSIONS = int(os.getenv('EMBEDDING_DIMENSIONS', '1536'))
+NATIVE_DIMENSIONS = {
+    'text-embedding-3-small': 1536,
+    'text-embedding-3-large': 3072,
+}
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so equal content always embeds (and caches) the same way"""
+    return " ".join(text.split()) if text else ""
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token) used for batch sizing"""
+    return len(text) // 4 + 1
+
+
+def dimension_kwargs(model: str, dimensions: Optional[int]) -> Dict[str, int]:
+    """`dimensions` argument for embeddings.create, omitted when it is the model's native size"""
+    if not dimensions or dimensions == NATIVE_DIMENSIONS.get(model):
+        return {}
+    return {'dimensions': dimensions}
+
+
+def cache_namespace(model: str, dimensions: Optional[int]) -> str:
+    """Cache key prefix; shortened vectors must not collide with full-length ones"""
+    return f"{model}:{dimensions}" if dimension_kwargs(model, dimensions) else model
+
+
+def make_batches(items: List[tuple],
+                 max_batch_tokens: int = EMBED_BATCH_MAX_TOKENS,
+                 max_batch_inputs: int = EMBED_BATCH_MAX_INPUTS) -> List[List[tuple]]:
+    """Split (key, text) pairs into request batches under the token and input caps"""
+    batches = []
+    current = []
+    current_tokens = 0
+
+    for item in items:
+        tokens = estimate_tokens(item[1])
+        if current and (current_tokens + tokens > max_batch_tokens
+                        or len(current) >= max_batch_inputs):
+            batches.append(current)
+            current = []
+            current_tokens = 0
+        current.append(item)
+        current_tokens += tokens
+
+    if current:
+        batches.append(current)
+    return batches
+
+
+def vectors_in_input_order(response, count: int) -> List[Optional[List[float]]]:
+    """The API tags each vector with the index of its input; don't rely on list order"""
+    vectors = [None] * count
+    for item in response.data:
+        vectors[item.index] = item.embedding
+    return vectors
+
+
+def is_rejected_request(error: Optional[Exception]) -> bool:
+    """400: the request itself was rejected (e.g. one input too long); retrying won't help"""
+    return getattr(error, 'status_code', None) == 400
+
+
+def retry_backoff(retry_delay: float, attempt: int) -> float:
+    return retry_delay * (2 ** attempt)
+
+
+class EmbeddingCache:
+    """
+    Persistent content-addressed embedding cache backed by SQLite.
+
+    Entries are keyed by model name plus a SHA-256 of the normalized text and
+    evicted least-recently-used once the cache grows past `max_entries`.
+    Safe to share between threads; several processes may use the same file.
+    """
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        with self._lock:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("""
+                CREATE TABLE IF NOT EXISTS embeddings (
+                    key TEXT PRIMARY KEY,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL,
+                    last_used REAL NOT NULL
+                )
+            """)
+            self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            self._conn.commit()
+            self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def make_key(model: str, text: str) -> str:
+        return hashlib.sha256(f"{model}\n{normalize_text(text)}".encode('utf-8')).hexdigest()
+
+    def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Look up several texts at once; misses come back as None"""
+        keys = [self.make_key(model, text) for text in texts]
+        found = {}
+
+        with self._lock:
+            unique_keys = list(set(keys))
+            # Stay under SQLite's bound-parameter limit
+            for i in range(0, len(unique_keys), 500):
+                batch = unique_keys[i:i + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = array('f', blob).tolist()
+
+                hit_keys = [key for key, _ in rows]
+                if hit_keys:
+                    self._conn.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE key IN ({','.join('?' * len(hit_keys))})",
+                        [time.time()] + hit_keys
+                    )
+            self._conn.commit()
+
+            results = [found.get(key) for key in keys]
+            hits = sum(1 for vector in results if vector is not None)
+            self.hits += hits
+            self.misses += len(results) - hits
+        return results
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        return self.get_many(model, [text])[0]
+
+    def put_many(self, model: str, items: List[tuple]):
+        """Store (text, vector) pairs"""
+        rows = [
+            (self.make_key(model, text), model, array('f', vector).tobytes(), time.time())
+            for text, vector in items if vector
+        ]
+        if not rows:
+            return
+
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, model, vector, last_used) VALUES (?, ?, ?, ?)", rows
+            )
+            self._entries += self._conn.total_changes - before
+            if self._entries > self.max_entries:
+                self._evict()
+            self._conn.commit()
+
+    def put(self, model: str, text: str, vector: List[float]):
+        self.put_many(model, [(text, vector)])
+
+    def _evict(self):
+        """Drop least-recently-used entries down to 90% of capacity (caller holds the lock)"""
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        excess = self._entries - int(self.max_entries * 0.9)
+        if excess <= 0:
+            return
+        self._conn.execute("""
+            DELETE FROM embeddings WHERE key IN (
+                SELECT key FROM embeddings ORDER BY last_used LIMIT ?
+            )
+        """, (excess,))
+        self._entries -= excess
+        self.evictions += excess
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': self._entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'evictions': self.evictions,
+        }
+
+
+_embedding_cache = None
+_embedding_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache, or None when caching is disabled"""
+    global _embedding_cache
+    if not EMBEDDING_CACHE_PATH:
+        return None
+    with _embedding_cache_lock:
+        if _embedding_cache is None:
+            try:
+                _embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH)
+            except Exception as e:
+                print(f" Embedding cache unavailable ({e}); continuing without it")
+                return None
+        return _embedding_cache
+
+
+class EmbeddingBatcher:
+    """
+    Collects texts and embeds them with as few `embeddings.create` calls as possible.
+
+    Texts are queued with `add()`, which returns a ticket. `flush()` sends the
+    pending texts as list inputs sized to a token budget, and `result(ticket)`
+    returns the vector (or None if the text was empty or could not be embedded).
+    Texts found in the embedding cache are answered without a request.
+    """
+
+    def __init__(self,
+                 client,
+                 model: str = "text-embedding-3-small",
+                 max_batch_tokens: int = EMBED_BATCH_MAX_TOKENS,
+                 max_batch_inputs: int = EMBED_BATCH_MAX_INPUTS,
+                 max_retries: int = EMBED_MAX_RETRIES,
+                 retry_delay: float = 1.0,
+                 cache: Optional[EmbeddingCache] = None,
+                 dimensions: Optional[int] = EMBEDDING_DIMENSIONS):
+        self.client = client
+        self.cache = cache
+        self.model = model
+        self.dimensions = dimensions
+        self.cache_model = cache_namespace(model, dimensions)
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_inputs = max_batch_inputs
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+
+        self._pending: List[tuple] = []  # (ticket, normalized text)
+        self._results: Dict[int, Optional[List[float]]] = {}
+        self._next_ticket = 0
+        self.stats = {'requests': 0, 'inputs': 0, 'failed_requests': 0}
+
+    def add(self, text: str) -> int:
+        """Queue text for embedding and return its ticket"""
+        ticket = self._next_ticket
+        self._next_ticket += 1
+
+        text = normalize_text(text)
+        if text:
+            self._pending.append((ticket, text))
+        else:
+            self._results[ticket] = None
+        return ticket
+
+    def result(self, ticket: int) -> Optional[List[float]]:
+        """Return (and forget) the embedding for a flushed ticket"""
+        return self._results.pop(ticket, None)
+
+    @property
+    def pending_count(self) -> int:
+        return len(self._pending)
+
+    def flush(self):
+        """Embed every pending text"""
+        if not self._pending:
+            return
+
+        pending, self._pending = self._pending, []
+
+        if self.cache is not None:
+            cached = self.cache.get_many(self.cache_model, [text for _, text in pending])
+            misses = []
+            for (ticket, text), vector in zip(pending, cached):
+                if vector is not None:
+                    self._results[ticket] = vector
+                else:
+                    misses.append((ticket, text))
+            pending = misses
+
+        # Identical texts queued more than once are only sent once
+        by_text: Dict[str, List[int]] = {}
+        for ticket, text in pending:
+            by_text.setdefault(text, []).append(ticket)
+        unique = [(tickets[0], text) for text, tickets in by_text.items()]
+
+        for batch in make_batches(unique, self.max_batch_tokens, self.max_batch_inputs):
+            self._embed_batch(batch)
+
+        for text, tickets in by_text.items():
+            for ticket in tickets[1:]:
+                self._results[ticket] = self._results.get(tickets[0])
+
+        if self.cache is not None:
+            self.cache.put_many(self.cache_model, [
+                (text, self._results.get(tickets[0])) for text, tickets in by_text.items()
+            ])
+
+    def embed(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed a list of texts in as few requests as possible, preserving order"""
+        tickets = [self.add(text) for text in texts]
+        self.flush()
+        return [self.result(ticket) for ticket in tickets]
+
+    def _request(self, texts: List[str]) -> List[List[float]]:
+        response = self.client.embeddings.create(model=self.model, input=texts,
+                                                 **dimension_kwargs(self.model, self.dimensions))
+        self.stats['requests'] += 1
+        self.stats['inputs'] += len(texts)
+        return vectors_in_input_order(response, len(texts))
+
+    def _embed_batch(self, batch: List[tuple]):
+        """Embed one batch, retrying transient failures and bisecting rejected inputs"""
+        texts = [text for _, text in batch]
+        last_error = None
+
+        for attempt in range(self.max_retries):
+            try:
+                vectors = self._request(texts)
+                for (ticket, _), vector in zip(batch, vectors):
+                    self._results[ticket] = vector
+                return
+            except Exception as e:
+                last_error = e
+                self.stats['failed_requests'] += 1
+                if is_rejected_request(e):
+                    break
+                if attempt < self.max_retries - 1:
+                    time.sleep(retry_backoff(self.retry_delay, attempt))
+
+        if len(batch) > 1 and is_rejected_request(last_error):
+            # Re-send the halves independently so one bad input doesn't drop its neighbours
+            middle = len(batch) // 2
+            self._embed_batch(batch[:middle])
+            self._embed_batch(batch[middle:])
+            return
+
+        print(f" Error getting embeddings for {len(batch)} text(s): {str(last_error)[:100]}...")
+        for ticket, _ in batch:
+            self._results[ticket] = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return dict(self.stats)
+
+
+async def async_embed_batch(client, model: str, texts: List[str],
+                            dimensions: Optional[int] = EMBEDDING_DIMENSIONS,
+                            max_retries: int = EMBED_MAX_RETRIES,
+                            retry_delay: float = 1.0) -> List[Optional[List[float]]]:
+    """
+    Async counterpart of EmbeddingBatcher._embed_batch: retries transient failures
+    with backoff and bisects rejected (400) batches. Failed inputs come back as None.
+    """
+    last_error = None
+    for attempt in range(max_retries):
+        try:
+            response = await client.embeddings.create(model=model, input=texts,
+                                                      **dimension_kwargs(model, dimensions))
+            return vectors_in_input_order(response, len(texts))
+        except Exception as e:
+            last_error = e
+            if is_rejected_request(e):
+                break
+            if attempt < max_retries - 1:
+                await asyncio.sleep(retry_backoff(retry_delay, attempt))
+
+    if len(texts) > 1 and is_rejected_request(last_error):
+        # Re-send the halves independently so one bad input doesn't drop its neighbours
+        middle = len(texts) // 2
+        halves = await asyncio.gather(
+            async_embed_batch(client, model, texts[:middle], dimensions, max_retries, retry_delay),
+            async_embed_batch(client, model, texts[middle:], dimensions, max_retries, retry_delay),
+        )
+        return halves[0] + halves[1]
+
+    print(f" Error getting embeddings for {len(texts)} text(s): {str(last_error)[:100]}...")
+    return [None] * len(texts)
+
+
+async def async_embed_texts(client, model: str, texts: List[str],
+                            cache: Optional[EmbeddingCache] = None,
+                            dimensions: Optional[int] = EMBEDDING_DIMENSIONS) -> List[Optional[List[float]]]:
+    """
+    Async counterpart of EmbeddingBatcher.embed for an `openai.AsyncOpenAI` client.
+    Cache misses are sent as list inputs (same batching and retries as the batcher);
+    batches run concurrently. SQLite cache I/O runs in a worker thread, off the event loop.
+    """
+    normalized = [normalize_text(text) for text in texts]
+    results: List[Optional[List[float]]] = [None] * len(texts)
+    namespace = cache_namespace(model, dimensions)
+
+    wanted = [i for i, text in enumerate(normalized) if text]
+    if cache is not None and wanted:
+        cached = await asyncio.to_thread(cache.get_many, namespace, [normalized[i] for i in wanted])
+        for i, vector in zip(wanted, cached):
+            results[i] = vector
+
+    by_text: Dict[str, List[int]] = {}
+    for i in wanted:
+        if results[i] is None:
+            by_text.setdefault(normalized[i], []).append(i)
+    if not by_text:
+        return results
+
+    batches = make_batches(list(enumerate(by_text)))
+    embedded = []
+    for batch, vectors in zip(batches, await asyncio.gather(
+            *(async_embed_batch(client, model, [text for _, text in batch], dimensions) for batch in batches))):
+        embedded.extend((text, vector) for (_, text), vector in zip(batch, vectors) if vector is not None)
+
+    for text, vector in embedded:
+        for i in by_text[text]:
+            results[i] = vector
+    if cache is not None and embedded:
+        await asyncio.to_thread(cache.put_many, namespace, embedded)
+    return results
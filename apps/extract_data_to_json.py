@@ -1,67 +1,169 @@
 import json
+import os
 import re
-import base64
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
-from typing import Dict, List, Any
-import hashlib
+from types import SimpleNamespace
+from typing import Dict, List, Any, NamedTuple, Optional, Tuple
+from image_store import ImageStore, get_image_store
+
+# Worker processes for page extraction (1 = serial in the calling process)
+EXTRACT_WORKERS = int(os.getenv('EXTRACT_WORKERS', '1'))
+# Documents with fewer pages are extracted serially; a pool costs more than it saves there
+EXTRACT_PARALLEL_MIN_PAGES = int(os.getenv('EXTRACT_PARALLEL_MIN_PAGES', '64'))
+
+# Paragraphs of this many characters or fewer are dropped as OCR noise
+MIN_PARAGRAPH_CHARS = 10
+
+# Line-level patterns; each is anchored and its repeated parts cannot overlap, so
+# matching is linear in the line length
+FOOTNOTE_DEFINITION = re.compile(r'\[\^([^\]\n]+)\]:[ \t]*')
+IMAGE_REF_LINE = re.compile(r'(?:!\[[^\]\n]*\]\([^)\n]*\)[ \t]*)+')
+IMAGE_REF = re.compile(r'!\[([^\]\n]*)\]\(([^)\n]*)\)')
+
+
+class MarkdownBlock(NamedTuple):
+    kind: str  # 'paragraph', 'table', 'footnote' or 'image'
+    text: str
+    data: Optional[Dict] = None  # table: the raw lines; footnote: label; image: alt and target
+
+
+def is_table_row(stripped: str) -> bool:
+    return stripped.startswith('|') and stripped.endswith('|')
+
+
+def tokenize_markdown(text: str) -> List[MarkdownBlock]:
+    """
+    Split OCR markdown into blocks in document order, in a single pass over its lines:
+    - table: a run of 2+ lines that start and end with '|' (a lone '|' line stays text)
+    - footnote: '[^label]: text', plus indented continuation lines
+    - image: a line holding only image references ('![alt](target)')
+    - paragraph: everything else, split on blank lines, whitespace collapsed,
+      MIN_PARAGRAPH_CHARS or fewer dropped
+    """
+    blocks = []
+    paragraph = []
+    table_rows = []
+    footnote = None  # (label, lines)
+
+    def flush_paragraph():
+        if paragraph:
+            joined = " ".join(paragraph)
+            if len(joined) > MIN_PARAGRAPH_CHARS:
+                blocks.append(MarkdownBlock('paragraph', " ".join(joined.split())))
+            paragraph.clear()
+
+    def flush_footnote():
+        nonlocal footnote
+        if footnote is not None:
+            label, lines = footnote
+            blocks.append(MarkdownBlock('footnote', " ".join(" ".join(lines).split()), {'label': label}))
+            footnote = None
+
+    def flush_table():
+        if len(table_rows) >= 2:
+            flush_paragraph()
+            blocks.append(MarkdownBlock('table', '\n'.join(table_rows), {'lines': list(table_rows)}))
+        else:
+            paragraph.extend(row.strip() for row in table_rows)
+        table_rows.clear()
+
+    for line in text.split('\n'):
+        stripped = line.strip()
+
+        if stripped and is_table_row(stripped):
+            flush_footnote()
+            table_rows.append(line)
+            continue
+        if table_rows:
+            flush_table()
+
+        if not stripped:
+            flush_paragraph()
+            flush_footnote()
+            continue
+
+        if footnote is not None and line[:1] in (' ', '\t'):
+            footnote[1].append(stripped)
+            continue
+        flush_footnote()
+
+        if stripped.startswith('[^'):
+            match = FOOTNOTE_DEFINITION.match(stripped)
+            if match:
+                flush_paragraph()
+                footnote = (match.group(1), [stripped[match.end():]])
+                continue
+
+        if stripped.startswith('![') and IMAGE_REF_LINE.fullmatch(stripped):
+            flush_paragraph()
+            for ref in IMAGE_REF.finditer(stripped):
+                blocks.append(MarkdownBlock('image', ref.group(2), {'alt': ref.group(1)}))
+            continue
+
+        paragraph.append(stripped)
+
+    if table_rows:
+        flush_table()
+    flush_paragraph()
+    flush_footnote()
+    return blocks
+
+
+# (page_number, markdown, [(image_base64, bbox)]): all a worker needs to extract a page
+PagePayload = Tuple[int, str, List[Tuple[str, Any]]]
+
+_worker_extractor = None
+
+
+def page_payload(page, page_num: int) -> PagePayload:
+    """Only the page's markdown and image payloads, so workers get a small picklable tuple"""
+    images = [(image.image_base64, getattr(image, 'bbox', None)) for image in page.images]
+    return page_num, page.markdown, images
+
+
+def _init_extract_worker(image_store_root: str):
+    global _worker_extractor
+    _worker_extractor = PDFDataExtractor(ImageStore(image_store_root))
+
+
+def _extract_page_payload(payload: PagePayload) -> Dict:
+    page_num, markdown, images = payload
+    page = SimpleNamespace(
+        markdown=markdown,
+        images=[SimpleNamespace(image_base64=data, bbox=bbox) for data, bbox in images]
+    )
+    page_data = _worker_extractor.extract_page_data(page, page_num)
+    # The parent still holds the markdown; don't pickle it back
+    del page_data['raw_markdown']
+    return page_data
+
 
 class PDFDataExtractor:
-    def __init__(self):
-        self.table_patterns = [
-            r'\|.*?\|',  # Markdown table pattern
-            r'\+[-=]+\+',  # ASCII table borders
-            r'(?:(?:\S+\s*){2,}(?:\n|$)){3,}',  # Columnar data pattern
-        ]
-        
-    def extract_tables_from_text(self, text: str) -> List[Dict]:
-        """Extract tables from markdown text"""
+    def __init__(self, image_store: ImageStore = None):
+        # Images are decoded once into the content-addressed store; page data only references them
+        self.image_store = image_store or get_image_store()
+    
+    def table_entries(self, blocks: List[MarkdownBlock]) -> List[Dict]:
+        """Structured tables for the table blocks, numbered in page order"""
         tables = []
-        lines = text.split('\n')
-        
-        # Look for markdown tables
-        table_start = None
-        current_table_lines = []
-        
-        for i, line in enumerate(lines):
-            # Check if line contains table markers
-            if '|' in line and line.strip().startswith('|') and line.strip().endswith('|'):
-                if table_start is None:
-                    table_start = i
-                    current_table_lines = [line]
-                else:
-                    current_table_lines.append(line)
-            else:
-                # End of table or no table
-                if table_start is not None and len(current_table_lines) >= 2:
-                    # Process the table
-                    table_data = self.parse_markdown_table(current_table_lines)
-                    if table_data:
-                        tables.append({
-                            'table_id': f'table_{len(tables) + 1}',
-                            'type': 'markdown_table',
-                            'headers': table_data.get('headers', []),
-                            'rows': table_data.get('rows', []),
-                            'raw_text': '\n'.join(current_table_lines)
-                        })
-                
-                # Reset table tracking
-                table_start = None
-                current_table_lines = []
-        
-        # Handle last table if exists
-        if table_start is not None and len(current_table_lines) >= 2:
-            table_data = self.parse_markdown_table(current_table_lines)
-            if table_data:
-                tables.append({
-                    'table_id': f'table_{len(tables) + 1}',
-                    'type': 'markdown_table',
-                    'headers': table_data.get('headers', []),
-                    'rows': table_data.get('rows', []),
-                    'raw_text': '\n'.join(current_table_lines)
-                })
-        
+        for block in blocks:
+            if block.kind != 'table':
+                continue
+            table_data = self.parse_markdown_table(block.data['lines'])
+            tables.append({
+                'table_id': f'table_{len(tables) + 1}',
+                'type': 'markdown_table',
+                'headers': table_data.get('headers', []),
+                'rows': table_data.get('rows', []),
+                'raw_text': block.text
+            })
         return tables
     
+    def extract_tables_from_text(self, text: str) -> List[Dict]:
+        """Extract tables from markdown text"""
+        return self.table_entries(tokenize_markdown(text))
+    
     def parse_markdown_table(self, table_lines: List[str]) -> Dict:
         """Parse markdown table into structured format"""
         if len(table_lines) < 2:
@@ -89,24 +191,9 @@ class PDFDataExtractor:
             'rows': data_rows
         }
     
-    def extract_paragraphs(self, text: str, tables: List[Dict]) -> List[str]:
-        """Extract paragraphs, excluding table content"""
-        # Remove table content from text
-        clean_text = text
-        for table in tables:
-            clean_text = clean_text.replace(table['raw_text'], '')
-        
-        # Split into paragraphs
-        paragraphs = []
-        for para in clean_text.split('\n\n'):
-            para = para.strip()
-            if para and len(para) > 10:  # Filter out very short content
-                # Clean up the paragraph
-                para = re.sub(r'\n+', ' ', para)  # Replace multiple newlines with space
-                para = re.sub(r'\s+', ' ', para)  # Replace multiple spaces with single space
-                paragraphs.append(para)
-        
-        return paragraphs
+    def extract_paragraphs(self, text: str, tables: List[Dict] = None) -> List[str]:
+        """Extract paragraphs, excluding table content (tables are recognized by the tokenizer)"""
+        return [block.text for block in tokenize_markdown(text) if block.kind == 'paragraph']
     
     def process_images(self, images: List, page_num: int) -> List[Dict]:
         """Process images from a page"""
@@ -114,16 +201,16 @@ class PDFDataExtractor:
         
         for i, image in enumerate(images):
             try:
-                # Generate image hash for unique identification
-                image_data = base64.b64decode(image.image_base64.split(',')[1])
-                image_hash = hashlib.md5(image_data).hexdigest()
+                # Decode once into the image store; the hash identifies the image across pages and documents
+                stored = self.image_store.put_data_uri(image.image_base64)
                 
                 image_info = {
                     'image_id': f'page_{page_num}_image_{i + 1}',
-                    'image_hash': image_hash,
+                    'image_hash': stored['image_hash'],
                     'filename': f'page_{page_num:03d}_image_{i + 1:03d}.png',
-                    'size_bytes': len(image_data),
-                    'base64_data': image.image_base64,  # Keep full base64 for storage
+                    'size_bytes': stored['size_bytes'],
+                    'image_path': stored['image_path'],  # base64 is no longer carried in the JSON
+                    'mime_type': stored['mime_type'],
                     'position': {
                         'page': page_num,
                         'image_index': i
@@ -146,11 +233,15 @@ class PDFDataExtractor:
         # Get raw text
         raw_text = page.markdown
         
-        # Extract tables
-        tables = self.extract_tables_from_text(raw_text)
-        
-        # Extract paragraphs (excluding table content)
-        paragraphs = self.extract_paragraphs(raw_text, tables)
+        # One pass over the markdown yields paragraphs, tables, footnotes and image refs in order
+        blocks = tokenize_markdown(raw_text)
+        tables = self.table_entries(blocks)
+        paragraphs = [block.text for block in blocks if block.kind == 'paragraph']
+        footnotes = [
+            {'label': block.data['label'], 'text': block.text}
+            for block in blocks if block.kind == 'footnote'
+        ]
+        image_refs = [block.text for block in blocks if block.kind == 'image']
         
         # Process images
         images = self.process_images(page.images, page_num)
@@ -160,20 +251,43 @@ class PDFDataExtractor:
             'page_number': page_num,
             'paragraphs': paragraphs,
             'tables': tables,
+            'footnotes': footnotes,
+            'image_refs': image_refs,
             'images': images,
             'metadata': {
                 'paragraph_count': len(paragraphs),
                 'table_count': len(tables),
+                'footnote_count': len(footnotes),
                 'image_count': len(images),
                 'total_characters': len(raw_text),
-                'has_content': len(paragraphs) > 0 or len(tables) > 0 or len(images) > 0
+                'has_content': len(paragraphs) > 0 or len(tables) > 0 or len(images) > 0 or len(footnotes) > 0
             },
             'raw_markdown': raw_text  # Keep original for reference
         }
         
         return page_data
     
-    def extract_full_document(self, response) -> Dict:
+    def extract_pages(self, pages, workers: int = None) -> List[Dict]:
+        """
+        Extract every page, in page order. With workers > 1 (capped at the CPU
+        count) and at least EXTRACT_PARALLEL_MIN_PAGES pages, pages are extracted
+        on a process pool; workers write images to the same image store root.
+        """
+        workers = min(EXTRACT_WORKERS if workers is None else workers, os.cpu_count() or 1)
+        if workers <= 1 or len(pages) < EXTRACT_PARALLEL_MIN_PAGES:
+            return [self.extract_page_data(page, i + 1) for i, page in enumerate(pages)]
+        
+        payloads = [page_payload(page, i + 1) for i, page in enumerate(pages)]
+        chunksize = max(1, len(payloads) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_extract_worker,
+                                 initargs=(str(self.image_store.root),)) as executor:
+            # map yields results in submission order, so page order does not depend on scheduling
+            page_data = list(executor.map(_extract_page_payload, payloads, chunksize=chunksize))
+        for data, page in zip(page_data, pages):
+            data['raw_markdown'] = page.markdown
+        return page_data
+    
+    def extract_full_document(self, response, workers: int = None) -> Dict:
         """Extract data from entire document"""
         document_data = {
             'document_metadata': {
@@ -183,16 +297,11 @@ class PDFDataExtractor:
                 'total_tables': 0,
                 'total_images': 0
             },
-            'pages': []
+            'pages': self.extract_pages(response.pages, workers)
         }
         
-        # Process each page
-        for i, page in enumerate(response.pages):
-            page_num = i + 1
-            page_data = self.extract_page_data(page, page_num)
-            document_data['pages'].append(page_data)
-            
-            # Update document metadata
+        # Update document metadata in page order
+        for page_data in document_data['pages']:
             document_data['document_metadata']['total_paragraphs'] += page_data['metadata']['paragraph_count']
             document_data['document_metadata']['total_tables'] += page_data['metadata']['table_count']
             document_data['document_metadata']['total_images'] += page_data['metadata']['image_count']
@@ -214,27 +323,30 @@ class PDFDataExtractor:
             print(f"Error saving JSON: {e}")
             return False
     
+    def db_ready_page(self, page: Dict) -> Dict:
+        """Database-ready view of one extracted page (no base64 image payloads)"""
+        return {
+            'page_number': page['page_number'],
+            # Footnotes are chunked with the page text so they stay searchable
+            'paragraphs': page['paragraphs'] + [
+                f"[^{note['label']}] {note['text']}" for note in page.get('footnotes', [])
+            ],
+            'tables': page['tables'],
+            'images': [
+                {
+                    'image_id': img['image_id'],
+                    'filename': img['filename'],
+                    'size_bytes': img['size_bytes'],
+                    'image_hash': img['image_hash'],
+                    'image_path': img['image_path']
+                } for img in page['images']
+            ],
+            'metadata': page['metadata']
+        }
+    
     def create_database_ready_json(self, document_data: Dict, output_path: str = "db_ready_data.json"):
         """Create a database-ready version with optimized structure"""
-        db_ready_data = []
-        
-        for page in document_data['pages']:
-            page_record = {
-                'page_number': page['page_number'],
-                'paragraphs': page['paragraphs'],
-                'tables': page['tables'],
-                'images': [
-                    {
-                        'image_id': img['image_id'],
-                        'filename': img['filename'],
-                        'size_bytes': img['size_bytes'],
-                        'image_hash': img['image_hash']
-                        # Note: base64_data removed for DB efficiency - store separately if needed
-                    } for img in page['images']
-                ],
-                'metadata': page['metadata']
-            }
-            db_ready_data.append(page_record)
+        db_ready_data = [self.db_ready_page(page) for page in document_data['pages']]
         
         # Save database-ready version
         try:
@@ -249,8 +361,8 @@ class PDFDataExtractor:
             print(f" Error saving database-ready JSON: {e}")
             return False
 
-def process_pdf_to_json(response, output_dir="output"):
-    """Main function to process PDF response and create JSON files"""
+def process_pdf_to_json(response, output_dir="output", workers: int = None):
+    """Main function to process PDF response and create JSON files (workers: see extract_pages)"""
     extractor = PDFDataExtractor()
     
     # Create output directory
@@ -260,7 +372,7 @@ def process_pdf_to_json(response, output_dir="output"):
     print(" Starting JSON extraction...")
     
     # Extract all data
-    document_data = extractor.extract_full_document(response)
+    document_data = extractor.extract_full_document(response, workers)
     
     # Save complete JSON
     complete_json_path = output_path / "extracted_data.json"
@@ -0,0 +1,142 @@
+import base64
+import hashlib
+import os
+import tempfile
+import threading
+from pathlib import Path
+from typing import Dict, Optional
+
+# Root of the content-addressed image store; anchored to this directory so stored
+# paths don't depend on the working directory ingestion ran from
+IMAGE_STORE_DIR = os.getenv('IMAGE_STORE_DIR', str(Path(__file__).parent / 'image_store'))
+
+MIME_EXTENSIONS = {
+    'image/png': '.png',
+    'image/jpeg': '.jpeg',
+    'image/jpg': '.jpeg',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+    'image/bmp': '.bmp',
+    'image/tiff': '.tiff',
+}
+EXTENSION_MIMES = {extension: mime for mime, extension in MIME_EXTENSIONS.items() if mime != 'image/jpg'}
+
+
+def split_data_uri(data_uri: str):
+    """'data:image/png;base64,AAA' -> ('image/png', 'AAA'); bare base64 is treated as PNG"""
+    if data_uri.startswith('data:') and ',' in data_uri:
+        header, encoded = data_uri.split(',', 1)
+        mime = header[5:].split(';', 1)[0] or 'image/png'
+        return mime, encoded
+    return 'image/png', data_uri
+
+
+class ImageStore:
+    """
+    Content-addressed image files: each image is decoded once and written to
+    <root>/<first two hex chars>/<sha256><ext>. Identical images on other pages
+    or in other documents resolve to the same file and are not written again.
+    Returned image paths are absolute.
+    Writes go through a temp file + rename, so concurrent workers are safe.
+    """
+
+    def __init__(self, root: str = IMAGE_STORE_DIR):
+        self.root = Path(root).resolve()
+        self._lock = threading.Lock()
+        self.stats = {'written': 0, 'deduplicated': 0, 'bytes_written': 0}
+
+    def path_for(self, digest: str, extension: str = '.png') -> Path:
+        return self.root / digest[:2] / f"{digest}{extension}"
+
+    def put(self, data: bytes, mime: str = 'image/png') -> Dict:
+        """Store raw image bytes and return their hash, path, size and mime type"""
+        digest = hashlib.sha256(data).hexdigest()
+        path = self.path_for(digest, MIME_EXTENSIONS.get(mime, '.bin'))
+
+        if path.exists():
+            with self._lock:
+                self.stats['deduplicated'] += 1
+        else:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                if os.path.exists(tmp_path):
+                    os.unlink(tmp_path)
+                raise
+            with self._lock:
+                self.stats['written'] += 1
+                self.stats['bytes_written'] += len(data)
+
+        return {
+            'image_hash': digest,
+            'image_path': str(path),
+            'size_bytes': len(data),
+            'mime_type': mime,
+        }
+
+    def put_data_uri(self, data_uri: str) -> Dict:
+        """Decode a base64 data URI (the only decode an image goes through) and store it"""
+        mime, encoded = split_data_uri(data_uri)
+        return self.put(base64.b64decode(encoded), mime)
+
+    def resolve(self, image_path: str) -> Path:
+        """
+        Path of a stored image. Relative paths recorded before paths were absolute
+        ('image_store/ab/<sha256>.png' against some earlier working directory) are
+        looked up under this store's root by their last two components.
+        """
+        path = Path(image_path)
+        if path.is_absolute() or path.exists():
+            return path
+        return self.root / path.parent.name / path.name
+
+    def read_bytes(self, image_path: str) -> bytes:
+        with open(self.resolve(image_path), 'rb') as f:
+            return f.read()
+
+    def to_data_uri(self, image_path: str, mime: Optional[str] = None) -> str:
+        """Re-encode a stored image for APIs that only accept data URIs"""
+        mime = mime or EXTENSION_MIMES.get(Path(image_path).suffix.lower(), 'image/png')
+        encoded = base64.b64encode(self.read_bytes(image_path)).decode('ascii')
+        return f"data:{mime};base64,{encoded}"
+
+    def export(self, image_path: str, destination) -> Path:
+        """Expose a stored image under another name (hard link, falling back to a copy)"""
+        destination = Path(destination)
+        destination.parent.mkdir(parents=True, exist_ok=True)
+        if destination.exists():
+            destination.unlink()
+        try:
+            os.link(self.resolve(image_path), destination)
+        except OSError:
+            destination.write_bytes(self.read_bytes(image_path))
+        return destination
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            return dict(self.stats)
+
+
+_store: Optional[ImageStore] = None
+_store_lock = threading.Lock()
+
+
+def get_image_store() -> ImageStore:
+    """Process-wide image store rooted at IMAGE_STORE_DIR"""
+    global _store
+    with _store_lock:
+        if _store is None:
+            _store = ImageStore()
+        return _store
+
+
+def configure_image_store(root: str) -> ImageStore:
+    """Point the process-wide image store at another directory (benchmarks, tests)"""
+    global _store
+    with _store_lock:
+        _store = ImageStore(root)
+        return _store
@@ -1,47 +1,242 @@
 import json
-import psycopg2
 from psycopg2.extras import execute_values
 import openai
 import os
 from dotenv import load_dotenv
 import hashlib
+import time
 from pathlib import Path
-import base64
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Iterable, Optional, Set
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from embeddings import EmbeddingBatcher, get_embedding_cache
+from image_store import get_image_store
+from chunk_planner import ChunkPlanner, chunk_hash, CHUNK_DEDUP_ACROSS_DOCUMENTS
+from db import get_pool, BUMP_CORPUS_VERSION_SQL, deferred_vector_indexes
+from bulk_loader import copy_rows, CHUNK_COLUMNS, TABLE_COLUMNS, IMAGE_COLUMNS
+from vector_snapshot import VectorSnapshot, snapshot_enabled
+from rerank import parse_vector
 
 load_dotenv()
 
-class DocumentInserter:
-    def __init__(self):
-        # Database configuration
-        self.db_config = {
-            'host': 'localhost',
-            'database': 'report_agent_11',
-            'user': 'postgres',
-            'password': os.getenv('PG_PASSWORD', 'your_password'),
-            'port': 5432
+# Parallel vision calls during image ingestion
+VISION_CONCURRENCY = int(os.getenv('VISION_CONCURRENCY', '4'))
+# Pages per committed checkpoint window; a crashed run resumes after the last committed window.
+# 0 buffers the whole document and writes it in a single transaction.
+INGEST_CHECKPOINT_PAGES = int(os.getenv('INGEST_CHECKPOINT_PAGES', '10'))
+# Documents with at least this many pages are loaded with the ANN indexes dropped
+# and rebuilt once at the end (0 = always maintain the indexes during the load).
+# The indexes are dropped for the whole tables, so queries run as exact scans until
+# the rebuild: for offline bulk loads, not a database that is serving queries.
+INGEST_DEFER_INDEX_PAGES = int(os.getenv('INGEST_DEFER_INDEX_PAGES', '0'))
+
+INGEST_PHASES = ('chunks', 'tables', 'images')
+IMAGE_CHUNK_PREFIX = "[IMAGE CONTENT]"
+
+# Rows each phase owns for a set of pages; deleted before a page is (re)processed
+PHASE_CLEANUP_SQL = {
+    'chunks': [
+        "DELETE FROM document_chunks WHERE doc_id = %(doc_id)s AND page_number = ANY(%(pages)s) "
+        "AND chunk_text NOT LIKE %(image_prefix)s",
+    ],
+    'tables': [
+        "DELETE FROM extracted_tables WHERE doc_id = %(doc_id)s AND page_number = ANY(%(pages)s)",
+    ],
+    'images': [
+        "DELETE FROM extracted_images WHERE doc_id = %(doc_id)s AND page_number = ANY(%(pages)s)",
+        "DELETE FROM document_chunks WHERE doc_id = %(doc_id)s AND page_number = ANY(%(pages)s) "
+        "AND chunk_text LIKE %(image_prefix)s",
+    ],
+}
+
+
+def file_sha256(path: str) -> Optional[str]:
+    """sha256 of a file's bytes, or None when the file is not available"""
+    if not path or not os.path.isfile(path):
+        return None
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def markdown_sha256(markdowns: Iterable[str]) -> str:
+    """
+    Document key used when the PDF is not on disk: sha256 of the OCR markdown of
+    its pages, in order. Computable from an OCR response or an extracted_data.json.
+    """
+    digest = hashlib.sha256()
+    for markdown in markdowns:
+        digest.update(markdown.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def window_size(page_count: int, window: Optional[int] = None) -> int:
+    """Pages per committed window; 0 (or INGEST_CHECKPOINT_PAGES=0) means the whole document"""
+    pages = INGEST_CHECKPOINT_PAGES if window is None else window
+    return max(1, pages or page_count)
+
+
+def index_maintenance(page_count: int, checkpoints: Dict[tuple, str]):
+    """
+    Context for loading a document: defers ANN index maintenance when a large
+    document (INGEST_DEFER_INDEX_PAGES) still has pages to ingest
+    """
+    unfinished = len(checkpoints) < page_count * len(INGEST_PHASES)
+    if INGEST_DEFER_INDEX_PAGES and page_count >= INGEST_DEFER_INDEX_PAGES and unfinished:
+        return deferred_vector_indexes()
+    return nullcontext()
+
+
+def page_content_hash(phase: str, db_page: Dict, extracted_page: Dict) -> str:
+    """Hash of exactly the page content one ingestion phase consumes"""
+    if phase == 'chunks':
+        content = db_page.get('paragraphs', [])
+    elif phase == 'tables':
+        content = db_page.get('tables', [])
+    else:
+        paragraphs = extracted_page.get('paragraphs', [])
+        content = {
+            'context': " ".join(paragraphs[:3]),
+            'images': [
+                image.get('image_hash') or hashlib.md5(image.get('base64_data', '').encode()).hexdigest()
+                for image in extracted_page.get('images', [])
+                if image.get('image_path') or image.get('base64_data')
+            ],
         }
+    return hashlib.sha256(json.dumps(content, sort_keys=True).encode('utf-8')).hexdigest()
+
+class DocumentInserter:
+    def __init__(self, openai_client=None, use_embedding_cache: bool = True):
+        # Database connections come from the shared pool configured in db.py
+        self.pool = get_pool()
         
-        # OpenAI configuration
-        self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        # OpenAI configuration (any client with the same embeddings/chat interface can be passed in)
+        self.openai_client = openai_client or openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
         self.embedding_model = "text-embedding-3-small"
+        self.embedder = EmbeddingBatcher(self.openai_client, self.embedding_model,
+                                        cache=get_embedding_cache() if use_embedding_cache else None)
+        self.image_store = get_image_store()
+        
+        # Cumulative seconds per ingestion phase across ingest_window() calls
+        self.phase_seconds = {phase: 0.0 for phase in INGEST_PHASES + ('embed_and_write',)}
+        
+        # Rows waiting for their embeddings; written by flush_pending()
+        self._pending_chunks = []  # (doc_id, phase, page_num, chunk_text, content_hash, ticket or vector)
+        self._pending_tables = []  # (doc_id, phase, page_num, table_json, table_text, ticket)
+        self._pending_images = []  # (doc_id, page_num, image_filename, image_path)
+        self._pending_checkpoints = []  # (doc_id, phase, page_num, content_hash)
+        self._chunk_planner = None
+        self._chunk_planner_doc_id = None
+        self._stored_embeddings = {}  # content_hash -> vector already embedded or stored
+        self._chunk_tickets = {}  # content_hash -> embedding ticket of a queued chunk
         
     def get_embedding(self, text: str) -> List[float]:
         """Get embedding vector for text"""
-        try:
-            # Clean the text
-            text = text.replace("\n", " ").strip()
-            if not text:
-                return None
+        return self.embedder.embed([text])[0]
+    
+    def queue_chunk(self, doc_id: int, page_num: int, chunk_text: str, content_hash: str = None,
+                    phase: str = 'chunks', embedding: Optional[List[float]] = None):
+        """
+        Queue a document_chunks row for an ingestion phase; its embedding is fetched in
+        batch on flush unless an already stored `embedding` is given. Rows with the same
+        content hash queued before the flush share one embedding request.
+        """
+        content_hash = content_hash or chunk_hash(chunk_text)
+        if embedding is not None:
+            pending = embedding
+        elif content_hash in self._chunk_tickets:
+            pending = self._chunk_tickets[content_hash]
+        else:
+            pending = self._chunk_tickets[content_hash] = self.embedder.add(chunk_text)
+        self._pending_chunks.append((doc_id, phase, page_num, chunk_text, content_hash, pending))
+    
+    def queue_table(self, doc_id: int, page_num: int, table: Dict, table_text: str):
+        """Queue an extracted_tables row; its embedding is fetched in batch on flush"""
+        ticket = self.embedder.add(table_text)
+        self._pending_tables.append((doc_id, 'tables', page_num, json.dumps(table), table_text, ticket))
+    
+    def queue_checkpoint(self, doc_id: int, phase: str, page_num: int, content_hash: str):
+        """Queue a page checkpoint; it commits in the same transaction as the page's rows"""
+        self._pending_checkpoints.append((doc_id, phase, page_num, content_hash))
+    
+    def queue_image(self, doc_id: int, page_num: int, image_filename: str, image_path: str):
+        """Queue an extracted_images row; written with the window's other rows on flush"""
+        self._pending_images.append((doc_id, page_num, image_filename, image_path))
+    
+    def flush_pending(self):
+        """
+        Embed every queued chunk and table in batched requests, then write all queued
+        chunks, tables, images and checkpoints in one transaction: one binary COPY per
+        table, plus an upsert for the checkpoints. A page phase with any row whose
+        embedding failed gets no checkpoint, so resume and re-runs process it again.
+        """
+        if not (self._pending_chunks or self._pending_tables or self._pending_images
+                or self._pending_checkpoints):
+            return
+        
+        if self.embedder.pending_count:
+            print(f" Embedding {self.embedder.pending_count} queued texts in batches...")
+        self.embedder.flush()
+        
+        incomplete = set()  # (doc_id, phase, page_num) with at least one failed embedding
+        chunk_rows = []
+        results = {}  # ticket -> embedding, for tickets shared by identical chunks
+        for doc_id, phase, page_num, chunk_text, content_hash, pending in self._pending_chunks:
+            if isinstance(pending, int):
+                if pending not in results:
+                    results[pending] = self.embedder.result(pending)
+                embedding = results[pending]
+            else:
+                embedding = pending
+            if embedding:
+                chunk_rows.append((doc_id, page_num, chunk_text, content_hash, embedding))
+                self._stored_embeddings[content_hash] = embedding
+            else:
+                incomplete.add((doc_id, phase, page_num))
+        
+        table_rows = []
+        for doc_id, phase, page_num, table_json, table_text, ticket in self._pending_tables:
+            embedding = self.embedder.result(ticket)
+            if embedding:
+                table_rows.append((doc_id, page_num, table_json, table_text, embedding))
+            else:
+                incomplete.add((doc_id, phase, page_num))
+        
+        image_rows = self._pending_images
+        checkpoint_rows = [row for row in self._pending_checkpoints if row[:3] not in incomplete]
+        if incomplete:
+            print(f" Embeddings failed for {len(incomplete)} page phases; they stay unchecked "
+                  f"and will be ingested again on the next run: {sorted(incomplete)}")
+        
+        self._pending_chunks = []
+        self._chunk_tickets = {}
+        self._pending_tables = []
+        self._pending_images = []
+        self._pending_checkpoints = []
+        
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                copy_rows(cur, 'document_chunks', CHUNK_COLUMNS, chunk_rows)
+                copy_rows(cur, 'extracted_tables', TABLE_COLUMNS, table_rows)
+                copy_rows(cur, 'extracted_images', IMAGE_COLUMNS, image_rows)
                 
-            response = self.openai_client.embeddings.create(
-                model=self.embedding_model,
-                input=text
-            )
-            return response.data[0].embedding
-        except Exception as e:
-            print(f" Error getting embedding for text: {str(e)[:100]}...")
-            return None
+                if checkpoint_rows:
+                    execute_values(cur, """
+                        INSERT INTO ingest_checkpoints (doc_id, phase, page_number, content_hash)
+                        VALUES %s
+                        ON CONFLICT (doc_id, phase, page_number)
+                        DO UPDATE SET content_hash = EXCLUDED.content_hash, completed_at = now()
+                    """, checkpoint_rows)
+        
+        stats = self.embedder.get_stats()
+        print(f" Inserted {len(chunk_rows)} chunks, {len(table_rows)} tables and {len(image_rows)} images "
+              f"({stats['requests']} embedding requests so far)")
+        if self.embedder.cache is not None:
+            cache_stats = self.embedder.cache.get_stats()
+            print(f" Embedding cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses "
+                  f"(hit rate {cache_stats['hit_rate']:.0%})")
     
     def analyze_image_with_vision(self, base64_image: str, surrounding_text: str = "") -> Dict:
         """
@@ -110,101 +305,193 @@ class DocumentInserter:
                 "data_extracted": ""
             }
     
-    def insert_document(self, filename: str, company_name: str = None, report_year: int = None) -> int:
+    def insert_document(self, filename: str, company_name: str = None, report_year: int = None,
+                        file_hash: str = None) -> int:
         """Insert document record and return doc_id"""
-        with psycopg2.connect(**self.db_config) as conn:
+        with self.pool.connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("""
-                    INSERT INTO documents (company_name, report_year, file_path)
-                    VALUES (%s, %s, %s) RETURNING doc_id
-                """, (company_name, report_year, filename))
+                    INSERT INTO documents (company_name, report_year, file_path, file_hash)
+                    VALUES (%s, %s, %s, %s) RETURNING doc_id
+                """, (company_name, report_year, filename, file_hash))
                 
                 doc_id = cur.fetchone()[0]
-                conn.commit()
         
         print(f" Document inserted with doc_id: {doc_id}")
         return doc_id
     
-    def process_and_insert_chunks(self, doc_id: int, db_ready_data: Dict):
+    def resolve_document(self, filename: str, file_hash: str,
+                         company_name: str = None, report_year: int = None) -> int:
         """
-        Process text chunks from db_ready_data.json with advanced chunking strategy
+        Return the doc_id to ingest into, keyed by the file's content hash:
+        - same hash already ingested: reuse it (completed pages are skipped)
+        - same path with a different hash: the file changed, reuse the doc_id and
+          let the page checkpoints decide what to re-process
+        - otherwise insert a new document
+        """
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("SELECT doc_id FROM documents WHERE file_hash = %s", (file_hash,))
+                row = cur.fetchone()
+                if row:
+                    print(f" Resuming document doc_id {row[0]} (file hash {file_hash[:12]})")
+                    return row[0]
+                
+                cur.execute("""
+                    SELECT doc_id FROM documents WHERE file_path = %s
+                    ORDER BY processed_at DESC LIMIT 1
+                """, (filename,))
+                row = cur.fetchone()
+                if row:
+                    cur.execute("""
+                        UPDATE documents
+                        SET file_hash = %s, company_name = COALESCE(%s, company_name),
+                            report_year = COALESCE(%s, report_year), processed_at = now()
+                        WHERE doc_id = %s
+                    """, (file_hash, company_name, report_year, row[0]))
+                    print(f" File changed since last ingestion, updating doc_id {row[0]}")
+                    return row[0]
+        
+        return self.insert_document(filename, company_name, report_year, file_hash)
+    
+    def load_checkpoints(self, doc_id: int) -> Dict[tuple, str]:
+        """{(phase, page_number): content_hash} of every committed page phase"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT phase, page_number, content_hash
+                    FROM ingest_checkpoints WHERE doc_id = %s
+                """, (doc_id,))
+                return {(phase, page): content_hash for phase, page, content_hash in cur.fetchall()}
+    
+    def clear_pages(self, doc_id: int, phase: str, pages: List[int]):
+        """Delete a phase's rows and checkpoints for pages about to be (re)processed"""
+        if not pages:
+            return
+        params = {'doc_id': doc_id, 'pages': list(pages), 'image_prefix': IMAGE_CHUNK_PREFIX + '%'}
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                for statement in PHASE_CLEANUP_SQL[phase]:
+                    cur.execute(statement, params)
+                cur.execute("""
+                    DELETE FROM ingest_checkpoints
+                    WHERE doc_id = %(doc_id)s AND phase = %(phase)s AND page_number = ANY(%(pages)s)
+                """, {**params, 'phase': phase})
+    
+    def delete_document(self, doc_id: int):
+        """Remove a document and every row derived from it"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                for table in ('ingest_checkpoints', 'extracted_images', 'extracted_tables', 'document_chunks'):
+                    cur.execute(f"DELETE FROM {table} WHERE doc_id = %s", (doc_id,))
+                cur.execute("DELETE FROM documents WHERE doc_id = %s", (doc_id,))
+                # Invalidate answers cached against the deleted content
+                cur.execute(BUMP_CORPUS_VERSION_SQL)
+    
+    def clear_pages_after(self, doc_id: int, last_page: int) -> int:
+        """Drop rows and checkpoints of pages the new version of the file no longer has"""
+        removed = 0
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                for table in ('document_chunks', 'extracted_tables', 'extracted_images', 'ingest_checkpoints'):
+                    cur.execute(f"DELETE FROM {table} WHERE doc_id = %s AND page_number > %s",
+                                (doc_id, last_page))
+                    removed += cur.rowcount
+        return removed
+    
+    def plan_pages(self, doc_id: int, db_pages: List[Dict], extracted_pages: List[Dict],
+                   checkpoints: Dict[tuple, str]) -> Dict[str, Set[int]]:
+        """
+        Work out which pages each phase still has to process: those without a
+        checkpoint or whose content hash changed. Their old rows are cleared and
+        checkpoints queued, so they commit with the new rows on flush_pending().
+        """
+        todo = {}
+        for phase in INGEST_PHASES:
+            todo[phase] = set()
+            for page_num, (db_page, extracted_page) in enumerate(zip(db_pages, extracted_pages), 1):
+                page_num = db_page.get('page_number', page_num)
+                content_hash = page_content_hash(phase, db_page, extracted_page)
+                if checkpoints.get((phase, page_num)) == content_hash:
+                    continue
+                todo[phase].add(page_num)
+                self.queue_checkpoint(doc_id, phase, page_num, content_hash)
+            self.clear_pages(doc_id, phase, sorted(todo[phase]))
+        return todo
+    
+    
+    def existing_chunk_hashes(self, hashes: List[str]) -> Set[str]:
+        """
+        Subset of content hashes already stored in document_chunks, by other documents
+        or by pages of this one that are not being re-ingested (their old rows were
+        cleared by plan_pages). Their vectors are kept for reuse; the rows are still
+        inserted for the pages being processed.
+        """
+        if not hashes:
+            return set()
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT DISTINCT ON (content_hash) content_hash, embedding::text
+                    FROM document_chunks
+                    WHERE content_hash = ANY(%s) AND embedding IS NOT NULL
+                """, (hashes,))
+                found = {content_hash: parse_vector(vector).tolist() for content_hash, vector in cur.fetchall()}
+        self._stored_embeddings.update(found)
+        return set(found)
+    
+    def chunk_planner_for(self, doc_id: int) -> ChunkPlanner:
+        """One planner per document, so vector reuse spans all of its windows"""
+        if self._chunk_planner is None or self._chunk_planner_doc_id != doc_id:
+            self._chunk_planner_doc_id = doc_id
+            self._stored_embeddings = {}
+            self._chunk_planner = ChunkPlanner(
+                existing_hashes=self.existing_chunk_hashes if CHUNK_DEDUP_ACROSS_DOCUMENTS else None)
+        return self._chunk_planner
+    
+    def process_and_insert_chunks(self, doc_id: int, db_ready_data: Dict, defer: bool = False,
+                                  only_pages: Optional[Set[int]] = None):
+        """
+        Process text chunks from db_ready_data.json with the configured chunk
+        strategies (see chunk_planner.py); identical texts are stored once per page and
+        embedded once per document, and texts already stored reuse their vectors.
+        With defer=True the chunks stay queued until flush_pending() is called;
+        only_pages restricts processing to those page numbers.
         """
         pages = db_ready_data.get('pages', [])
-        total_chunks = 0
+        if only_pages is not None:
+            pages = [page for page_num, page in enumerate(pages, 1)
+                     if page.get('page_number', page_num) in only_pages]
         
         print(f" Processing {len(pages)} pages for text chunks...")
         
-        for page_num, page_data in enumerate(pages, 1):
-            paragraphs = page_data.get('paragraphs', [])
-            
-            if not paragraphs:
-                continue
-            
-            # Strategy 1: Individual paragraphs (for specific content)
-            paragraph_chunks = []
-            for i, paragraph in enumerate(paragraphs):
-                if len(paragraph.strip()) > 20:  # Skip very short paragraphs
-                    embedding = self.get_embedding(paragraph)
-                    if embedding:
-                        paragraph_chunks.append((
-                            doc_id, page_num, paragraph, embedding
-                        ))
-            
-            # Strategy 2: Combined context chunks (for broader understanding)
-            if len(paragraphs) > 1:
-                # Combine 2-3 paragraphs for context
-                for i in range(0, len(paragraphs), 2):
-                    combined_text = " ".join(paragraphs[i:i+3])  # Take 2-3 paragraphs
-                    if len(combined_text.strip()) > 50:
-                        embedding = self.get_embedding(combined_text)
-                        if embedding:
-                            paragraph_chunks.append((
-                                doc_id, page_num, combined_text, embedding
-                            ))
-            
-            # Strategy 3: Full page context (for page-level queries)
-            full_page_text = " ".join(paragraphs)
-            if len(full_page_text.strip()) > 100:
-                # Split into chunks if too long (max ~400 words)
-                words = full_page_text.split()
-                if len(words) > 400:
-                    # Split into overlapping chunks
-                    chunk_size = 300
-                    overlap = 50
-                    for i in range(0, len(words), chunk_size - overlap):
-                        chunk_words = words[i:i + chunk_size]
-                        chunk_text = " ".join(chunk_words)
-                        if len(chunk_text.strip()) > 100:
-                            embedding = self.get_embedding(chunk_text)
-                            if embedding:
-                                paragraph_chunks.append((
-                                    doc_id, page_num, chunk_text, embedding
-                                ))
-                else:
-                    embedding = self.get_embedding(full_page_text)
-                    if embedding:
-                        paragraph_chunks.append((
-                            doc_id, page_num, full_page_text, embedding
-                        ))
-            
-            # Bulk insert chunks for this page
-            if paragraph_chunks:
-                with psycopg2.connect(**self.db_config) as conn:
-                    with conn.cursor() as cur:
-                        execute_values(cur, """
-                            INSERT INTO document_chunks (doc_id, page_number, chunk_text, embedding)
-                            VALUES %s
-                        """, paragraph_chunks)
-                    conn.commit()
-                
-                total_chunks += len(paragraph_chunks)
-                print(f"   Page {page_num}: {len(paragraph_chunks)} chunks inserted")
+        planner = self.chunk_planner_for(doc_id)
+        planned = planner.plan(pages)
+        
+        # Queue planned chunks; embeddings are requested in batches on flush
+        per_page = {}
+        for chunk in planned:
+            self.queue_chunk(doc_id, chunk.page_number, chunk.text, chunk.content_hash,
+                             embedding=self._stored_embeddings.get(chunk.content_hash) if chunk.reused else None)
+            per_page[chunk.page_number] = per_page.get(chunk.page_number, 0) + 1
+        
+        for page_num, count in per_page.items():
+            print(f"   Page {page_num}: {count} chunks queued")
         
-        print(f"🎉 Total text chunks inserted: {total_chunks}")
+        totals = planner.report()['total']
+        print(f"🎉 Total text chunks queued: {len(planned)} "
+              f"(document so far: {totals['duplicates']} same-page duplicates dropped, "
+              f"{totals['reused_vectors']} reusing vectors of identical chunks)")
+        
+        if not defer:
+            self.flush_pending()
     
-    def process_and_insert_tables(self, doc_id: int, db_ready_data: Dict):
+    def process_and_insert_tables(self, doc_id: int, db_ready_data: Dict, defer: bool = False,
+                                  only_pages: Optional[Set[int]] = None):
         """
-        Process tables with multiple representation strategies
+        Process tables with multiple representation strategies.
+        With defer=True the tables stay queued until flush_pending() is called;
+        only_pages restricts processing to those page numbers.
         """
         pages = db_ready_data.get('pages', [])
         total_tables = 0
@@ -212,6 +499,9 @@ class DocumentInserter:
         print(f"Processing tables from {len(pages)} pages...")
         
         for page_num, page_data in enumerate(pages, 1):
+            page_num = page_data.get('page_number', page_num)
+            if only_pages is not None and page_num not in only_pages:
+                continue
             tables = page_data.get('tables', [])
             
             for table_idx, table in enumerate(tables):
@@ -250,55 +540,92 @@ class DocumentInserter:
                 if key_value_text:
                     comprehensive_text += " Additional details: " + ". ".join(key_value_text[:10])  # Limit for length
                 
-                # Get embedding
-                embedding = self.get_embedding(comprehensive_text)
+                # Queue for batched embedding
+                self.queue_table(doc_id, page_num, table, comprehensive_text)
                 
-                if embedding:
-                    with psycopg2.connect(**self.db_config) as conn:
-                        with conn.cursor() as cur:
-                            cur.execute("""
-                                INSERT INTO extracted_tables 
-                                (doc_id, page_number, table_data_json, table_as_text, embedding)
-                                VALUES (%s, %s, %s, %s, %s)
-                            """, (
-                                doc_id,
-                                page_num,
-                                json.dumps(table),
-                                comprehensive_text,
-                                embedding
-                            ))
-                        conn.commit()
-                    
-                    total_tables += 1
-                    print(f"   Page {page_num}, Table {table_idx + 1}: Inserted with comprehensive text")
+                total_tables += 1
+                print(f"   Page {page_num}, Table {table_idx + 1}: Queued with comprehensive text")
         
-        print(f"🎉 Total tables inserted: {total_tables}")
+        print(f"🎉 Total tables queued: {total_tables}")
+        
+        if not defer:
+            self.flush_pending()
+    
+    def _analyze_image_job(self, job: Dict) -> Dict:
+        """Worker-side wrapper: one image's failure must not stop the document"""
+        print(f"   Analyzing image {job['image'].get('image_id', 'unknown')} from page {job['page_num']}...")
+        try:
+            image = job['image']
+            data_uri = image.get('base64_data') or self.image_store.to_data_uri(
+                image['image_path'], image.get('mime_type'))
+            return self.analyze_image_with_vision(data_uri, job['surrounding_text'])
+        except Exception as e:
+            print(f"   Vision analysis failed for page {job['page_num']} image {job['index'] + 1}: {e}")
+            return {
+                "detailed_description": f"Image from document (analysis failed: {str(e)})",
+                "ocr_text": "",
+                "key_insights": "",
+                "visual_type": "unknown",
+                "data_extracted": ""
+            }
     
-    def process_and_insert_images(self, doc_id: int, extracted_data: Dict):
+    def process_and_insert_images(self, doc_id: int, extracted_data: Dict, defer: bool = False,
+                                  only_pages: Optional[Set[int]] = None):
         """
-        Process images with AI analysis for comprehensive search capability
+        Process images with AI analysis for comprehensive search capability.
+        Vision calls run on a bounded thread pool (VISION_CONCURRENCY), once per distinct
+        image hash; results are consumed in page/image order and extracted_images rows,
+        which point at the image store path, are queued with the image text chunks.
+        With defer=True they stay queued until flush_pending() is called;
+        only_pages restricts processing to those page numbers.
         """
         pages = extracted_data.get('pages', [])
         total_images = 0
         
-        print(f" Processing images with AI analysis...")
-        
+        # Collect every image first so vision calls can overlap across pages
+        jobs = []
         for page_num, page_data in enumerate(pages, 1):
-            images = page_data.get('images', [])
+            page_num = page_data.get('page_number', page_num)
+            if only_pages is not None and page_num not in only_pages:
+                continue
             paragraphs = page_data.get('paragraphs', [])
             
             # Get surrounding text context
             surrounding_text = " ".join(paragraphs[:3]) if paragraphs else ""
             
-            for image in images:
-                base64_data = image.get('base64_data', '')
-                if not base64_data:
-                    continue
-                
-                print(f"   Analyzing image {image.get('image_id', 'unknown')} from page {page_num}...")
-                
-                # Analyze image with Vision API
-                ai_analysis = self.analyze_image_with_vision(base64_data, surrounding_text)
+            for index, image in enumerate(page_data.get('images', [])):
+                if not image.get('image_path'):
+                    if not image.get('base64_data'):
+                        continue
+                    # JSON written before the image store existed: store the inline payload once
+                    try:
+                        image = {**image, **self.image_store.put_data_uri(image['base64_data'])}
+                    except Exception as e:
+                        print(f"   Could not store image {index + 1} from page {page_num}: {e}")
+                        continue
+                jobs.append({
+                    'page_num': page_num,
+                    'index': index,
+                    'image': image,
+                    'surrounding_text': surrounding_text,
+                })
+        
+        # The same image repeated across pages (logos, headers) is analyzed once
+        unique_jobs = {}
+        for job in jobs:
+            unique_jobs.setdefault(job['image'].get('image_hash') or job['image']['image_path'], job)
+        
+        print(f" Processing {len(jobs)} images ({len(unique_jobs)} distinct) with AI analysis "
+              f"({VISION_CONCURRENCY} concurrent)...")
+        
+        with ThreadPoolExecutor(max_workers=max(1, VISION_CONCURRENCY)) as executor:
+            analyses = dict(zip(unique_jobs, executor.map(self._analyze_image_job, unique_jobs.values())))
+            
+            # Consume in page/image order so page/order metadata stays stable
+            for job in jobs:
+                page_num = job['page_num']
+                image = job['image']
+                ai_analysis = analyses[image.get('image_hash') or image['image_path']]
                 
                 # Create comprehensive searchable text
                 searchable_content = []
@@ -317,93 +644,79 @@ class DocumentInserter:
                     searchable_content.append(f"Data found: {ai_analysis['data_extracted']}")
                 
                 # Add context
-                searchable_content.append(f"Page {page_num} context: {surrounding_text[:200]}")
+                searchable_content.append(f"Page {page_num} context: {job['surrounding_text'][:200]}")
                 
                 # Combine all searchable content
                 full_searchable_text = ". ".join(searchable_content)
                 
-                # Save image file
-                image_filename = image.get('filename', f'page_{page_num:03d}_image_{total_images + 1:03d}.png')
-                image_path = f"images/{image_filename}"
-                
-                # Create images directory if it doesn't exist
-                os.makedirs('images', exist_ok=True)
+                # The image file already lives in the content-addressed store
+                image_filename = image.get('filename', f'page_{page_num:03d}_image_{job["index"] + 1:03d}.png')
+                image_path = image['image_path']
                 
-                # Save base64 as file
-                try:
-                    image_bytes = base64.b64decode(base64_data.split(',')[1])
-                    with open(image_path, 'wb') as f:
-                        f.write(image_bytes)
-                except Exception as e:
-                    print(f"   Could not save image file: {e}")
-                    image_path = ""
+                self.queue_image(doc_id, page_num, image_filename, image_path)
                 
-                # Insert into database
-                with psycopg2.connect(**self.db_config) as conn:
-                    with conn.cursor() as cur:
-                        cur.execute("""
-                            INSERT INTO extracted_images 
-                            (doc_id, page_number, image_filename, image_path)
-                            VALUES (%s, %s, %s, %s)
-                        """, (doc_id, page_num, image_filename, image_path))
-                    conn.commit()
-                
-                # ALSO insert image analysis as text chunks for searchability
-                embedding = self.get_embedding(full_searchable_text)
-                if embedding:
-                    with psycopg2.connect(**self.db_config) as conn:
-                        with conn.cursor() as cur:
-                            cur.execute("""
-                                INSERT INTO document_chunks (doc_id, page_number, chunk_text, embedding)
-                                VALUES (%s, %s, %s, %s)
-                            """, (
-                                doc_id, 
-                                page_num, 
-                                f"[IMAGE CONTENT] {full_searchable_text}", 
-                                embedding
-                            ))
-                        conn.commit()
+                # ALSO queue image analysis as a text chunk for searchability
+                self.queue_chunk(doc_id, page_num, f"{IMAGE_CHUNK_PREFIX} {full_searchable_text}",
+                                 phase='images')
                 
                 total_images += 1
                 print(f"   Image processed and made searchable: {image_filename}")
         
         print(f" Total images processed: {total_images}")
+        
+        if not defer:
+            self.flush_pending()
     
-    def insert_complete_document(self, 
-                                filename: str,
-                                db_ready_path: str,
-                                extracted_data_path: str,
-                                company_name: str = None,
-                                report_year: int = None):
+    def ingest_window(self, doc_id: int, db_pages: List[Dict], extracted_pages: List[Dict],
+                      checkpoints: Dict[tuple, str]) -> bool:
         """
-        Complete document insertion with optimal search capability
+        Run the three phases for one window of pages and commit it with its
+        checkpoints. Returns False when every page was already ingested.
         """
-        print(f" Starting complete document insertion for: {filename}")
+        if not db_pages:
+            return False
+        first = db_pages[0].get('page_number', '?')
+        last = db_pages[-1].get('page_number', '?')
         
-        # Load both JSON files
-        with open(db_ready_path, 'r', encoding='utf-8') as f:
-            db_ready_data = json.load(f)
-        
-        with open(extracted_data_path, 'r', encoding='utf-8') as f:
-            extracted_data = json.load(f)
-        
-        # Insert document record
-        doc_id = self.insert_document(filename, company_name, report_year)
-        
-        # Process all content types
-        print("\n Processing text chunks...")
-        self.process_and_insert_chunks(doc_id, db_ready_data)
+        todo = self.plan_pages(doc_id, db_pages, extracted_pages, checkpoints)
+        if not any(todo.values()):
+            print(f"\n Pages {first}-{last} already ingested, skipping")
+            return False
         
-        print("\n Processing tables...")
-        self.process_and_insert_tables(doc_id, db_ready_data)
+        print(f"\n Processing pages {first}-{last}...")
+        started = time.perf_counter()
+        if todo['chunks']:
+            self.process_and_insert_chunks(doc_id, {'pages': db_pages}, defer=True,
+                                           only_pages=todo['chunks'])
+        started = self._record_phase('chunks', started)
+        if todo['tables']:
+            self.process_and_insert_tables(doc_id, {'pages': db_pages}, defer=True,
+                                           only_pages=todo['tables'])
+        started = self._record_phase('tables', started)
+        if todo['images']:
+            self.process_and_insert_images(doc_id, {'pages': extracted_pages}, defer=True,
+                                           only_pages=todo['images'])
+        started = self._record_phase('images', started)
         
-        print("\n Processing images...")
-        self.process_and_insert_images(doc_id, extracted_data)
+        print("\n Embedding and inserting queued chunks and tables...")
+        self.flush_pending()
+        self._record_phase('embed_and_write', started)
+        return True
+    
+    def _record_phase(self, phase: str, started: float) -> float:
+        now = time.perf_counter()
+        self.phase_seconds[phase] += now - started
+        return now
+    
+    def finish_document(self, doc_id: int, page_count: int, changed: bool) -> Dict[str, int]:
+        """Drop pages past the end of the document, bump the corpus version and print a summary"""
+        if self.clear_pages_after(doc_id, page_count):
+            changed = True
         
         print(f"\n Complete document insertion finished for doc_id: {doc_id}")
         
         # Print summary
-        with psycopg2.connect(**self.db_config) as conn:
+        with self.pool.connection() as conn:
             with conn.cursor() as cur:
                 cur.execute("SELECT COUNT(*) FROM document_chunks WHERE doc_id = %s", (doc_id,))
                 chunk_count = cur.fetchone()[0]
@@ -413,6 +726,17 @@ class DocumentInserter:
                 
                 cur.execute("SELECT COUNT(*) FROM extracted_images WHERE doc_id = %s", (doc_id,))
                 image_count = cur.fetchone()[0]
+                
+                # Invalidate answers cached against the previous corpus
+                if changed:
+                    cur.execute(BUMP_CORPUS_VERSION_SQL)
+        
+        # Keep the in-process vector index (RAG_VECTOR_BACKEND=snapshot) in step with the tables
+        if changed and snapshot_enabled():
+            try:
+                VectorSnapshot().refresh(self.pool)
+            except Exception as e:
+                print(f" Could not refresh the vector snapshot: {e}")
         
         print(f"""
  INSERTION SUMMARY:
@@ -424,6 +748,53 @@ class DocumentInserter:
  Ready for 100% query coverage!
         """)
         
+        return {'chunks': chunk_count, 'tables': table_count, 'images': image_count, 'changed': changed}
+    
+    def insert_complete_document(self, 
+                                filename: str,
+                                db_ready_path: str,
+                                extracted_data_path: str,
+                                company_name: str = None,
+                                report_year: int = None):
+        """
+        Complete document insertion with optimal search capability.
+        
+        Idempotent and resumable: the document is keyed by the PDF's sha256 and
+        every page commits a checkpoint per phase together with its rows, in
+        windows of INGEST_CHECKPOINT_PAGES pages. Re-running after a crash skips
+        committed pages; re-running on a changed file re-processes only the pages
+        whose content hash changed.
+        """
+        print(f" Starting complete document insertion for: {filename}")
+        
+        # Load both JSON files
+        with open(db_ready_path, 'r', encoding='utf-8') as f:
+            db_ready_data = json.load(f)
+        
+        with open(extracted_data_path, 'r', encoding='utf-8') as f:
+            extracted_data = json.load(f)
+        
+        db_pages = db_ready_data.get('pages', [])
+        extracted_pages = extracted_data.get('pages', [])
+        
+        # Key the document by file content; fall back to its OCR markdown when the PDF is not on disk
+        file_hash = file_sha256(filename) or markdown_sha256(
+            page.get('raw_markdown', '') for page in extracted_pages)
+        doc_id = self.resolve_document(filename, file_hash, company_name, report_year)
+        
+        checkpoints = self.load_checkpoints(doc_id)
+        changed = False
+        
+        # Process all content types one window of pages at a time; each window's
+        # embeddings are requested together and committed with its checkpoints
+        window = window_size(len(db_pages))
+        with index_maintenance(len(db_pages), checkpoints):
+            for start in range(0, len(db_pages), window):
+                changed |= self.ingest_window(doc_id, db_pages[start:start + window],
+                                              extracted_pages[start:start + window], checkpoints)
+        
+        self.finish_document(doc_id, len(db_pages), changed)
+        
         return doc_id
 
 def main():
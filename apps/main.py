@@ -1,10 +1,16 @@
+import json
+import time
+from typing import Dict, Optional
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse
 from pydantic import BaseModel
-from rag import EnhancedRAG
+from async_rag import AsyncEnhancedRAG
+from rag import ANSWER_ERROR_PREFIX
+from metrics import observe_request, render_metrics
 
 app = FastAPI()
-rag = EnhancedRAG()
+rag = AsyncEnhancedRAG()
 
 # Enable CORS so frontend can call /query
 app.add_middleware(
@@ -14,17 +20,75 @@ app.add_middleware(
     allow_headers=["*"],      
 )
 
-class Q(BaseModel): question: str
-class A(BaseModel): answer: str
+class Q(BaseModel):
+    question: str
+    debug: bool = False  # include the per-stage timings in the response
+
+class A(BaseModel):
+    answer: str
+    cached: Optional[bool] = None
+    timings: Optional[Dict[str, float]] = None  # milliseconds per stage, plus 'total'
+
+def outcome(result: Dict) -> str:
+    if result['answer'].startswith(ANSWER_ERROR_PREFIX):
+        return "error"
+    return "cached" if result['cached'] else "ok"
+
+@app.on_event("startup")
+async def startup():
+    await rag.connect()
+
+@app.on_event("shutdown")
+async def shutdown():
+    await rag.close()
 
 @app.get("/")
 def root():
     return {"status": "API is running"}
 
-@app.post("/query", response_model=A)
-def query(q: Q):
+@app.get("/metrics")
+def metrics():
+    """Request and per-stage latency histograms in the Prometheus text format"""
+    return PlainTextResponse(render_metrics(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+@app.post("/query", response_model=A, response_model_exclude_none=True)
+async def query(q: Q):
     if not q.question.strip(): raise HTTPException(400, "Empty question")
+    started = time.perf_counter()
     try:
-        return {"answer": rag.ask(q.question)}
+        result = await rag.answer(q.question)
     except Exception as e:
+        observe_request("/query", "error", time.perf_counter() - started)
         raise HTTPException(500, str(e))
+    seconds = time.perf_counter() - started
+    observe_request("/query", outcome(result), seconds)
+    if not q.debug:
+        return {"answer": result['answer']}
+    return {**result, "timings": {**result['timings'], "total": round(seconds * 1000, 2)}}
+
+def sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@app.post("/query/stream")
+async def query_stream(q: Q):
+    """Server-sent events: `metadata` (pages, doc_ids) first, then `token`s, then `done`"""
+    if not q.question.strip(): raise HTTPException(400, "Empty question")
+
+    async def events():
+        started = time.perf_counter()
+        status = "error"
+        try:
+            async for event, data in rag.ask_stream(q.question):
+                if event == 'done':
+                    status = outcome(data)
+                yield sse(event, data)
+        except Exception as e:
+            yield sse("error", {"detail": str(e)})
+        finally:
+            observe_request("/query/stream", status, time.perf_counter() - started)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,112 @@
+"""
+In-process request metrics rendered in the Prometheus text exposition format.
+
+Stage timings collected by EnhancedRAG / AsyncEnhancedRAG (the same dicts
+their `timings` arguments fill) feed a latency histogram per stage; the API
+records one request histogram and counter per endpoint and outcome, and the
+answer cache counts its hits per tier and its misses.
+Values are per process: with several workers, scrape each one.
+"""
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# Histogram buckets in seconds (upper bounds; +Inf is implicit)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Dict[str, str]) -> LabelKey:
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    escaped = (value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in pairs)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(pairs, escaped)) + "}"
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else f"{int(value)}"
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str):
+        self.name = name
+        self.help_text = help_text
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, buckets: Iterable[float] = LATENCY_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.buckets = tuple(sorted(buckets))
+        self._series: Dict[LabelKey, Dict] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'counts': [0] * len(self.buckets), 'sum': 0.0, 'count': 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['counts'][i] += 1
+            series['sum'] += value
+            series['count'] += 1
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['counts']):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, ('le', repr(bound)))} {count}")
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {series['count']}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {_format_value(series['sum'])}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {series['count']}")
+        return lines
+
+
+STAGE_SECONDS = Histogram('rag_stage_duration_seconds', 'Time spent in each question-answering stage')
+REQUEST_SECONDS = Histogram('rag_request_duration_seconds', 'End-to-end request latency by endpoint and outcome')
+REQUESTS = Counter('rag_requests_total', 'Requests by endpoint and outcome (ok, cached, error)')
+ANSWER_CACHE_HITS = Counter('answer_cache_hits_total', 'Answer cache hits by tier (exact, semantic)')
+ANSWER_CACHE_MISSES = Counter('answer_cache_misses_total', 'Answer cache lookups that found no usable entry')
+
+REGISTRY = (REQUESTS, REQUEST_SECONDS, STAGE_SECONDS, ANSWER_CACHE_HITS, ANSWER_CACHE_MISSES)
+
+
+def observe_stages(timings: Dict[str, float]):
+    """Record a request's stage timings (milliseconds, as filled by timed_stage)"""
+    for stage, ms in timings.items():
+        STAGE_SECONDS.observe(ms / 1000.0, stage=stage)
+
+
+def observe_request(endpoint: str, outcome: str, seconds: float):
+    REQUESTS.inc(endpoint=endpoint, outcome=outcome)
+    REQUEST_SECONDS.observe(seconds, endpoint=endpoint, outcome=outcome)
+
+
+def render_metrics() -> str:
+    """Every metric in the Prometheus text format (version 0.0.4)"""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
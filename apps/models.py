@@ -1,3 +1,4 @@
+import os
 from sqlalchemy import (
     Column,
     Integer,
@@ -5,15 +6,34 @@ from sqlalchemy import (
     Text,
     ForeignKey,
     DateTime,
+    BigInteger,
+    Computed,
+    Index,
+    UniqueConstraint,
 )
 from sqlalchemy.orm import declarative_base, relationship
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.sql import func
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC
+from embeddings import EMBEDDING_DIMENSIONS
 
 
 Base = declarative_base()
 
+# Text search configuration used for the generated search_vector columns
+TEXT_SEARCH_CONFIG = 'english'
+
+def search_vector_expression(column: str) -> str:
+    return f"to_tsvector('{TEXT_SEARCH_CONFIG}', coalesce({column}, ''))"
+
+# Storage type of the embedding columns: vector (float32) or halfvec (float16, half the size)
+VECTOR_STORAGE = os.getenv('PG_VECTOR_STORAGE', 'vector').lower()
+if VECTOR_STORAGE not in ('vector', 'halfvec'):
+    raise ValueError("PG_VECTOR_STORAGE must be 'vector' or 'halfvec'")
+
+def embedding_column_type():
+    return HALFVEC(EMBEDDING_DIMENSIONS) if VECTOR_STORAGE == 'halfvec' else Vector(EMBEDDING_DIMENSIONS)
+
 class Document(Base):
 
     __tablename__ = 'documents'
@@ -22,12 +42,14 @@ class Document(Base):
     company_name = Column(String(255))
     report_year = Column(Integer)
     file_path = Column(String(255), nullable=False)
+    file_hash = Column(String(64), unique=True)  # sha256 of the source PDF, for idempotent ingestion
     processed_at = Column(DateTime, server_default=func.now())
 
 
     chunks = relationship("DocumentChunk", back_populates="document", cascade="all, delete-orphan")
     tables = relationship("ExtractedTable", back_populates="document", cascade="all, delete-orphan")
     images = relationship("ExtractedImage", back_populates="document", cascade="all, delete-orphan")
+    checkpoints = relationship("IngestCheckpoint", back_populates="document", cascade="all, delete-orphan")
 
     def __repr__(self):
         return f"<Document(id={self.doc_id}, name='{self.company_name} {self.report_year}')>"
@@ -40,11 +62,17 @@ class DocumentChunk(Base):
     doc_id = Column(Integer, ForeignKey('documents.doc_id'), nullable=False)
     page_number = Column(Integer)
     chunk_text = Column(Text)
-    embedding = Column(Vector(1536)) 
+    content_hash = Column(String(64), index=True)  # sha256 of the normalized text, for chunk dedup
+    embedding = Column(embedding_column_type())
+    search_vector = Column(TSVECTOR, Computed(search_vector_expression('chunk_text'), persisted=True))
 
 
     document = relationship("Document", back_populates="chunks")
 
+    __table_args__ = (
+        Index('document_chunks_search_vector_idx', 'search_vector', postgresql_using='gin'),
+    )
+
 class ExtractedTable(Base):
 
     __tablename__ = 'extracted_tables'
@@ -54,10 +82,15 @@ class ExtractedTable(Base):
     page_number = Column(Integer)
     table_data_json = Column(JSONB)
     table_as_text = Column(Text)
-    embedding = Column(Vector(1536))
+    embedding = Column(embedding_column_type())
+    search_vector = Column(TSVECTOR, Computed(search_vector_expression('table_as_text'), persisted=True))
 
     document = relationship("Document", back_populates="tables")
 
+    __table_args__ = (
+        Index('extracted_tables_search_vector_idx', 'search_vector', postgresql_using='gin'),
+    )
+
 class ExtractedImage(Base):
 
     __tablename__ = 'extracted_images'
@@ -69,3 +102,31 @@ class ExtractedImage(Base):
     image_path = Column(String(500))
     document = relationship("Document", back_populates="images")
 
+
+class IngestCheckpoint(Base):
+    """Marks one ingestion phase (chunks/tables/images) of one page as committed"""
+
+    __tablename__ = 'ingest_checkpoints'
+
+    id = Column(Integer, primary_key=True)
+    doc_id = Column(Integer, ForeignKey('documents.doc_id'), nullable=False)
+    phase = Column(String(20), nullable=False)
+    page_number = Column(Integer, nullable=False)
+    content_hash = Column(String(64), nullable=False)
+    completed_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
+
+    document = relationship("Document", back_populates="checkpoints")
+
+    __table_args__ = (
+        UniqueConstraint('doc_id', 'phase', 'page_number', name='ingest_checkpoints_doc_phase_page_key'),
+    )
+
+
+class CorpusState(Base):
+    """Single-row counter bumped whenever ingestion changes the corpus (used to invalidate answer caches)"""
+
+    __tablename__ = 'corpus_state'
+
+    id = Column(Integer, primary_key=True)
+    version = Column(BigInteger, nullable=False, server_default='0')
+    updated_at = Column(DateTime, server_default=func.now(), onupdate=func.now())
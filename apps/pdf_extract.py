@@ -7,11 +7,60 @@ import time
 import re
 import json
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
 from extract_data_to_json import process_pdf_to_json  # Import the new JSON processor
+from image_store import get_image_store
+
+try:
+    from pypdf import PdfReader
+except ImportError:  # optional; page counting falls back to scanning the PDF trailer
+    PdfReader = None
 
 load_dotenv()
 client = Mistral(api_key=os.getenv("MISTRAL_API_KEY"))
 
+OCR_MODEL = "mistral-ocr-latest"
+# Page-range sharding for large PDFs: pages per OCR request and concurrent requests
+OCR_SHARD_PAGES = int(os.getenv('OCR_SHARD_PAGES', '25'))
+OCR_CONCURRENCY = int(os.getenv('OCR_CONCURRENCY', '4'))
+
+
+def count_pdf_pages(file_path) -> Optional[int]:
+    """Number of pages in a PDF, or None if it cannot be determined"""
+    if PdfReader is not None:
+        try:
+            return len(PdfReader(file_path).pages)
+        except Exception as e:
+            print(f"Could not read page count with pypdf: {e}")
+    
+    # Without pypdf: the root page tree carries the total in /Count
+    with open(file_path, "rb") as f:
+        data = f.read()
+    counts = [int(n) for n in re.findall(rb"/Type\s*/Pages\b[^>]*?/Count\s+(\d+)", data)]
+    counts += [int(n) for n in re.findall(rb"/Count\s+(\d+)[^>]*?/Type\s*/Pages\b", data)]
+    return max(counts) if counts else None
+
+
+def merge_usage_info(responses):
+    """usage_info of shard responses summed field by field (pages_processed, doc_size_bytes)"""
+    usages = [response.usage_info for response in responses if getattr(response, 'usage_info', None) is not None]
+    if not usages:
+        return None
+    totals = {}
+    for usage in usages:
+        for field, value in usage.model_dump().items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                totals[field] = totals.get(field, 0) + value
+    return usages[0].model_copy(update=totals)
+
+
+def page_shards(page_count: int, shard_pages: int) -> List[List[int]]:
+    """Split 0-based page indexes into consecutive ranges of at most shard_pages"""
+    shard_pages = max(1, shard_pages)
+    return [list(range(start, min(start + shard_pages, page_count)))
+            for start in range(0, page_count, shard_pages)]
+
 
 def clean_ocr_text(text: str) -> str:
     """
@@ -27,29 +76,39 @@ class EnhancedOCRProcessor:
     def __init__(self, client):
         self.client = client
  
+    def upload(self, file_path, file_name="document.pdf"):
+        """Upload a PDF for OCR and return its signed URL"""
+        with open(file_path, "rb") as content:
+            uploaded_file = self.client.files.upload(
+                file={
+                    "file_name": file_name,
+                    "content": content
+                },
+                purpose="ocr"
+            )
+        return self.client.files.get_signed_url(file_id=uploaded_file.id).url
+    
+    def ocr_document_url(self, document_url, pages=None):
+        """Run OCR on an uploaded document, optionally restricted to 0-based page indexes"""
+        kwargs = {"pages": pages} if pages is not None else {}
+        return self.client.ocr.process(
+            model=OCR_MODEL,
+            document={
+                "type": "document_url",
+                "document_url": document_url
+            },
+            include_image_base64=True,
+            **kwargs
+        )
+ 
     def process_with_retry(self, file_path, max_retries=3, delay=2):
         """Process PDF with retry mechanism"""
         for attempt in range(max_retries):
             try:
-                uploaded_file = self.client.files.upload(
-                    file={
-                        "file_name": f"document_attempt_{attempt}.pdf",
-                        "content": open(file_path, "rb")
-                    },
-                    purpose="ocr"
-                )
-                
-                file_url = self.client.files.get_signed_url(file_id=uploaded_file.id)
+                file_url = self.upload(file_path, f"document_attempt_{attempt}.pdf")
                 
                 # Try different processing parameters
-                response = self.client.ocr.process(
-                    model="mistral-ocr-latest",
-                    document={
-                        "type": "document_url",
-                        "document_url": file_url.url
-                    },
-                    include_image_base64=True,
-                )
+                response = self.ocr_document_url(file_url)
                 
                 return response
                 
@@ -60,11 +119,65 @@ class EnhancedOCRProcessor:
                 else:
                     raise
 
-    def process_page_by_page(self, file_path):
-        """Process individual pages if full document processing fails"""
-        # You'd need to split PDF into individual pages first
-       
-        pass
+    def _process_shard(self, document_url, pages, max_retries, delay):
+        """OCR one page range, retrying only this shard with exponential backoff"""
+        label = f"pages {pages[0] + 1}-{pages[-1] + 1}"
+        for attempt in range(max_retries):
+            try:
+                started = time.perf_counter()
+                response = self.ocr_document_url(document_url, pages=pages)
+                print(f"OCR {label}: {len(response.pages)} pages in {time.perf_counter() - started:.1f}s")
+                return response
+            except Exception as e:
+                print(f"OCR {label} attempt {attempt + 1} failed: {e}")
+                if attempt < max_retries - 1:
+                    time.sleep(delay * (2 ** attempt))
+                else:
+                    raise RuntimeError(f"OCR failed for {label} after {max_retries} attempts") from e
+
+    def process_page_by_page(self, file_path, shard_pages=None, max_workers=None, max_retries=3, delay=2):
+        """
+        OCR a large PDF as page-range shards. The file is uploaded once, shards
+        of `shard_pages` pages run concurrently (at most `max_workers` at a time)
+        and are retried independently, then merged into a single response whose
+        pages are in document order - a drop-in replacement for process_with_retry.
+        Small documents, or ones whose page count cannot be read, go through
+        process_with_retry as a single request.
+        """
+        shard_pages = shard_pages or OCR_SHARD_PAGES
+        max_workers = max(1, max_workers or OCR_CONCURRENCY)
+        
+        page_count = count_pdf_pages(file_path)
+        if not page_count or page_count <= shard_pages:
+            return self.process_with_retry(file_path, max_retries=max_retries, delay=delay)
+        
+        shards = page_shards(page_count, shard_pages)
+        print(f"OCR {page_count} pages as {len(shards)} shards ({max_workers} concurrent)...")
+        
+        for attempt in range(max_retries):
+            try:
+                document_url = self.upload(file_path)
+                break
+            except Exception as e:
+                print(f"Upload attempt {attempt + 1} failed: {e}")
+                if attempt < max_retries - 1:
+                    time.sleep(delay)
+                else:
+                    raise
+        
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            responses = list(executor.map(
+                lambda pages: self._process_shard(document_url, pages, max_retries, delay), shards))
+        
+        # Shards come back in submission order; sort by page index in case a shard reorders
+        merged_pages = sorted((page for response in responses for page in response.pages),
+                              key=lambda page: page.index)
+        if len(merged_pages) != page_count:
+            print(f"Warning: expected {page_count} pages, OCR returned {len(merged_pages)}")
+        
+        # One merged response: usage is the sum over the shards, not just the first one's
+        return responses[0].model_copy(update={"pages": merged_pages,
+                                               "usage_info": merge_usage_info(responses)})
     
     def validate_extraction(self, response):
         """Validate and analyze extraction completeness"""
@@ -119,28 +232,25 @@ class EnhancedOCRProcessor:
             with open(pages_dir / f'page_{i+1:03d}.md', 'w', encoding='utf-8') as f:
                 f.write(page.markdown)
         
-        # Export images
+        # JSON conversion decodes every image once into the image store
+        print("\n Converting to JSON format...")
+        document_data = process_pdf_to_json(response, output_dir)
+        
+        # Export images as links to the stored files instead of decoding them again
         images_dir = output_path / "images"
         images_dir.mkdir(exist_ok=True)
         
         image_count = 0
-        for i, page in enumerate(response.pages):
-            for j, image in enumerate(page.images):
+        for page in document_data['pages']:
+            for image in page['images']:
                 try:
-                    parsed_image = self.data_uri_to_bytes(image.image_base64)
-                    image_filename = f"page_{i+1:03d}_image_{j+1:03d}.png"
-                    with open(images_dir / image_filename, 'wb') as f:
-                        f.write(parsed_image)
+                    get_image_store().export(image['image_path'], images_dir / image['filename'])
                     image_count += 1
                 except Exception as e:
-                    print(f"Failed to export image {j+1} from page {i+1}: {e}")
+                    print(f"Failed to export image {image['image_id']}: {e}")
         
         print(f"Exported {image_count} images to {images_dir}")
         
- 
-        print("/n Converting to JSON format...")
-        document_data = process_pdf_to_json(response, output_dir)
-        
         return output_path, document_data
     
     def data_uri_to_bytes(self, data_uri):
@@ -192,7 +302,7 @@ def main():
     try:
 
         print("=== Enhanced Single Processing ===")
-        response = processor.process_with_retry(file_path)
+        response = processor.process_page_by_page(file_path)
         stats = processor.validate_extraction(response)
         
         # Export with validation AND JSON conversion
@@ -0,0 +1,212 @@
+"""
+Streaming ingestion pipeline: OCR -> PDFDataExtractor -> DocumentInserter.
+
+Pages are extracted one at a time and handed to the inserter in windows of
+INGEST_CHECKPOINT_PAGES, so nothing is serialized to JSON and parsed back and
+the document is never held twice in memory. The markdown/image/JSON exports
+that pdf_extract.py produces are optional side outputs (--output-dir).
+
+Usage:
+    python pipeline.py ../pdf_holder/report.pdf --company "Example Corp" --year 2023
+"""
+import argparse
+import importlib.util
+import json
+import time
+from datetime import datetime
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, Iterator, Tuple
+
+from extract_data_to_json import PDFDataExtractor
+from pdf_extract import EnhancedOCRProcessor, client, clean_ocr_text
+from image_store import get_image_store
+
+APPS_DIR = Path(__file__).resolve().parent
+
+
+@lru_cache(maxsize=1)
+def load_inserter_module():
+    """insert._to_db.py cannot be imported by name (dotted filename), so load it from its path"""
+    spec = importlib.util.spec_from_file_location("insert_to_db", APPS_DIR / "insert._to_db.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class ArtifactWriter:
+    """
+    Writes the same files as EnhancedOCRProcessor.enhanced_export + process_pdf_to_json
+    (complete_output.md, pages/*.md, images/*.png, extracted_data.json, db_ready_data.json)
+    incrementally, one page at a time.
+    """
+
+    def __init__(self, output_dir: str):
+        self.output_path = Path(output_dir)
+        self.pages_dir = self.output_path / "pages"
+        self.images_dir = self.output_path / "images"
+        for directory in (self.output_path, self.pages_dir, self.images_dir):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        self._markdown = open(self.output_path / "complete_output.md", 'w', encoding='utf-8')
+        # The JSON files are streamed as {"pages": [...], "document_metadata": {...}}
+        self._extracted = open(self.output_path / "extracted_data.json", 'w', encoding='utf-8')
+        self._db_ready = open(self.output_path / "db_ready_data.json", 'w', encoding='utf-8')
+        for f in (self._extracted, self._db_ready):
+            f.write('{\n"pages": [\n')
+        self._page_count = 0
+
+    def write_page(self, page, page_data: Dict, db_page: Dict):
+        page_num = page_data['page_number']
+
+        self._markdown.write(f"\n\n--- PAGE {page_num} ---\n\n")
+        self._markdown.write(clean_ocr_text(page.markdown))
+        if len(page.markdown.strip()) < 10:
+            self._markdown.write("\n[WARNING: This page has minimal content]\n")
+
+        with open(self.pages_dir / f'page_{page_num:03d}.md', 'w', encoding='utf-8') as f:
+            f.write(page.markdown)
+
+        for image in page_data['images']:
+            try:
+                get_image_store().export(image['image_path'], self.images_dir / image['filename'])
+            except Exception as e:
+                print(f"Failed to export image {image['image_id']}: {e}")
+
+        separator = ",\n" if self._page_count else ""
+        self._extracted.write(separator + json.dumps(page_data, ensure_ascii=False))
+        self._db_ready.write(separator + json.dumps(db_page, ensure_ascii=False))
+        self._page_count += 1
+
+    def close(self, document_metadata: Dict):
+        self._markdown.close()
+        for f in (self._extracted, self._db_ready):
+            f.write('\n],\n"document_metadata": ')
+            f.write(json.dumps(document_metadata, ensure_ascii=False))
+            f.write('\n}\n')
+            f.close()
+        print(f" Side outputs written to {self.output_path}")
+
+
+def stream_pages(response, extractor: PDFDataExtractor) -> Iterator[Tuple[object, Dict]]:
+    """Yield (ocr_page, extracted_page_data) in page order"""
+    for i, page in enumerate(response.pages):
+        yield page, extractor.extract_page_data(page, i + 1)
+
+
+def run_pipeline(pdf_path: str,
+                 company_name: str = None,
+                 report_year: int = None,
+                 response=None,
+                 output_dir: str = None,
+                 processor: EnhancedOCRProcessor = None,
+                 inserter=None,
+                 window: int = None) -> Dict:
+    """
+    OCR a PDF (unless an OCR `response` is given) and stream its pages into the
+    database. Returns a summary with the doc_id, content totals and stage timings.
+    """
+    insert_module = load_inserter_module()
+    processor = processor or EnhancedOCRProcessor(client)
+    inserter = inserter or insert_module.DocumentInserter()
+    extractor = PDFDataExtractor()
+    timings = {'ocr': 0.0, 'extract': 0.0, 'write': 0.0, 'ingest': 0.0}
+
+    print(f" Starting streaming pipeline for: {pdf_path}")
+
+    if response is None:
+        started = time.perf_counter()
+        response = processor.process_page_by_page(pdf_path)
+        timings['ocr'] = time.perf_counter() - started
+    processor.validate_extraction(response)
+    window = insert_module.window_size(len(response.pages), window)
+
+    started = time.perf_counter()
+    file_hash = insert_module.file_sha256(pdf_path) or insert_module.markdown_sha256(
+        page.markdown for page in response.pages)
+    doc_id = inserter.resolve_document(pdf_path, file_hash, company_name, report_year)
+    checkpoints = inserter.load_checkpoints(doc_id)
+    timings['ingest'] += time.perf_counter() - started
+
+    writer = ArtifactWriter(output_dir) if output_dir else None
+    metadata = {
+        'total_pages': len(response.pages),
+        'extraction_timestamp': datetime.now().isoformat(),
+        'total_paragraphs': 0,
+        'total_tables': 0,
+        'total_images': 0,
+    }
+
+    changed = False
+    window_pages = []
+
+    def flush_window():
+        nonlocal changed
+        if not window_pages:
+            return
+        started = time.perf_counter()
+        changed |= inserter.ingest_window(doc_id,
+                                          [db_page for db_page, _ in window_pages],
+                                          [page_data for _, page_data in window_pages],
+                                          checkpoints)
+        timings['ingest'] += time.perf_counter() - started
+        window_pages.clear()
+
+    try:
+        with insert_module.index_maintenance(len(response.pages), checkpoints):
+            started = time.perf_counter()
+            for page, page_data in stream_pages(response, extractor):
+                db_page = extractor.db_ready_page(page_data)
+                metadata['total_paragraphs'] += page_data['metadata']['paragraph_count']
+                metadata['total_tables'] += page_data['metadata']['table_count']
+                metadata['total_images'] += page_data['metadata']['image_count']
+                window_pages.append((db_page, page_data))
+                timings['extract'] += time.perf_counter() - started
+                if writer:
+                    # Side-output I/O (markdown, JSON, image exports) is timed on its own
+                    started = time.perf_counter()
+                    writer.write_page(page, page_data, db_page)
+                    timings['write'] += time.perf_counter() - started
+
+                if len(window_pages) >= window:
+                    flush_window()
+                started = time.perf_counter()
+            flush_window()
+            started = time.perf_counter()
+        # A deferred index rebuild runs on leaving the block and counts as ingest time
+        timings['ingest'] += time.perf_counter() - started
+    finally:
+        if writer:
+            writer.close(metadata)
+
+    started = time.perf_counter()
+    counts = inserter.finish_document(doc_id, len(response.pages), changed)
+    timings['ingest'] += time.perf_counter() - started
+
+    return {
+        'doc_id': doc_id,
+        'file_path': pdf_path,
+        'file_hash': file_hash,
+        'document_metadata': metadata,
+        'rows': counts,
+        'timings': {stage: round(seconds, 3) for stage, seconds in timings.items()},
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OCR a PDF and stream it straight into the database")
+    parser.add_argument("pdf_path")
+    parser.add_argument("--company", dest="company_name")
+    parser.add_argument("--year", dest="report_year", type=int)
+    parser.add_argument("--output-dir", help="Also write the markdown/image/JSON exports here")
+    parser.add_argument("--window", type=int,
+                        help="Pages per committed window (default INGEST_CHECKPOINT_PAGES; 0 = whole document)")
+    args = parser.parse_args()
+
+    summary = run_pipeline(args.pdf_path, args.company_name, args.report_year,
+                           output_dir=args.output_dir, window=args.window)
+    print(json.dumps(summary, indent=2))
+
+
+if __name__ == "__main__":
+    main()
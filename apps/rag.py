@@ -1,43 +1,244 @@
-import psycopg2
 import openai
 import os
 from dotenv import load_dotenv
 import json
 import re
-from typing import List, Dict, Any, Tuple
+import time
+from contextlib import contextmanager
+from typing import List, Dict, Any, Tuple, Optional
 import numpy as np
+from embeddings import EmbeddingBatcher, get_embedding_cache, EMBEDDING_DIMENSIONS
+from db import (
+    get_pool, vector_search_settings_sql, CORPUS_VERSION_SQL,
+    VECTOR_DISTANCE_OPERATOR, VECTOR_SQL_TYPE, VECTOR_BINARY_QUANTIZATION,
+    BINARY_RERANK_FACTOR, BINARY_COLUMN,
+)
+from answer_cache import AnswerCache, ANSWER_CACHE_ENABLED
+from models import TEXT_SEARCH_CONFIG
+from rerank import mmr_rerank, parse_vector, RERANK_CANDIDATES, CONTEXT_CHUNKS
+from vector_snapshot import get_vector_snapshot
 
 load_dotenv()
 
+
+# Reciprocal-rank-fusion constant: higher values flatten the gap between top ranks
+RRF_K = int(os.getenv('RAG_RRF_K', '60'))
+
+# Chat completion settings for answer generation
+ANSWER_MODEL = "gpt-4o-mini"  # Using more capable model for better accuracy
+ANSWER_MAX_TOKENS = 800
+ANSWER_TEMPERATURE = 0.1  # Low temperature for factual accuracy
+
+ANSWER_ERROR_PREFIX = "I found relevant information but encountered an error generating the response"
+NO_RESULTS_ANSWER = "I couldn't find any relevant information in the documents to answer your question. Please try rephrasing your query or asking about different topics."
+
+# Ranked full-text hits over chunks and tables, covering every keyword at once
+KEYWORD_HITS_SQL = """
+    SELECT c.id AS item_id, c.chunk_text AS content, c.page_number, c.doc_id,
+           NULL::jsonb AS table_data_json, 'keyword_text' AS content_type,
+           c.embedding, ts_rank(c.search_vector, kw.query, 32) AS rank
+    FROM document_chunks c, kw
+    WHERE c.search_vector @@ kw.query
+    UNION ALL
+    SELECT t.table_id, t.table_as_text, t.page_number, t.doc_id,
+           t.table_data_json, 'table', t.embedding,
+           ts_rank(t.search_vector, kw.query, 32)
+    FROM extracted_tables t, kw
+    WHERE t.search_vector @@ kw.query
+"""
+
+def nearest_rows_sql(table: str, columns: str) -> str:
+    """
+    The arm_limit rows of table nearest to q.emb (used inside a LATERAL join).
+    With binary quantization, a Hamming-distance pass over the bit column picks
+    BINARY_RERANK_FACTOR x arm_limit candidates, which are then reranked with
+    the full-precision distance.
+    """
+    distance = f"embedding {VECTOR_DISTANCE_OPERATOR} q.emb"
+    if not VECTOR_BINARY_QUANTIZATION:
+        return f"""
+            SELECT {columns}, embedding, {distance} AS distance
+            FROM {table}
+            ORDER BY {distance}
+            LIMIT %(arm_limit)s
+        """
+    return f"""
+            SELECT * FROM (
+                SELECT {columns}, embedding, {distance} AS distance
+                FROM {table}
+                ORDER BY {BINARY_COLUMN} <~> binary_quantize(q.emb)::bit({EMBEDDING_DIMENSIONS})
+                LIMIT %(arm_limit)s * {BINARY_RERANK_FACTOR}
+            ) shortlist
+            ORDER BY distance
+            LIMIT %(arm_limit)s
+        """
+
+
+# Vector arms (every query variant over chunks and tables) and the keyword arm in
+# one statement. Each arm ranks its own hits; rows are grouped by the same
+# content/page key deduplicate_and_rank uses and scored by reciprocal rank fusion.
+# Candidate embeddings come back as pgvector text for the MMR reranker.
+HYBRID_SEARCH_SQL = f"""
+    WITH q AS (
+        SELECT ord, emb::{VECTOR_SQL_TYPE} AS emb
+        FROM unnest(%(embeddings)s::text[]) WITH ORDINALITY AS v(emb, ord)
+    ),
+    kw AS (SELECT to_tsquery('{TEXT_SEARCH_CONFIG}', %(tsquery)s) AS query),
+    text_arm AS (
+        SELECT c.id AS item_id, c.chunk_text AS content, c.page_number, c.doc_id,
+               NULL::jsonb AS table_data_json, 'text' AS content_type, c.embedding, c.distance,
+               row_number() OVER (PARTITION BY q.ord ORDER BY c.distance) AS arm_rank
+        FROM q CROSS JOIN LATERAL ({nearest_rows_sql('document_chunks', 'id, chunk_text, page_number, doc_id')}) c
+    ),
+    table_arm AS (
+        SELECT t.table_id, t.table_as_text, t.page_number, t.doc_id,
+               t.table_data_json, 'table', t.embedding, t.distance,
+               row_number() OVER (PARTITION BY q.ord ORDER BY t.distance)
+        FROM q CROSS JOIN LATERAL ({nearest_rows_sql('extracted_tables', 'table_id, table_as_text, page_number, doc_id, table_data_json')}) t
+    ),
+    keyword_arm AS (
+        SELECT item_id, content, page_number, doc_id, table_data_json, content_type,
+               embedding, NULL::float8 AS distance,
+               row_number() OVER (ORDER BY rank DESC) AS arm_rank
+        FROM ({KEYWORD_HITS_SQL}) hits
+        ORDER BY rank DESC
+        LIMIT %(arm_limit)s
+    ),
+    arms AS (
+        SELECT * FROM text_arm
+        UNION ALL SELECT * FROM table_arm
+        UNION ALL SELECT * FROM keyword_arm
+    ),
+    scored AS (
+        SELECT arms.*,
+               sum(1.0 / (%(rrf_k)s + arm_rank)) OVER w AS rrf_score,
+               min(distance) OVER w AS best_distance
+        FROM arms
+        WINDOW w AS (PARTITION BY left(content, 100), page_number)
+    ),
+    best AS (
+        -- one row per content/page key, preferring a vector hit over a keyword-only hit
+        SELECT DISTINCT ON (left(content, 100), page_number) *
+        FROM scored
+        ORDER BY left(content, 100), page_number, (content_type = 'keyword_text'), arm_rank
+    )
+    SELECT content, page_number, doc_id, table_data_json, content_type, best_distance, rrf_score,
+           embedding::text AS embedding
+    FROM best
+    ORDER BY rrf_score DESC
+    LIMIT %(limit)s
+"""
+
+
+def extract_keywords(query: str) -> List[str]:
+    """Words longer than 3 characters, reduced to tsquery-safe alphanumerics"""
+    seen = []
+    for word in re.findall(r'[a-z0-9]+', query.lower()):
+        if len(word) > 3 and word not in seen:
+            seen.append(word)
+    return seen
+
+
+def to_vector_literal(embedding: List[float]) -> str:
+    return '[' + ','.join(map(str, embedding)) + ']'
+
+
+def result_sources(results: List[Dict]) -> Dict[str, Any]:
+    """Pages, doc_ids and per-result provenance for API responses"""
+    return {
+        'pages': sorted({r['page'] for r in results if r.get('page') is not None}),
+        'doc_ids': sorted({r['doc_id'] for r in results if r.get('doc_id') is not None}),
+        'sources': [{'doc_id': r['doc_id'], 'page': r['page'], 'type': r['type']} for r in results],
+    }
+
+
+def parse_table_json(value) -> Dict:
+    """table_data_json arrives as a dict from psycopg2's jsonb adapter, or as text"""
+    if not value:
+        return {}
+    if isinstance(value, dict):
+        return value
+    try:
+        return json.loads(value)
+    except (TypeError, ValueError):
+        return {}
+
+
+def fuse_search_rows(row_lists: List[List[tuple]], limit: int) -> List[tuple]:
+    """
+    Merge HYBRID_SEARCH_SQL results from statements that ran disjoint arms.
+
+    RRF scores are additive across arms, so summing per content/page key gives
+    the same ranking as fusing every arm in one statement.
+    """
+    merged = {}
+    for rows in row_lists:
+        for row in rows:
+            content, page, doc_id, table_data_json, content_type, distance, rrf_score, embedding = row
+            key = (content[:100], page)
+            if key not in merged:
+                merged[key] = list(row)
+                continue
+            current = merged[key]
+            # Keep a vector hit as the representative row over a keyword-only one
+            if current[4] == 'keyword_text' and content_type != 'keyword_text':
+                current[:5] = row[:5]
+                current[7] = embedding
+            if distance is not None and (current[5] is None or distance < current[5]):
+                current[5] = distance
+            current[6] = float(current[6]) + float(rrf_score)
+    
+    fused = sorted(merged.values(), key=lambda r: float(r[6]), reverse=True)
+    return [tuple(r) for r in fused[:limit]]
+
+
+@contextmanager
+def timed_stage(timings: Optional[Dict[str, float]], stage: str):
+    """Record the wall time of a block in milliseconds under timings[stage]"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        if timings is not None:
+            timings[stage] = round((time.perf_counter() - start) * 1000, 2)
+
+
 class EnhancedRAG:
     def __init__(self):
-        self.db_config = {
-            'host': 'localhost',
-            'database': 'report_agent_11',
-            'user': 'postgres',
-            'password': os.getenv('PG_PASSWORD'),
-            'port': 5432
-        }
+        self.pool = get_pool()
         
         self.openai_client = openai.OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+        self.embedding_model = "text-embedding-3-small"
+        self.embedding_cache = get_embedding_cache()
+        self.answer_cache = AnswerCache() if ANSWER_CACHE_ENABLED else None
         
     def get_embedding(self, text: str) -> List[float]:
         """Get embedding for text with error handling"""
+        return self.embed_texts([text])[0]
+    
+    def embed_texts(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed several texts in one request, consulting the embedding cache first"""
         try:
-            if not text or not text.strip():
-                return None
-            
-            # Clean text
-            text = text.replace('\n', ' ').strip()
-            
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
-            )
-            return response.data[0].embedding
+            # A batcher per call keeps concurrent requests from sharing queue state
+            batcher = EmbeddingBatcher(self.openai_client, self.embedding_model,
+                                       cache=self.embedding_cache)
+            return batcher.embed(texts)
         except Exception as e:
             print(f"Embedding error: {e}")
-            return None
+            return [None] * len(texts)
+    
+    def embed_query_variations(self, query_variations: List[str]) -> Dict[str, List[float]]:
+        """
+        Embed every query variation in a single batched call.
+        Returns {variant: embedding} for the variants that could be embedded,
+        so the answer cache and all retrieval passes of a request share the same vectors.
+        """
+        embeddings = self.embed_texts(query_variations)
+        return {
+            variant: embedding
+            for variant, embedding in zip(query_variations, embeddings)
+            if embedding
+        }
     
     def preprocess_query(self, query: str) -> Dict[str, Any]:
         """Analyze and preprocess the query to determine search strategy"""
@@ -89,119 +290,100 @@ class EnhancedRAG:
                 for synonym in synonyms:
                     variations.append(query.lower().replace(original, synonym))
         
-        return list(set(variations))[:5]  # Limit to 5 variations
+        # Deduplicate keeping order, so the original query always survives the limit
+        return list(dict.fromkeys(variations))[:5]  # Limit to 5 variations
     
-    def hybrid_search(self, query: str, limit: int = 10) -> List[Dict]:
-        """Enhanced hybrid search combining semantic and keyword matching"""
-        query_analysis = self.preprocess_query(query)
-        query_variations = self.expand_query(query)
+    def hybrid_search(self, query: str, limit: int = 10, timings: Optional[Dict[str, float]] = None,
+                      query_embeddings: Optional[Dict[str, List[float]]] = None) -> List[Dict]:
+        """
+        Enhanced hybrid search combining semantic and keyword matching.
+        All retrieval arms and their rank fusion run as one SQL statement (or, with
+        RAG_VECTOR_BACKEND=snapshot, the vector arms run in-process over the memory-mapped
+        snapshot and only the keyword arm runs in SQL); the top RERANK_CANDIDATES fused
+        rows are then reranked for diversity down to `limit`.
+        Pass a dict as `timings` to receive per-stage durations in milliseconds, and
+        `query_embeddings` (from embed_query_variations) if they were already computed.
+        """
+        with timed_stage(timings, 'preprocess'):
+            query_analysis = self.preprocess_query(query)
+        with timed_stage(timings, 'expand'):
+            query_variations = self.expand_query(query)
+        
+        # Embed all variations once; every vector arm below reuses them
+        if query_embeddings is None:
+            with timed_stage(timings, 'embed_queries'):
+                query_embeddings = self.embed_query_variations(query_variations)
         
-        all_results = []
+        embeddings = list(query_embeddings.values())
+        candidates = max(limit, RERANK_CANDIDATES)
+        
+        # RAG_VECTOR_BACKEND=snapshot: vector arms run in-process, only the keyword arm goes to SQL
+        snapshot = get_vector_snapshot()
+        snapshot_rows = None
+        if snapshot is not None:
+            try:
+                with timed_stage(timings, 'vector_snapshot'):
+                    snapshot_rows = snapshot.search_rows(embeddings, limit, RRF_K)
+                embeddings = []
+            except Exception as e:
+                # A corrupt or half-written snapshot falls back to the SQL vector arms
+                print(f"Vector snapshot search error, using SQL: {e}")
+                snapshot_rows = None
+        
+        params = self.build_search_params(query, embeddings, limit)
+        params['limit'] = candidates
         
         try:
-            with psycopg2.connect(**self.db_config) as conn:
+            with timed_stage(timings, 'sql'), self.pool.connection() as conn:
                 with conn.cursor() as cur:
-                    # 1. Semantic search with multiple query variations
-                    for q_variant in query_variations:
-                        query_embedding = self.get_embedding(q_variant)
-                        if not query_embedding:
-                            continue
-                        
-                        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-                        
-                        # Search text chunks
-                        cur.execute("""
-                            SELECT chunk_text, page_number, doc_id,
-                                   (embedding <-> %s::vector) as distance,
-                                   'text' as content_type
-                            FROM document_chunks
-                            WHERE doc_id IS NOT NULL
-                            ORDER BY distance
-                            LIMIT %s
-                        """, (embedding_str, limit))
-                        
-                        results = cur.fetchall()
-                        for row in results:
-                            all_results.append({
-                                'content': row[0],
-                                'page': row[1],
-                                'doc_id': row[2],
-                                'distance': row[3],
-                                'type': 'text',
-                                'score': 1 / (1 + row[3]),  # Convert distance to similarity score
-                                'query_variant': q_variant
-                            })
-                    
-                    # 2. Table-focused search (especially important for your data)
-                    for q_variant in query_variations:
-                        query_embedding = self.get_embedding(q_variant)
-                        if not query_embedding:
-                            continue
-                        
-                        embedding_str = '[' + ','.join(map(str, query_embedding)) + ']'
-                        
-                        cur.execute("""
-                            SELECT table_as_text, page_number, doc_id, table_data_json,
-                                   (embedding <-> %s::vector) as distance,
-                                   'table' as content_type
-                            FROM extracted_tables
-                            WHERE doc_id IS NOT NULL
-                            ORDER BY distance
-                            LIMIT %s
-                        """, (embedding_str, limit))
-                        
-                        table_results = cur.fetchall()
-                        for row in table_results:
-                            # Parse table JSON for structured data
-                            table_json = {}
-                            try:
-                                table_json = json.loads(row[3]) if row[3] else {}
-                            except:
-                                pass
-                            
-                            all_results.append({
-                                'content': row[0],
-                                'page': row[1],
-                                'doc_id': row[2],
-                                'distance': row[4],
-                                'type': 'table',
-                                'score': 1 / (1 + row[4]),
-                                'table_data': table_json,
-                                'query_variant': q_variant
-                            })
-                    
-                    # 3. Keyword-based fallback search
-                    keywords = query.lower().split()
-                    for keyword in keywords:
-                        if len(keyword) > 3:  # Skip short words
-                            cur.execute("""
-                                SELECT chunk_text, page_number, doc_id,
-                                       'keyword_text' as content_type
-                                FROM document_chunks
-                                WHERE LOWER(chunk_text) LIKE %s
-                                LIMIT 5
-                            """, (f'%{keyword}%',))
-                            
-                            keyword_results = cur.fetchall()
-                            for row in keyword_results:
-                                all_results.append({
-                                    'content': row[0],
-                                    'page': row[1],
-                                    'doc_id': row[2],
-                                    'distance': 0.5,  # Fixed distance for keyword matches
-                                    'type': 'keyword_text',
-                                    'score': 0.7,
-                                    'matched_keyword': keyword
-                                })
+                    # Tune the ANN index (ef_search / probes) in the same round trip
+                    search_settings = vector_search_settings_sql()
+                    sql = f"{search_settings};{HYBRID_SEARCH_SQL}" if search_settings else HYBRID_SEARCH_SQL
+                    cur.execute(sql, params)
+                    rows = cur.fetchall()
         
         except Exception as e:
             print(f"Search error: {e}")
             return []
         
-        # Remove duplicates and rank results
-        unique_results = self.deduplicate_and_rank(all_results, query_analysis)
+        if snapshot_rows is not None:
+            rows = fuse_search_rows([snapshot_rows, rows], candidates)
         
-        return unique_results[:limit]
+        # Apply query-pattern boosts to the fused ranking, then pick a diverse top `limit`
+        with timed_stage(timings, 'dedupe_rank'):
+            unique_results = self.deduplicate_and_rank(self.rows_to_results(rows), query_analysis)
+        with timed_stage(timings, 'mmr'):
+            return mmr_rerank(unique_results, limit)
+    
+    def build_search_params(self, query: str, embeddings: List[List[float]], limit: int) -> Dict[str, Any]:
+        """Parameters for HYBRID_SEARCH_SQL"""
+        keywords = extract_keywords(query)
+        return {
+            'embeddings': [to_vector_literal(embedding) for embedding in embeddings],
+            'tsquery': ' | '.join(keywords) if keywords else None,
+            'arm_limit': limit,
+            'rrf_k': RRF_K,
+            'limit': limit,
+        }
+    
+    def rows_to_results(self, rows: List[tuple]) -> List[Dict]:
+        """Convert fused search rows into the result dicts used downstream"""
+        results = []
+        for content, page, doc_id, table_data_json, content_type, distance, rrf_score, embedding in rows:
+            result = {
+                'content': content,
+                'page': page,
+                'doc_id': doc_id,
+                # keyword-only hits have no vector distance
+                'distance': distance if distance is not None else 0.5,
+                'type': content_type,
+                'score': float(rrf_score),
+                'embedding': parse_vector(embedding),  # consumed by mmr_rerank
+            }
+            if content_type == 'table':
+                result['table_data'] = parse_table_json(table_data_json)
+            results.append(result)
+        return results
     
     def deduplicate_and_rank(self, results: List[Dict], query_analysis: Dict) -> List[Dict]:
         """Remove duplicates and rank results by relevance"""
@@ -266,11 +448,8 @@ class EnhancedRAG:
         
         return "\n".join(context_parts)
     
-    def generate_enhanced_answer(self, query: str, results: List[Dict]) -> str:
-        """Generate comprehensive answer with enhanced prompting"""
-        if not results:
-            return "I couldn't find any relevant information in the documents to answer your question. Please try rephrasing your query or asking about different topics."
-        
+    def build_answer_prompt(self, query: str, results: List[Dict]) -> str:
+        """Build the answer-generation prompt from the retrieved results"""
         context = self.format_context_for_llm(results, query)
         query_analysis = self.preprocess_query(query)
         
@@ -301,28 +480,80 @@ INSTRUCTIONS:
 - No formatting like bullet points or headers
 
 ANSWER:"""
+        return prompt
+    
+    def generate_enhanced_answer(self, query: str, results: List[Dict],
+                                 timings: Optional[Dict[str, float]] = None) -> str:
+        """Generate comprehensive answer with enhanced prompting"""
+        if not results:
+            return NO_RESULTS_ANSWER
+        
+        with timed_stage(timings, 'context'):
+            prompt = self.build_answer_prompt(query, results)
         
         try:
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o-mini",  # Using more capable model for better accuracy
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=800,
-                temperature=0.1  # Low temperature for factual accuracy
-            )
+            with timed_stage(timings, 'llm'):
+                response = self.openai_client.chat.completions.create(
+                    model=ANSWER_MODEL,
+                    messages=[{"role": "user", "content": prompt}],
+                    max_tokens=ANSWER_MAX_TOKENS,
+                    temperature=ANSWER_TEMPERATURE
+                )
             return response.choices[0].message.content
         except Exception as e:
-            return f"I found relevant information but encountered an error generating the response: {e}"
+            return f"{ANSWER_ERROR_PREFIX}: {e}"
+    
+    def refresh_corpus_version(self):
+        """Re-read the corpus version (throttled) so the answer cache drops stale answers"""
+        if self.answer_cache is None or not self.answer_cache.needs_version_check():
+            return
+        try:
+            with self.pool.connection() as conn:
+                with conn.cursor() as cur:
+                    cur.execute(CORPUS_VERSION_SQL)
+                    self.answer_cache.observe_version(cur.fetchone()[0])
+        except Exception as e:
+            print(f"Could not read corpus version: {e}")
+    
+    def cache_answer(self, question: str, query_embeddings: Dict[str, List[float]], answer: str, results: List[Dict]):
+        """Store a successful answer under the question's embedding"""
+        if self.answer_cache is None or not results or answer.startswith(ANSWER_ERROR_PREFIX):
+            return
+        self.answer_cache.put(question, query_embeddings.get(question), answer, result_sources(results)['sources'])
     
     def ask(self, question: str) -> str:
         """Main function to ask a question and get a direct answer"""
-        # Search for relevant documents
-        results = self.hybrid_search(question, limit=8)
+        timings = {}
+        
+        # 1. Exact-match answer cache
+        cached = None
+        if self.answer_cache is not None:
+            with timed_stage(timings, 'answer_cache'):
+                self.refresh_corpus_version()
+                cached = self.answer_cache.get_exact(question)
+        
+        # 2. Near-duplicate match on the question embedding (reused for retrieval on a miss)
+        query_embeddings = {}
+        if cached is None:
+            with timed_stage(timings, 'embed_queries'):
+                query_embeddings = self.embed_query_variations(self.expand_query(question))
+            if self.answer_cache is not None:
+                cached = self.answer_cache.get_similar(query_embeddings.get(question), question)
         
-        # Generate answer
-        answer = self.generate_enhanced_answer(question, results)
+        if cached is not None:
+            answer = cached['answer']
+        else:
+            # Search for relevant documents
+            results = self.hybrid_search(question, limit=CONTEXT_CHUNKS, timings=timings, query_embeddings=query_embeddings)
+            
+            # Generate answer (stages 'context' and 'llm')
+            answer = self.generate_enhanced_answer(question, results, timings)
+            
+            self.cache_answer(question, query_embeddings, answer, results)
         
         print(f"\n**Question:** {question}")
-        print(f"**Answer:** {answer}")
+        print(f"**Answer:** {answer}{' (cached)' if cached is not None else ''}")
+        print("**Timings (ms):** " + ", ".join(f"{stage}={ms}" for stage, ms in timings.items()))
         
         return answer
     
@@ -0,0 +1,79 @@
+import os
+from typing import List, Dict, Optional
+
+import numpy as np
+
+# Trade-off between relevance (1.0) and diversity (0.0) in maximal marginal relevance
+MMR_LAMBDA = float(os.getenv('RAG_MMR_LAMBDA', '0.7'))
+# Fused candidates fetched for reranking, and chunks finally passed to the LLM
+RERANK_CANDIDATES = int(os.getenv('RAG_RERANK_CANDIDATES', '24'))
+CONTEXT_CHUNKS = int(os.getenv('RAG_CONTEXT_CHUNKS', '5'))
+
+
+def parse_vector(value) -> Optional[np.ndarray]:
+    """pgvector text ('[0.1,0.2,...]') or a sequence -> float32 array"""
+    if value is None:
+        return None
+    if isinstance(value, str):
+        return np.array(value.strip('[]').split(','), dtype=np.float32)
+    return np.asarray(value, dtype=np.float32)
+
+
+def mmr_select(relevance: np.ndarray, embeddings: np.ndarray, k: int, lambda_: float = MMR_LAMBDA) -> List[int]:
+    """
+    Greedy maximal marginal relevance over n candidates.
+
+    relevance: (n,) scores in [0, 1]; embeddings: (n, d) rows (zero rows = unknown,
+    never penalized as redundant). All pairwise cosine similarities come from one
+    matrix product; each greedy step is a vectorized update of the running
+    max-similarity-to-selected vector. Returns candidate indexes in selection order.
+    """
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    unit = np.divide(embeddings, norms, out=np.zeros_like(embeddings), where=norms > 0)
+    similarity = unit @ unit.T
+
+    selected = [int(np.argmax(relevance))]
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    max_similarity = similarity[selected[0]].copy()
+
+    while len(selected) < k:
+        scores = lambda_ * relevance - (1.0 - lambda_) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+
+    return selected
+
+
+def mmr_rerank(results: List[Dict], k: int, lambda_: float = MMR_LAMBDA,
+               score_key: str = 'final_score') -> List[Dict]:
+    """
+    Pick a diverse top-k from ranked results carrying an 'embedding' entry.
+    Relevance is the existing score scaled to [0, 1], so query-pattern boosts
+    still count. The 'embedding' entries are removed from the returned results.
+    """
+    if not results:
+        return []
+
+    vectors = [r.pop('embedding', None) for r in results]
+    if len(results) <= k or lambda_ >= 1.0:
+        return results[:k]
+
+    dim = next((len(v) for v in vectors if v is not None), 0)
+    if dim == 0:
+        return results[:k]
+    embeddings = np.stack([v if v is not None else np.zeros(dim, dtype=np.float32) for v in vectors])
+
+    scores = np.array([float(r.get(score_key, 0.0)) for r in results], dtype=np.float32)
+    top = scores.max()
+    relevance = scores / top if top > 0 else scores
+
+    return [results[i] for i in mmr_select(relevance, embeddings, k, lambda_)]
@@ -0,0 +1,59 @@
+"""
+Chunk planner tests: run from apps/ with `python -m pytest`.
+
+The document_chunks table is modelled as {page_number: [chunk texts]}, cleared
+per page the way DocumentInserter.plan_pages/clear_pages do before re-ingesting.
+"""
+from chunk_planner import ChunkPlanner, chunk_hash
+
+SHARED = "Forward-looking statements involve risks and uncertainties described in this report."
+
+
+def store(rows, planned):
+    for chunk in planned:
+        rows.setdefault(chunk.page_number, []).append(chunk.text)
+
+
+def stored_hashes(rows):
+    """existing_hashes callback over the modelled table"""
+    hashes = {chunk_hash(text) for texts in rows.values() for text in texts}
+    return lambda candidates: set(candidates) & hashes
+
+
+def test_duplicate_across_pages_is_stored_per_page_and_embedded_once():
+    planner = ChunkPlanner(['paragraph'])
+    planned = planner.plan([
+        {'page_number': 1, 'paragraphs': [SHARED, SHARED]},
+        {'page_number': 2, 'paragraphs': [SHARED]},
+    ])
+
+    assert [(c.page_number, c.reused) for c in planned] == [(1, False), (2, True)]
+    totals = planner.report()['total']
+    assert totals['duplicates'] == 1
+    assert totals['reused_vectors'] == 1
+
+
+def test_editing_one_page_of_a_two_page_duplicate_keeps_the_text():
+    pages = [
+        {'page_number': 1, 'paragraphs': [SHARED, "Revenue grew 12% to 4.1 billion in 2023."]},
+        {'page_number': 2, 'paragraphs': [SHARED, "Operating margin widened to 18% in 2023."]},
+    ]
+    rows = {}
+    store(rows, ChunkPlanner(['paragraph']).plan(pages))
+
+    # Page 1 is edited: its rows are cleared and only it is planned again (a resumed run)
+    edited = {'page_number': 1, 'paragraphs': ["Revenue grew 15% to 4.3 billion in 2023."]}
+    rows.pop(1)
+    store(rows, ChunkPlanner(['paragraph'], existing_hashes=stored_hashes(rows)).plan([edited]))
+
+    assert SHARED in rows[2]
+    assert SHARED not in rows[1]
+
+
+def test_resumed_page_reuses_vectors_stored_by_earlier_pages():
+    rows = {2: [SHARED]}
+    planner = ChunkPlanner(['paragraph'], existing_hashes=stored_hashes(rows))
+    planned = planner.plan([{'page_number': 1, 'paragraphs': [SHARED]}])
+
+    assert [(c.page_number, c.reused) for c in planned] == [(1, True)]
+    assert planner.report()['total']['estimated_tokens'] == 0
@@ -0,0 +1,186 @@
+"""
+Recall vs. latency of the configured vector storage.
+
+Stored embeddings are sampled as queries. Their exact nearest neighbours (a
+sequential scan with index scans disabled) are the ground truth for:
+    ann       the ANN index at several ef_search / probes values
+    binary    the Hamming pass over the binary-quantized column followed by a
+              full-precision rerank, at several rerank factors (PG_VECTOR_BINARY)
+Also reports the on-disk size of the table, its embedding column and indexes.
+
+Usage:
+    python vector_recall.py --queries 200 --k 10
+    python vector_recall.py --table extracted_tables --ann 20,40,100 --factors 2,4,8 --output recall.json
+"""
+import argparse
+import json
+import time
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from db import (
+    get_pool, VECTOR_INDEX_TYPE, VECTOR_DISTANCE_OPERATOR, VECTOR_SQL_TYPE, VECTOR_BINARY_QUANTIZATION,
+    VECTOR_INDEXED_COLUMNS, BINARY_COLUMN, HNSW_EF_SEARCH, IVFFLAT_PROBES,
+)
+from embeddings import EMBEDDING_DIMENSIONS
+
+ID_COLUMNS = {
+    'document_chunks': 'id',
+    'extracted_tables': 'table_id',
+}
+ANN_SETTING = {'hnsw': 'hnsw.ef_search', 'ivfflat': 'ivfflat.probes'}
+
+
+def sample_queries(cursor, table: str, count: int) -> List[str]:
+    cursor.execute(f"""
+        SELECT embedding::text FROM {table}
+        WHERE embedding IS NOT NULL
+        ORDER BY random()
+        LIMIT %s
+    """, (count,))
+    return [row[0] for row in cursor.fetchall()]
+
+
+def exact_sql(table: str) -> str:
+    return f"""
+        SELECT {ID_COLUMNS[table]} FROM {table}
+        ORDER BY embedding {VECTOR_DISTANCE_OPERATOR} %(q)s::{VECTOR_SQL_TYPE}
+        LIMIT %(k)s
+    """
+
+
+def binary_sql(table: str) -> str:
+    return f"""
+        SELECT id FROM (
+            SELECT {ID_COLUMNS[table]} AS id,
+                   embedding {VECTOR_DISTANCE_OPERATOR} %(q)s::{VECTOR_SQL_TYPE} AS distance
+            FROM {table}
+            ORDER BY {BINARY_COLUMN} <~> binary_quantize(%(q)s::{VECTOR_SQL_TYPE})::bit({EMBEDDING_DIMENSIONS})
+            LIMIT %(shortlist)s
+        ) shortlist
+        ORDER BY distance
+        LIMIT %(k)s
+    """
+
+
+def run_queries(conn, sql: str, queries: List[str], params: Dict, settings: List[str]):
+    """Ids returned per query and per-query latency in ms; each query runs in its own transaction"""
+    ids, latencies = [], []
+    with conn.cursor() as cursor:
+        for query in queries:
+            for statement in settings:
+                cursor.execute(statement)
+            started = time.perf_counter()
+            cursor.execute(sql, dict(params, q=query))
+            rows = cursor.fetchall()
+            latencies.append((time.perf_counter() - started) * 1000)
+            ids.append([row[0] for row in rows])
+            conn.rollback()
+    return ids, latencies
+
+
+def summarize(name: str, value, ids: List[List], truth: List[List], latencies: List[float], k: int) -> Dict:
+    recalls = [len(set(found) & set(expected)) / max(len(expected), 1) for found, expected in zip(ids, truth)]
+    return {
+        'method': name,
+        'parameter': value,
+        f'recall@{k}': round(float(np.mean(recalls)), 4),
+        'p50_ms': round(float(np.percentile(latencies, 50)), 3),
+        'p95_ms': round(float(np.percentile(latencies, 95)), 3),
+        'mean_ms': round(float(np.mean(latencies)), 3),
+    }
+
+
+def storage_report(cursor, table: str) -> Dict:
+    cursor.execute(f"""
+        SELECT count(*), pg_total_relation_size('{table}'), pg_relation_size('{table}'),
+               COALESCE(avg(pg_column_size(embedding)), 0)
+        FROM {table}
+    """)
+    rows, total_bytes, heap_bytes, embedding_bytes = cursor.fetchone()
+    cursor.execute("""
+        SELECT i.relname, pg_relation_size(i.oid)
+        FROM pg_index x
+        JOIN pg_class i ON i.oid = x.indexrelid
+        JOIN pg_class t ON t.oid = x.indrelid
+        WHERE t.relname = %s
+        ORDER BY i.relname
+    """, (table,))
+    return {
+        'storage': VECTOR_SQL_TYPE,
+        'binary_column': VECTOR_BINARY_QUANTIZATION,
+        'rows': rows,
+        'total_bytes': total_bytes,
+        'heap_bytes': heap_bytes,
+        'avg_embedding_bytes': round(float(embedding_bytes), 1),
+        'indexes': {name: size for name, size in cursor.fetchall()},
+    }
+
+
+def measure(table: str = 'document_chunks', queries: int = 100, k: int = 10,
+            ann_values: Optional[List[int]] = None, factors: Optional[List[int]] = None) -> Dict:
+    """Recall@k and latency per method/parameter, plus the storage footprint"""
+    if table not in VECTOR_INDEXED_COLUMNS:
+        raise ValueError(f"table must be one of {', '.join(VECTOR_INDEXED_COLUMNS)}")
+    setting = ANN_SETTING.get(VECTOR_INDEX_TYPE)
+    default_ann = HNSW_EF_SEARCH if VECTOR_INDEX_TYPE == 'hnsw' else IVFFLAT_PROBES
+    ann_values = ann_values or [default_ann]
+    factors = factors or [1, 2, 4, 8]
+
+    with get_pool().connection() as conn:
+        with conn.cursor() as cursor:
+            sample = sample_queries(cursor, table, queries)
+            storage = storage_report(cursor, table)
+        conn.commit()
+        if not sample:
+            return {'table': table, 'queries': 0, 'storage': storage, 'results': []}
+
+        exact_settings = ["SET LOCAL enable_indexscan = off", "SET LOCAL enable_bitmapscan = off"]
+        truth, exact_latencies = run_queries(conn, exact_sql(table), sample, {'k': k}, exact_settings)
+        results = [summarize('exact', None, truth, truth, exact_latencies, k)]
+
+        if setting:
+            for value in ann_values:
+                ids, latencies = run_queries(conn, exact_sql(table), sample, {'k': k},
+                                             [f"SET LOCAL {setting} = {int(value)}"])
+                results.append(summarize('ann', value, ids, truth, latencies, k))
+
+        if VECTOR_BINARY_QUANTIZATION:
+            for factor in factors:
+                # hnsw returns at most ef_search rows, so it has to cover the shortlist
+                settings = []
+                if VECTOR_INDEX_TYPE == 'hnsw':
+                    settings = [f"SET LOCAL hnsw.ef_search = {max(default_ann, k * factor)}"]
+                ids, latencies = run_queries(conn, binary_sql(table), sample,
+                                             {'k': k, 'shortlist': k * factor}, settings)
+                results.append(summarize('binary', factor, ids, truth, latencies, k))
+
+    return {'table': table, 'queries': len(sample), 'k': k, 'index': VECTOR_INDEX_TYPE,
+            'distance_operator': VECTOR_DISTANCE_OPERATOR, 'storage': storage, 'results': results}
+
+
+def parse_ints(value: str) -> List[int]:
+    return [int(v) for v in value.split(',') if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure vector search recall against latency")
+    parser.add_argument("--table", default="document_chunks", choices=sorted(VECTOR_INDEXED_COLUMNS))
+    parser.add_argument("--queries", type=int, default=100, help="Stored embeddings sampled as queries")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--ann", type=parse_ints, help="ef_search (hnsw) or probes (ivfflat) values to sweep")
+    parser.add_argument("--factors", type=parse_ints, help="Binary shortlist sizes as multiples of k")
+    parser.add_argument("--output", help="Also write the report to this JSON file")
+    args = parser.parse_args()
+
+    report = measure(args.table, args.queries, args.k, args.ann, args.factors)
+    text = json.dumps(report, indent=2)
+    print(text)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,391 @@
+"""
+In-process vector search over a memory-mapped snapshot of the embeddings.
+
+With RAG_VECTOR_BACKEND=snapshot, hybrid_search answers the vector arms from
+a float16 matrix exported from document_chunks and extracted_tables instead of
+querying pgvector; only the keyword arm still goes to Postgres. Exact (brute
+force) top-k: one matmul per block of rows for all query variants, then
+argpartition.
+
+Snapshot directory (VECTOR_SNAPSHOT_DIR):
+    vectors.f16   row-major float16 embeddings, append-only
+    norms.f32     float32 L2 norm of each row
+    kinds.i1      0 = document_chunks row, 1 = extracted_tables row
+    meta.jsonl    one [kind, id, doc_id, page_number, content, table_data_json] per row
+    state.json    row count, dimension and the highest exported id per table
+
+Ingestion refreshes the snapshot incrementally after each document (new rows
+are appended; deleted rows trigger a rebuild). Readers reload when state.json
+changes. Usage:
+    python vector_snapshot.py build | refresh | stats
+"""
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from db import VECTOR_DISTANCE
+from embeddings import EMBEDDING_DIMENSIONS
+
+# postgres: vector arms run in SQL (default); snapshot: vector arms run in-process
+VECTOR_BACKEND = os.getenv('RAG_VECTOR_BACKEND', 'postgres').lower()
+VECTOR_SNAPSHOT_DIR = os.getenv('VECTOR_SNAPSHOT_DIR', str(Path(__file__).parent / 'vector_snapshot'))
+# How often readers check state.json for a newer snapshot
+VECTOR_SNAPSHOT_RELOAD_SECONDS = float(os.getenv('VECTOR_SNAPSHOT_RELOAD_SECONDS', '10'))
+# Rows converted to float32 per matmul; bounds the temporary memory of a search
+VECTOR_SNAPSHOT_BLOCK_ROWS = int(os.getenv('VECTOR_SNAPSHOT_BLOCK_ROWS', '65536'))
+EXPORT_FETCH_ROWS = 2000
+
+KIND_CHUNK, KIND_TABLE = 0, 1
+
+# kind -> (table, id column, content column, table_data_json expression, content_type)
+SNAPSHOT_SOURCES = {
+    KIND_CHUNK: ('document_chunks', 'id', 'chunk_text', 'NULL::text', 'text'),
+    KIND_TABLE: ('extracted_tables', 'table_id', 'table_as_text', 'table_data_json::text', 'table'),
+}
+
+
+def snapshot_enabled() -> bool:
+    return VECTOR_BACKEND == 'snapshot'
+
+
+@contextmanager
+def exclusive_file_lock(lock_file):
+    """
+    Blocking exclusive lock on an open file: fcntl.flock on POSIX, msvcrt.locking
+    on Windows. Both are imported here so the module loads on either platform.
+    """
+    if os.name == 'nt':
+        import msvcrt
+        lock_file.seek(0)
+        while True:
+            try:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                # LK_LOCK gives up after ~10 seconds; keep waiting like flock does
+                continue
+        try:
+            yield
+        finally:
+            lock_file.seek(0)
+            msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+    else:
+        import fcntl
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+class VectorSnapshot:
+    def __init__(self, directory: str = VECTOR_SNAPSHOT_DIR):
+        self.directory = Path(directory)
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._checked_at = 0.0
+        self.state = {'count': 0, 'dim': 0, 'max_ids': {}}
+        self.vectors = None
+        self.norms = None
+        self.kinds = None
+        self.meta: List[list] = []
+
+    # --- files ------------------------------------------------------------
+
+    def _path(self, name: str, directory: Optional[Path] = None) -> Path:
+        return (directory or self.directory) / name
+
+    @contextmanager
+    def _writer_lock(self):
+        """One writer at a time across threads and processes (ingest workers)"""
+        self.directory.parent.mkdir(parents=True, exist_ok=True)
+        with open(f"{self.directory}.lock", 'w') as lock_file, exclusive_file_lock(lock_file):
+            yield
+
+    def _read_state(self, directory: Optional[Path] = None) -> Optional[Dict]:
+        try:
+            with open(self._path('state.json', directory), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write_state(self, state: Dict, directory: Optional[Path] = None):
+        path = self._path('state.json', directory)
+        tmp = path.with_suffix('.tmp')
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+        os.replace(tmp, path)
+
+    # --- reading ----------------------------------------------------------
+
+    def load(self) -> bool:
+        """Map the snapshot on disk; returns False if there is none yet"""
+        state = self._read_state()
+        if state is None or not state.get('count'):
+            return False
+        count, dim = state['count'], state['dim']
+
+        # state.json is written last, so files may hold a partially appended tail; map only `count` rows
+        vectors = np.memmap(self._path('vectors.f16'), dtype=np.float16, mode='r', shape=(count, dim))
+        norms = np.memmap(self._path('norms.f32'), dtype=np.float32, mode='r', shape=(count,))
+        kinds = np.memmap(self._path('kinds.i1'), dtype=np.int8, mode='r', shape=(count,))
+        meta = []
+        with open(self._path('meta.jsonl'), 'r', encoding='utf-8') as f:
+            for line in f:
+                if len(meta) == count:
+                    break
+                meta.append(json.loads(line))
+
+        with self._lock:
+            self.state, self.vectors, self.norms, self.kinds, self.meta = state, vectors, norms, kinds, meta
+            self._loaded_mtime = self._path('state.json').stat().st_mtime
+        return True
+
+    def maybe_reload(self):
+        """Pick up a snapshot refreshed by ingestion (throttled stat of state.json)"""
+        now = time.monotonic()
+        if now - self._checked_at < VECTOR_SNAPSHOT_RELOAD_SECONDS and self.vectors is not None:
+            return
+        self._checked_at = now
+        try:
+            mtime = self._path('state.json').stat().st_mtime
+        except FileNotFoundError:
+            return
+        if mtime != self._loaded_mtime:
+            self.load()
+
+    @property
+    def size(self) -> int:
+        return self.state.get('count', 0)
+
+    # --- search -----------------------------------------------------------
+
+    def _distances(self, block: np.ndarray, block_norms: np.ndarray,
+                   queries: np.ndarray, query_norms: np.ndarray) -> np.ndarray:
+        """(rows, variants) distances in pgvector's convention for VECTOR_DISTANCE"""
+        dots = block.astype(np.float32) @ queries.T
+        if VECTOR_DISTANCE == 'ip':
+            return -dots
+        if VECTOR_DISTANCE == 'cosine':
+            denominator = np.outer(block_norms, query_norms)
+            return 1.0 - np.divide(dots, denominator, out=np.zeros_like(dots), where=denominator > 0)
+        squared = block_norms[:, None] ** 2 - 2.0 * dots + query_norms[None, :] ** 2
+        return np.sqrt(np.maximum(squared, 0.0))
+
+    def _arrays(self) -> tuple:
+        """The currently loaded (vectors, norms, kinds, meta), consistent with each other"""
+        with self._lock:
+            return self.vectors, self.norms, self.kinds, self.meta
+
+    def top_k(self, embeddings: List[List[float]], k: int,
+              arrays: Optional[tuple] = None) -> Dict[int, List[List[Tuple[int, float]]]]:
+        """
+        Exact top-k per query variant and per kind:
+        {kind: [[(row, distance), ...] for each variant]}, nearest first.
+        """
+        vectors, norms, kinds, _ = arrays or self._arrays()
+        results = {kind: [[] for _ in embeddings] for kind in SNAPSHOT_SOURCES}
+        if vectors is None or not embeddings:
+            return results
+
+        queries = np.asarray(embeddings, dtype=np.float32)
+        query_norms = np.linalg.norm(queries, axis=1)
+        candidates = {kind: [] for kind in SNAPSHOT_SOURCES}  # (rows, distances) per block
+
+        for start in range(0, len(vectors), VECTOR_SNAPSHOT_BLOCK_ROWS):
+            stop = start + VECTOR_SNAPSHOT_BLOCK_ROWS
+            distances = self._distances(vectors[start:stop], norms[start:stop], queries, query_norms)
+            block_kinds = np.asarray(kinds[start:stop])
+            for kind in SNAPSHOT_SOURCES:
+                rows = np.flatnonzero(block_kinds == kind)
+                if not len(rows):
+                    continue
+                kind_distances = distances[rows]
+                if len(rows) > k:
+                    keep = np.argpartition(kind_distances, k - 1, axis=0)[:k]  # (k, variants)
+                else:
+                    keep = np.tile(np.arange(len(rows))[:, None], (1, len(embeddings)))
+                candidates[kind].append((rows[keep] + start, np.take_along_axis(kind_distances, keep, axis=0)))
+
+        for kind, blocks in candidates.items():
+            if not blocks:
+                continue
+            rows = np.concatenate([b[0] for b in blocks])
+            distances = np.concatenate([b[1] for b in blocks])
+            order = np.argsort(distances, axis=0)[:k]
+            for variant in range(len(embeddings)):
+                picked = order[:, variant]
+                results[kind][variant] = list(zip(rows[picked, variant].tolist(),
+                                                  distances[picked, variant].tolist()))
+        return results
+
+    def search_rows(self, embeddings: List[List[float]], arm_limit: int, rrf_k: int) -> List[tuple]:
+        """
+        The vector arms of HYBRID_SEARCH_SQL computed in-process: rows shaped like
+        its output (content, page, doc_id, table_data_json, content_type,
+        best_distance, rrf_score, embedding), fused per content/page key, ready
+        for fuse_search_rows together with the SQL keyword arm.
+        """
+        arrays = self._arrays()
+        vectors, meta = arrays[0], arrays[3]
+        fused = {}
+        for kind, variants in self.top_k(embeddings, arm_limit, arrays).items():
+            content_type = SNAPSHOT_SOURCES[kind][4]
+            for hits in variants:
+                for arm_rank, (row, distance) in enumerate(hits, 1):
+                    _, _, doc_id, page, content, table_data_json = meta[row]
+                    key = (content[:100], page)
+                    if key not in fused:
+                        fused[key] = [content, page, doc_id, table_data_json, content_type,
+                                      distance, 0.0, vectors[row]]
+                    entry = fused[key]
+                    entry[5] = min(entry[5], distance)
+                    entry[6] += 1.0 / (rrf_k + arm_rank)
+        return [tuple(entry) for entry in fused.values()]
+
+    # --- writing ----------------------------------------------------------
+
+    def _truncate(self, directory: Path, state: Dict):
+        """Cut files back to state['count'] rows, dropping the tail of an interrupted export"""
+        count, dim = state['count'], state['dim']
+        for name, row_bytes in (('vectors.f16', dim * 2), ('norms.f32', 4), ('kinds.i1', 1)):
+            path = self._path(name, directory)
+            if path.exists() and path.stat().st_size > count * row_bytes:
+                os.truncate(path, count * row_bytes)
+        meta_path = self._path('meta.jsonl', directory)
+        if meta_path.exists():
+            with open(meta_path, 'rb+') as f:
+                for _ in range(count):
+                    f.readline()
+                f.truncate(f.tell())
+
+    def _export(self, conn, directory: Path, state: Dict):
+        """Append every row newer than state['max_ids'] to the files in `directory`"""
+        with open(self._path('vectors.f16', directory), 'ab') as vectors_file, \
+                open(self._path('norms.f32', directory), 'ab') as norms_file, \
+                open(self._path('kinds.i1', directory), 'ab') as kinds_file, \
+                open(self._path('meta.jsonl', directory), 'a', encoding='utf-8') as meta_file:
+            for kind, (table, id_column, content_column, table_json, _) in SNAPSHOT_SOURCES.items():
+                after = state['max_ids'].get(table, 0)
+                # Server-side cursor: rows stream in batches instead of loading the whole table
+                cursor = conn.cursor(name=f"snapshot_export_{table}")
+                cursor.itersize = EXPORT_FETCH_ROWS
+                cursor.execute(f"""
+                    SELECT {id_column}, doc_id, page_number, {content_column}, {table_json}, embedding::text
+                    FROM {table}
+                    WHERE embedding IS NOT NULL AND {id_column} > %s
+                    ORDER BY {id_column}
+                """, (after,))
+                while True:
+                    rows = cursor.fetchmany(EXPORT_FETCH_ROWS)
+                    if not rows:
+                        break
+                    matrix = np.array([r[5].strip('[]').split(',') for r in rows], dtype=np.float32)
+                    state['dim'] = state['dim'] or matrix.shape[1]
+                    vectors_file.write(matrix.astype(np.float16).tobytes())
+                    norms_file.write(np.linalg.norm(matrix, axis=1).astype(np.float32).tobytes())
+                    kinds_file.write(np.full(len(rows), kind, dtype=np.int8).tobytes())
+                    for row_id, doc_id, page, content, table_data_json, _ in rows:
+                        meta_file.write(json.dumps([kind, row_id, doc_id, page, content or "", table_data_json]) + "\n")
+                    state['count'] += len(rows)
+                    state.setdefault('counts', {})[table] = state.get('counts', {}).get(table, 0) + len(rows)
+                    state['max_ids'][table] = rows[-1][0]
+                cursor.close()
+
+    def build(self, pool) -> Dict:
+        """Export a fresh snapshot and swap it in place of the current one"""
+        with self._writer_lock():
+            return self._build(pool)
+
+    def _build(self, pool) -> Dict:
+        staging = self.directory.with_name(self.directory.name + '.building')
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir(parents=True)
+        state = {'count': 0, 'dim': 0, 'max_ids': {}, 'counts': {}}
+        with pool.connection() as conn:
+            self._export(conn, staging, state)
+        self._write_state(state, staging)
+
+        previous = self.directory.with_name(self.directory.name + '.previous')
+        shutil.rmtree(previous, ignore_errors=True)
+        if self.directory.exists():
+            os.replace(self.directory, previous)
+        os.replace(staging, self.directory)
+        shutil.rmtree(previous, ignore_errors=True)
+        print(f" Vector snapshot built: {state['count']} rows in {self.directory}")
+        return state
+
+    def refresh(self, pool) -> Dict:
+        """
+        Bring the snapshot up to date: append rows inserted since the last export,
+        or rebuild if rows it contains were deleted (re-ingested pages).
+        """
+        with self._writer_lock():
+            state = self._read_state()
+            if state is None:
+                return self._build(pool)
+            if state['dim'] and state['dim'] != EMBEDDING_DIMENSIONS:
+                print(f" Embedding dimensions changed ({state['dim']} -> {EMBEDDING_DIMENSIONS}); rebuilding the vector snapshot")
+                return self._build(pool)
+
+            with pool.connection() as conn:
+                with conn.cursor() as cur:
+                    for table, id_column in ((t[0], t[1]) for t in SNAPSHOT_SOURCES.values()):
+                        cur.execute(f"SELECT count(*) FROM {table} WHERE embedding IS NOT NULL AND {id_column} <= %s",
+                                    (state['max_ids'].get(table, 0),))
+                        if cur.fetchone()[0] != state.get('counts', {}).get(table, 0):
+                            print(f" Rows were deleted from {table}; rebuilding the vector snapshot")
+                            return self._build(pool)
+
+                added = state['count']
+                self._truncate(self.directory, state)
+                self._export(conn, self.directory, state)
+                added = state['count'] - added
+
+            self._write_state(state)
+            print(f" Vector snapshot refreshed: +{added} rows ({state['count']} total)")
+            return state
+
+
+_snapshot: Optional[VectorSnapshot] = None
+_snapshot_lock = threading.Lock()
+
+
+def get_vector_snapshot() -> Optional[VectorSnapshot]:
+    """Process-wide snapshot when RAG_VECTOR_BACKEND=snapshot and one has been built, else None"""
+    global _snapshot
+    if not snapshot_enabled():
+        return None
+    with _snapshot_lock:
+        if _snapshot is None:
+            _snapshot = VectorSnapshot()
+            if not _snapshot.load():
+                print(f" No vector snapshot in {_snapshot.directory}; run `python vector_snapshot.py build`")
+    _snapshot.maybe_reload()
+    return _snapshot if _snapshot.size else None
+
+
+def main():
+    from db import get_pool
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'stats'
+    snapshot = VectorSnapshot()
+    if command == 'build':
+        snapshot.build(get_pool())
+    elif command == 'refresh':
+        snapshot.refresh(get_pool())
+    else:
+        state = snapshot._read_state()
+        print(json.dumps(state or {'count': 0}, indent=2))
+
+
+if __name__ == "__main__":
+    main()